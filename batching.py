@@ -0,0 +1,122 @@
+"""
+Purchase batching.
+
+Every order pays for a full elevator trip and grabber sequence however few
+pots it has. When purchases queue up while the machine is busy, the batcher
+merges them into one order: the instruction lists are concatenated into a
+single worm pass and all the pots go up in one elevator and grabber cycle.
+The merged order keeps each purchase as a separate part, so every order id
+still gets its own status updates.
+
+A purchase arriving while the machine has room is passed on straight away,
+so batching never delays an order on an idle machine.
+"""
+
+import collections
+import threading
+
+DEFAULT_MAX_ORDERS = 4  # Purchases merged into one elevator trip at most
+
+
+class PurchaseBatcher:
+    """
+    Merges waiting purchases before they reach an OrderScheduler.
+    """
+
+    def __init__(self, scheduler, max_orders=DEFAULT_MAX_ORDERS, max_instructions=None, max_waiting=None):
+        """
+        Args:
+            scheduler (OrderScheduler): Scheduler the merged orders go to.
+            max_orders (int): Purchases per merged order at most.
+            max_instructions (int): Worm rotations per merged order at most,
+                                    None for no limit. A single purchase
+                                    over the limit still runs on its own.
+            max_waiting (int): Purchases held before submit() blocks,
+                               default max_orders.
+        """
+        self.scheduler = scheduler
+        self.max_orders = max_orders
+        self.max_instructions = max_instructions
+        self.max_waiting = max_waiting or max_orders
+        self.pending = collections.deque()  # (order id, instructions)
+        self.submitting = 0  # purchases taken off pending and not yet in the scheduler
+        self.condition = threading.Condition()
+
+        self.orders = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+        self.thread = threading.Thread(target=self._run, name="purchase-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, instructions, order_id=None, timeout=None):
+        """
+        Queue a purchase, waiting while too many are already held.
+
+        Returns:
+            bool: True if queued, False on timeout.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.pending) < self.max_waiting, timeout):
+                return False
+            self.pending.append((order_id, instructions))
+            self.condition.notify_all()
+        return True
+
+    def _take(self):
+        # Called with the condition held. Oldest first, stopping at the first
+        # purchase that does not fit so orders are never reordered.
+        parts = [self.pending.popleft()]
+        count = len(parts[0][1])
+        while self.pending and len(parts) < self.max_orders:
+            order_id, instructions = self.pending[0]
+            if self.max_instructions is not None and count + len(instructions) > self.max_instructions:
+                break
+            parts.append(self.pending.popleft())
+            count += len(instructions)
+        return parts
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+            # Everything that arrives while the pipeline is full joins the next batch
+            self.scheduler.wait_room()
+            with self.condition:
+                parts = self._take()
+                self.orders += len(parts)
+                self.batches += 1
+                self.largest_batch = max(self.largest_batch, len(parts))
+                self.submitting = len(parts)
+                self.condition.notify_all()
+
+            instructions = [instruction for _, part in parts for instruction in part]
+            if len(parts) > 1:
+                print(f"Merged {len(parts)} purchases into one order: {[order_id for order_id, _ in parts]}")
+            try:
+                self.scheduler.submit(instructions, parts[0][0], parts=parts)
+            except Exception as e:
+                print(f"Error submitting merged order: {e}")
+            finally:
+                with self.condition:
+                    self.submitting = 0
+
+    def idle(self):
+        """True if no purchase is held here, waiting or on its way to the scheduler."""
+        with self.condition:
+            return not self.pending and not self.submitting
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Purchases waiting, purchases and merged orders submitted,
+                  and the largest and average batch size.
+        """
+        with self.condition:
+            return {
+                'waiting': len(self.pending),
+                'orders': self.orders,
+                'batches': self.batches,
+                'largest_batch': self.largest_batch,
+                'avg_batch': self.orders / self.batches if self.batches else 0.0,
+            }
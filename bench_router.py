@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: messages/sec through the TopicRouter against the original
+if/elif on_message function.
+
+Both paths decode, validate and emit the same message mix to a no-op emitter.
+Console output is discarded so the numbers measure routing, not printing.
+
+Usage: python bench_router.py [num_messages]
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from router import TopicRouter, NUMBER
+
+NUM_MESSAGES = 200000
+
+
+class CountingEmitter:
+    def __init__(self):
+        self.count = 0
+
+    def emit(self, event, *args):
+        self.count += 1
+
+
+def legacy_on_message(ee, msg):
+    """The original subscriber.on_message, emitting to `ee`."""
+    topic = msg.topic
+    if topic == "defarm/product/purchased":
+        try:
+            payload = json.loads(msg.payload.decode('utf-8'))
+            instructions = payload.get("instructions")
+
+            if not isinstance(instructions, list):
+                print("Received invalid instruction payload:", payload)
+                return
+
+            print("Received instruction sequence:", instructions)
+            ee.emit("purchase", instructions)
+        except Exception as e:
+            print("Error processing MQTT message:", e)
+    elif topic.startswith("defarm/remote/"):
+        try:
+            payload = json.loads(msg.payload.decode('utf-8'))
+            print("Received remote control command on {}: {}".format(topic, payload))
+            ee.emit(topic, payload)
+        except Exception as e:
+            print("Error processing remote MQTT message on topic {}: {}".format(topic, e))
+    else:
+        print("Received message on unexpected topic {}: {}".format(topic, msg.payload))
+
+
+def build_router(ee):
+    router = TopicRouter()
+
+    @router.route("defarm/product/purchased", schema={"instructions": [NUMBER]})
+    def on_purchase_message(topic, payload):
+        instructions = payload["instructions"]
+        print("Received instruction sequence:", instructions)
+        ee.emit("purchase", instructions)
+
+    @router.route("defarm/remote/#")
+    def on_remote_message(topic, payload):
+        print("Received remote control command on {}: {}".format(topic, payload))
+        ee.emit(topic, payload)
+
+    return router
+
+
+def build_messages(count):
+    """A mix of purchases, remote commands, invalid and oversized payloads."""
+    templates = [
+        ("defarm/product/purchased", json.dumps({"instructions": [2335, 2335, 2335]}).encode()),
+        ("defarm/remote/led", b'{"state": "on"}'),
+        ("defarm/remote/fan", b'{"state": "off"}'),
+        ("defarm/remote/main_pump", b'{"state": "on", "duration": 30}'),
+        ("defarm/product/purchased", b'{"instructions": "not a list"}'),
+        ("defarm/product/purchased", b'[' + b'1, ' * 4000 + b'1]'),
+        ("defarm/other", b'{}'),
+    ]
+    return [SimpleNamespace(topic=t, payload=p) for t, p in
+            (templates[i % len(templates)] for i in range(count))]
+
+
+def run(label, fn, messages):
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for msg in messages:
+            fn(msg)
+    elapsed = time.perf_counter() - start
+    rate = len(messages) / elapsed
+    print(f"{label:<10} {rate:>12,.0f} msg/s  ({elapsed:.3f} s for {len(messages)} messages)")
+    return rate
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_MESSAGES
+    messages = build_messages(count)
+
+    legacy_ee = CountingEmitter()
+    router_ee = CountingEmitter()
+    router = build_router(router_ee)
+
+    legacy_rate = run("legacy", lambda msg: legacy_on_message(legacy_ee, msg), messages)
+    router_rate = run("router", lambda msg: router.dispatch(msg.topic, msg.payload), messages)
+
+    print(f"emitted: legacy={legacy_ee.count} router={router_ee.count}")
+    print(f"speedup: {router_rate / legacy_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark: orders/hour of the pipelined order scheduler, with and
+without purchase batching, against the serial flow (one order end to end
+before the next), in simulated time.
+
+Stage durations are estimates: the grabber timings come from the sleeps in
+elevator.py, the rest should be measured on the machine and passed in. The
+pipeline only gains when the worm is on the critical path, so the benchmark
+is run for a range of instructions per order. Note that every order also
+runs a full elevator cycle alongside its worm rotations (as main.on_purchase
+always has), which keeps the elevator busy for most of the order.
+
+Usage: python bench_scheduler.py [--orders 20] [--instructions 1,2,4,8] [--worm 3.0] [--ascend 6.0] ...
+"""
+
+import argparse
+
+from scheduler import purchase_plan, simulate, DEFAULT_WORKERS
+
+# Seconds. grab is servo steps 1-8 (1 s each), release is the final step's 0.5 s.
+DEFAULT_DURATIONS = {
+    "worm": 3.0,      # per instruction
+    "ascend": 6.0,
+    "grab": 8.0,
+    "descend": 6.0,
+    "release": 0.5,
+}
+
+
+def print_timeline(timeline, orders=2):
+    for sequence, stage, start, end in timeline:
+        if sequence <= orders:
+            print(f"  order {sequence} {stage:<15} {start:>7.1f} -> {end:>7.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--orders", type=int, default=20, help="orders to simulate per run")
+    parser.add_argument("--instructions", default="1,2,4,8",
+                        help="comma separated worm instructions per order")
+    parser.add_argument("--in-flight", type=int, default=2, help="orders in the pipeline at once")
+    parser.add_argument("--batch", type=int, default=4,
+                        help="purchases merged into one order for the batched column")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="scheduler worker threads")
+    parser.add_argument("--timeline", action="store_true", help="print the first orders' stage timeline")
+    for name, seconds in DEFAULT_DURATIONS.items():
+        parser.add_argument(f"--{name}", type=float, default=seconds,
+                            help=f"seconds for {name}{' per instruction' if name == 'worm' else ''}")
+    args = parser.parse_args()
+
+    durations = {name: getattr(args, name) for name in DEFAULT_DURATIONS}
+    plan = purchase_plan(durations=durations)
+
+    print(f"{'instr':>6} {'serial/h':>10} {'pipelined/h':>12} {'gain':>7} {'batched/h':>10} {'gain':>7}")
+    for count in (int(n) for n in args.instructions.split(",")):
+        orders = [[2335] * count for _ in range(args.orders)]
+        serial = simulate(plan, orders, max_in_flight=1, workers=args.workers)
+        pipelined = simulate(plan, orders, max_in_flight=args.in_flight, workers=args.workers)
+        # A backlog of purchases merged the way batching.PurchaseBatcher would
+        merged = [sum(orders[i:i + args.batch], []) for i in range(0, len(orders), args.batch)]
+        batched = simulate(plan, merged, max_in_flight=args.in_flight, workers=args.workers)
+        batched_rate = len(orders) * 3600 / batched['seconds']
+        gain = pipelined['orders_per_hour'] / serial['orders_per_hour'] - 1
+        batch_gain = batched_rate / serial['orders_per_hour'] - 1
+        print(f"{count:>6} {serial['orders_per_hour']:>10.1f} {pipelined['orders_per_hour']:>12.1f} {gain:>+7.1%} "
+              f"{batched_rate:>10.1f} {batch_gain:>+7.1%}")
+        if args.timeline:
+            print_timeline(pipelined['timeline'])
+
+
+if __name__ == "__main__":
+    main()
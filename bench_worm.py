@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: CPU time and stop latency of Worm.rotate_degrees.
+
+Runs the real Worm against the simulator's worm and encoder model in real
+time and, for each rotation, measures:
+
+- the CPU time of the thread waiting for the rotation to finish, against
+  the time the rotation took;
+- the stop latency, from the encoder count reaching the count the power is
+  to be cut at (the target less the predicted coast) to the duty cycle
+  being set to 0 (0 when the speed controller made the stop, having moved
+  the stop count back past the count already reached);
+- the overshoot, the counts past the target once the worm has coasted to a
+  stop. Each rotation is counted from the last target, so the overshoot does
+  not add up over the rotations.
+
+The coast compensation starts from an empty calibration in a temporary
+file, so the overshoot of the first rotations shows it learning.
+
+Console output is discarded so the numbers measure the wait, not printing.
+The model's encoder updates come in 1 ms bursts of counts, so a stop is
+never seen less than one burst late.
+
+Usage: python bench_worm.py [--rotations 5] [--counts 2335] [--speed 60]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+from config import machine_config
+from simulator import (VirtualClock, Machine, fake_modules, WORM_ENABLE_PIN, WORM_IN1_PIN,
+                       WORM_IN2_PIN, ENCODER_A_PIN, ENCODER_B_PIN)
+
+COAST_TIME = 0.5  # Seconds allowed for the worm to coast to a stop after a rotation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rotations", type=int, default=5, help="rotations to time")
+    parser.add_argument("--counts", type=int, default=machine_config().worm.rotation_counts,
+                        help="encoder counts per rotation")
+    parser.add_argument("--speed", type=float, default=machine_config().worm.speed, help="PWM duty cycle")
+    args = parser.parse_args()
+
+    machine = Machine(VirtualClock(speedup=1.0))
+    sys.modules.update(fake_modules(machine))
+    from coast import CoastTable
+    from position import PositionStore
+    from worm import Worm
+
+    machine.start()
+    state_dir = tempfile.mkdtemp()
+    worm = Worm(WORM_ENABLE_PIN, WORM_IN1_PIN, WORM_IN2_PIN, ENCODER_A_PIN, ENCODER_B_PIN,
+                CoastTable(os.path.join(state_dir, "coast.db")),
+                PositionStore(os.path.join(state_dir, "worm_position.bin")))
+
+    # Timestamps of the stop count being reached and of the stop
+    marks = {}
+    count = worm.callback
+    set_speed = worm.set_speed
+
+    def timed_callback(way):
+        stop_at = worm.stop_at
+        if stop_at is not None and worm.encoder_position + way >= stop_at and "reached" not in marks:
+            marks["reached"] = time.perf_counter()
+        count(way)
+
+    def timed_set_speed(speed):
+        if speed == 0 and worm.stop_at is None and "stopped" not in marks:
+            marks["stopped"] = time.perf_counter()
+        set_speed(speed)
+
+    worm.callback = timed_callback
+    worm.set_speed = timed_set_speed
+
+    rows = []
+    quiet = open(os.devnull, "w")
+    for _ in range(args.rotations):
+        marks.clear()
+        with contextlib.redirect_stdout(quiet):
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+            worm.rotate_degrees(args.counts, args.speed)
+            cpu = time.thread_time() - cpu
+            wall = time.perf_counter() - wall
+        time.sleep(COAST_TIME)
+        rows.append((wall, cpu, marks["stopped"] - marks.get("reached", marks["stopped"]), worm.position - worm.goal))
+    machine.stop()
+
+    print(f"Worm.rotate_degrees, {args.rotations} rotations of {args.counts} counts at {args.speed:g}% duty")
+    print(f"{'rotation s':>11} {'CPU s':>8} {'CPU %':>6} {'stop latency ms':>16} {'overshoot':>10}")
+    for wall, cpu, latency, overshoot in rows:
+        print(f"{wall:>11.3f} {cpu:>8.3f} {100 * cpu / wall:>6.1f} {latency * 1000:>16.3f} {overshoot:>10}")
+    n = len(rows)
+    print(f"{'mean':>11} {sum(r[1] for r in rows) / n:>8.3f} "
+          f"{100 * sum(r[1] for r in rows) / sum(r[0] for r in rows):>6.1f} "
+          f"{1000 * sum(r[2] for r in rows) / n:>16.3f} {sum(r[3] for r in rows) / n:>10.1f}")
+    print(f"Absolute position {worm.position}, {worm.position - args.rotations * args.counts:+d} counts "
+          f"from {args.rotations} x {args.counts}")
+    print("Coast calibration:")
+    for velocity, counts, samples in worm.coast.table():
+        print(f"  {velocity:>6.0f} counts/s  {counts:6.1f} counts  ({samples} measurements)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Learned coast compensation for the worm.
+
+Once its power is cut the worm coasts on by a distance that grows with its
+speed and depends on its load. Every rotation records how far the worm
+coasted against the speed it was stopped at, and the next rotation cuts the
+power that many counts before the target, so it comes to rest on it.
+
+Coast distances are kept per speed bucket as a moving average, in memory so
+the encoder callback can look them up, and written through to an SQLite
+table so the calibration survives restarts. A speed with no measurement yet
+is predicted from the nearest bucket that has one, scaled by the speed, as
+the coast of a motor with friction is roughly proportional to its speed.
+"""
+
+import os
+import sqlite3
+import threading
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coast.db")
+BUCKET_WIDTH = 50.0  # Counts per second of speed sharing one calibration entry
+SMOOTHING = 0.3      # Weight of a new measurement in its bucket's moving average
+
+
+class CoastTable:
+    """
+    Coast distance of the worm per stopping speed.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        """
+        Args:
+            path (str): SQLite database file. Opened on first use.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        self.coasts = {}   # bucket -> (mean coast counts, measurements)
+
+    def _open(self):
+        """Open the database and load the calibration."""
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS coast "
+                        "(bucket INTEGER PRIMARY KEY, counts REAL NOT NULL, samples INTEGER NOT NULL)")
+        self.db.commit()
+        self.coasts = {bucket: (counts, samples)
+                       for bucket, counts, samples in self.db.execute("SELECT bucket, counts, samples FROM coast")}
+
+    def _ensure_open(self):
+        if self.db is None:
+            self._open()
+
+    def load(self):
+        """Load the calibration now rather than on the first rotation."""
+        with self.lock:
+            self._ensure_open()
+
+    def predict(self, velocity):
+        """
+        Args:
+            velocity (float): Speed the power is cut at, counts per second.
+
+        Returns:
+            float: Counts the worm is expected to coast, 0 with no calibration.
+        """
+        if velocity <= 0:
+            return 0.0
+        bucket = round(velocity / BUCKET_WIDTH)
+        coasts = self.coasts  # replaced, never changed in place, so safe to read without the lock
+        if bucket in coasts:
+            return coasts[bucket][0]
+        known = [b for b in coasts if b > 0]
+        if not known:
+            return 0.0
+        nearest = min(known, key=lambda b: abs(b - bucket))
+        return coasts[nearest][0] * velocity / (nearest * BUCKET_WIDTH)
+
+    def record(self, velocity, coast):
+        """
+        Add a measurement.
+
+        Args:
+            velocity (float): Speed the power was cut at, counts per second.
+            coast (int): Counts the worm turned after the power was cut.
+        """
+        bucket = round(velocity / BUCKET_WIDTH)
+        with self.lock:
+            self._ensure_open()
+            mean, samples = self.coasts.get(bucket, (coast, 0))
+            mean += SMOOTHING * (coast - mean)
+            coasts = dict(self.coasts)
+            coasts[bucket] = (mean, samples + 1)
+            self.coasts = coasts
+            self.db.execute("INSERT OR REPLACE INTO coast (bucket, counts, samples) VALUES (?, ?, ?)",
+                            (bucket, mean, samples + 1))
+            self.db.commit()
+
+    def table(self):
+        """
+        Returns:
+            list: (bucket speed in counts per second, mean coast counts,
+                  measurements), slowest first.
+        """
+        with self.lock:
+            self._ensure_open()
+            return [(bucket * BUCKET_WIDTH, counts, samples)
+                    for bucket, (counts, samples) in sorted(self.coasts.items())]
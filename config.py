@@ -0,0 +1,371 @@
+"""
+Machine configuration.
+
+Pins, motion parameters and the grabber's servo sequence live in one file,
+machine.toml (or the file named by MACHINE_CONFIG), which is parsed and
+validated once into an immutable MachineConfig. Every module reads its
+values through machine_config().
+
+The file can be edited on a running machine: watch() notices the change,
+validates the new file and swaps in a new MachineConfig with the new motion
+parameters, which each movement picks up when it starts. Wiring (pins, bus
+and driver settings) is only read at startup, so changes to it are reported
+and left for the next restart. A file that fails validation is reported and
+the running configuration is kept.
+"""
+
+import os
+import threading
+import time
+import tomllib
+from dataclasses import dataclass, fields, replace
+
+DEFAULT_CONFIG_PATH = os.getenv(
+    "MACHINE_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "machine.toml"))
+DEFAULT_WATCH_INTERVAL = 2.0  # Seconds between checks of the file for changes
+
+BCM_PINS = range(28)
+
+
+class ConfigError(ValueError):
+    """Raised when the configuration file is missing, unreadable or invalid."""
+
+
+@dataclass(frozen=True)
+class WormConfig:
+    enable_pin: int
+    in1_pin: int
+    in2_pin: int
+    encoder_a_pin: int
+    encoder_b_pin: int
+    pwm_frequency: float
+    rotation_counts: int
+    speed: float              # duty cycle limit
+    cruise_velocity: float    # counts per second
+    acceleration: float       # counts per second squared
+    creep_velocity: float     # counts per second
+    full_duty_velocity: float # counts per second at 100% duty, for the feed-forward
+    kp: float
+    ki: float
+    kd: float
+    control_period: float     # seconds
+    stall_window: float       # seconds
+    stall_retries: int
+    jiggle_duty: float
+    jiggle_time: float        # seconds
+
+    MOTION = ("speed", "cruise_velocity", "acceleration", "creep_velocity", "full_duty_velocity",
+              "kp", "ki", "kd", "control_period", "stall_window", "stall_retries", "jiggle_duty", "jiggle_time")
+
+
+@dataclass(frozen=True)
+class ElevatorConfig:
+    dir_pin: int
+    pul_pin: int
+    pulses_per_rev: int
+    i2c_bus: int
+    sensor_address: int
+    step_delay: float
+    step_increment: int
+    distance_threshold: float
+
+    MOTION = ("step_delay", "step_increment", "distance_threshold")
+
+
+@dataclass(frozen=True)
+class GrabberConfig:
+    pins: tuple
+    pwm_frequency: float
+    move_time: float
+    step_pause: float
+    sequence: tuple  # of steps, each a tuple of (servo index, angle) moves
+    release: tuple   # (servo index, angle) moves
+
+    MOTION = ("move_time", "step_pause", "sequence", "release")
+
+
+@dataclass(frozen=True)
+class OutputsConfig:
+    # None for an output with no pin configured; it is never driven
+    main_pump: int
+    drain_pump: int
+    peristaltic_pump: int
+    led: int
+    fan: int
+    active_low: bool
+
+    MOTION = ()
+    NAMES = ("main_pump", "drain_pump", "peristaltic_pump", "led", "fan")
+
+    def configured(self):
+        """Outputs with a pin, name -> BCM pin."""
+        return {name: getattr(self, name) for name in self.NAMES if getattr(self, name) is not None}
+
+
+@dataclass(frozen=True)
+class DHT11Config:
+    pins: tuple  # one per sensor, sensor 1 first; empty for none
+
+    MOTION = ()
+
+
+@dataclass(frozen=True)
+class MachineConfig:
+    worm: WormConfig
+    elevator: ElevatorConfig
+    grabber: GrabberConfig
+    outputs: OutputsConfig
+    dht11: DHT11Config
+    path: str = None
+
+    SECTIONS = {"worm": WormConfig, "elevator": ElevatorConfig, "grabber": GrabberConfig,
+                "outputs": OutputsConfig, "dht11": DHT11Config}
+
+    def pins(self):
+        """Output and input pins in use, name -> BCM pin."""
+        used = {f"worm.{name}": getattr(self.worm, name)
+                for name in ("enable_pin", "in1_pin", "in2_pin", "encoder_a_pin", "encoder_b_pin")}
+        used.update({f"elevator.{name}": getattr(self.elevator, name) for name in ("dir_pin", "pul_pin")})
+        used.update({f"grabber.pins[{i}]": pin for i, pin in enumerate(self.grabber.pins)})
+        used.update({f"outputs.{name}": pin for name, pin in self.outputs.configured().items()})
+        used.update({f"dht11.pins[{i}]": pin for i, pin in enumerate(self.dht11.pins)})
+        return used
+
+
+def _number(section, data, name, kind=float, minimum=None, maximum=None):
+    key = f"{section}.{name}"
+    if name not in data:
+        raise ConfigError(f"{key} is missing")
+    value = data[name]
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and not isinstance(value, int)):
+        raise ConfigError(f"{key} must be {'an integer' if kind is int else 'a number'}, got {value!r}")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ConfigError(f"{key} must be between {minimum} and {maximum}, got {value}")
+    return kind(value)
+
+
+def _pin(section, data, name):
+    return _number(section, data, name, int, BCM_PINS.start, BCM_PINS.stop - 1)
+
+
+def _moves(key, value, servos):
+    if not isinstance(value, list) or not value:
+        raise ConfigError(f"{key} must be a non-empty list of [servo index, angle] moves")
+    moves = []
+    for i, move in enumerate(value):
+        if (not isinstance(move, list) or len(move) != 2 or not isinstance(move[0], int)
+                or isinstance(move[1], bool) or not isinstance(move[1], (int, float))):
+            raise ConfigError(f"{key}[{i}] must be [servo index, angle], got {move!r}")
+        servo, angle = move
+        if not 0 <= servo < servos:
+            raise ConfigError(f"{key}[{i}] names servo index {servo}, there are {servos} servos")
+        if not 0 <= angle <= 180:
+            raise ConfigError(f"{key}[{i}] angle must be between 0 and 180, got {angle}")
+        moves.append((servo, float(angle)))
+    return tuple(moves)
+
+
+def parse(data, path=None):
+    """
+    Validate parsed TOML and build a MachineConfig.
+
+    Raises:
+        ConfigError: Naming the first invalid or missing key.
+    """
+    for section in MachineConfig.SECTIONS:
+        if not isinstance(data.get(section), dict):
+            raise ConfigError(f"[{section}] section is missing")
+        unknown = set(data[section]) - {field.name for field in fields(MachineConfig.SECTIONS[section])}
+        if unknown:
+            raise ConfigError(f"unknown keys in [{section}]: {', '.join(sorted(unknown))}")
+
+    w = data["worm"]
+    worm = WormConfig(
+        enable_pin=_pin("worm", w, "enable_pin"),
+        in1_pin=_pin("worm", w, "in1_pin"),
+        in2_pin=_pin("worm", w, "in2_pin"),
+        encoder_a_pin=_pin("worm", w, "encoder_a_pin"),
+        encoder_b_pin=_pin("worm", w, "encoder_b_pin"),
+        pwm_frequency=_number("worm", w, "pwm_frequency", minimum=1),
+        rotation_counts=_number("worm", w, "rotation_counts", int, minimum=1),
+        speed=_number("worm", w, "speed", minimum=1, maximum=100),
+        cruise_velocity=_number("worm", w, "cruise_velocity", minimum=1),
+        acceleration=_number("worm", w, "acceleration", minimum=1),
+        creep_velocity=_number("worm", w, "creep_velocity", minimum=1),
+        full_duty_velocity=_number("worm", w, "full_duty_velocity", minimum=1),
+        kp=_number("worm", w, "kp", minimum=0),
+        ki=_number("worm", w, "ki", minimum=0),
+        kd=_number("worm", w, "kd", minimum=0),
+        control_period=_number("worm", w, "control_period", minimum=0.001, maximum=0.5),
+        stall_window=_number("worm", w, "stall_window", minimum=0.05, maximum=10),
+        stall_retries=_number("worm", w, "stall_retries", int, minimum=0, maximum=10),
+        jiggle_duty=_number("worm", w, "jiggle_duty", minimum=1, maximum=100),
+        jiggle_time=_number("worm", w, "jiggle_time", minimum=0.01, maximum=5),
+    )
+    if worm.creep_velocity > worm.cruise_velocity:
+        raise ConfigError(f"worm.creep_velocity must not be above worm.cruise_velocity, "
+                          f"got {worm.creep_velocity} > {worm.cruise_velocity}")
+
+    e = data["elevator"]
+    elevator = ElevatorConfig(
+        dir_pin=_pin("elevator", e, "dir_pin"),
+        pul_pin=_pin("elevator", e, "pul_pin"),
+        pulses_per_rev=_number("elevator", e, "pulses_per_rev", int, minimum=1),
+        i2c_bus=_number("elevator", e, "i2c_bus", int, minimum=0),
+        sensor_address=_number("elevator", e, "sensor_address", int, 0x03, 0x77),
+        step_delay=_number("elevator", e, "step_delay", minimum=0.00001, maximum=0.1),
+        step_increment=_number("elevator", e, "step_increment", int, minimum=1),
+        distance_threshold=_number("elevator", e, "distance_threshold", minimum=1, maximum=2000),
+    )
+
+    g = data["grabber"]
+    pins = g.get("pins")
+    if not isinstance(pins, list) or not pins:
+        raise ConfigError("grabber.pins must be a non-empty list of pins")
+    pins = tuple(_pin("grabber", {f"pins[{i}]": pin}, f"pins[{i}]") for i, pin in enumerate(pins))
+    sequence = g.get("sequence")
+    if not isinstance(sequence, list) or not sequence:
+        raise ConfigError("grabber.sequence must be a non-empty list of steps")
+    if "release" not in g:
+        raise ConfigError("grabber.release is missing")
+    grabber = GrabberConfig(
+        pins=pins,
+        pwm_frequency=_number("grabber", g, "pwm_frequency", minimum=1),
+        move_time=_number("grabber", g, "move_time", minimum=0),
+        step_pause=_number("grabber", g, "step_pause", minimum=0),
+        sequence=tuple(_moves(f"grabber.sequence[{i}]", step, len(pins)) for i, step in enumerate(sequence)),
+        release=_moves("grabber.release", g["release"], len(pins)),
+    )
+
+    o = data["outputs"]
+    if not isinstance(o.get("active_low"), bool):
+        raise ConfigError("outputs.active_low must be true or false")
+    outputs = OutputsConfig(**{name: _pin("outputs", o, name) if name in o else None
+                               for name in OutputsConfig.NAMES},
+                            active_low=o["active_low"])
+
+    d = data["dht11"]
+    pins = d.get("pins")
+    if not isinstance(pins, list):
+        raise ConfigError("dht11.pins must be a list of pins")
+    dht11 = DHT11Config(pins=tuple(_pin("dht11", {f"pins[{i}]": pin}, f"pins[{i}]") for i, pin in enumerate(pins)))
+
+    config = MachineConfig(worm, elevator, grabber, outputs, dht11, path)
+    seen = {}
+    for name, pin in config.pins().items():
+        if pin in seen:
+            raise ConfigError(f"{name} and {seen[pin]} are both on pin {pin}")
+        seen[pin] = name
+    return config
+
+
+def load(path=DEFAULT_CONFIG_PATH):
+    """
+    Read and validate a configuration file.
+
+    Raises:
+        ConfigError: If the file cannot be read or is invalid.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        raise ConfigError(f"cannot read {path}: {e}") from e
+    return parse(data, path)
+
+
+_lock = threading.Lock()
+_config = None
+_mtime = None
+_watcher = None
+
+
+def machine_config():
+    """
+    The current configuration, loaded from DEFAULT_CONFIG_PATH on first use.
+
+    Read it at the start of each movement rather than keeping it, so motion
+    parameters reloaded by watch() take effect.
+    """
+    global _config, _mtime
+    config = _config
+    if config is None:
+        with _lock:
+            if _config is None:
+                _mtime = _modified(DEFAULT_CONFIG_PATH)
+                _config = load(DEFAULT_CONFIG_PATH)
+            config = _config
+    return config
+
+
+def _modified(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _changes(old, new):
+    # (section.key, old value, new value) for every key that differs
+    return [(f"{section}.{field.name}", getattr(getattr(old, section), field.name),
+             getattr(getattr(new, section), field.name))
+            for section, cls in MachineConfig.SECTIONS.items() for field in fields(cls)
+            if getattr(getattr(old, section), field.name) != getattr(getattr(new, section), field.name)]
+
+
+def reload(path=None):
+    """
+    Re-read the configuration and apply its motion parameters.
+
+    Returns:
+        list: (key, old value, new value) of the parameters applied.
+
+    Raises:
+        ConfigError: If the file is invalid; the current configuration is kept.
+    """
+    global _config, _mtime
+    current = machine_config()
+    path = path or current.path
+    mtime = _modified(path)
+    new = load(path)
+    with _lock:
+        current = _config
+        applied, ignored = [], []
+        for change in _changes(current, new):
+            section, key = change[0].split(".")
+            (applied if key in MachineConfig.SECTIONS[section].MOTION else ignored).append(change)
+        if ignored:
+            print(f"Config: restart to apply {', '.join(key for key, _, _ in ignored)}")
+        _config = replace(current, **{
+            section: replace(getattr(current, section), **{
+                field: getattr(getattr(new, section), field) for field in cls.MOTION})
+            for section, cls in MachineConfig.SECTIONS.items()})
+        _mtime = mtime
+    for key, old, value in applied:
+        print(f"Config: {key} {old} -> {value}")
+    return applied
+
+
+def watch(interval=DEFAULT_WATCH_INTERVAL):
+    """Start a background thread reloading the configuration whenever its file changes."""
+    global _watcher
+    machine_config()
+    with _lock:
+        if _watcher is not None:
+            return
+        _watcher = threading.Thread(target=_watch, args=(interval,), name="config-watcher", daemon=True)
+        _watcher.start()
+
+
+def _watch(interval):
+    global _mtime
+    while True:
+        time.sleep(interval)
+        if _modified(_config.path) == _mtime:
+            continue
+        try:
+            reload()
+        except ConfigError as e:
+            print(f"Config: keeping the running configuration, {e}")
+            with _lock:
+                _mtime = _modified(_config.path)  # tried again once the file changes again
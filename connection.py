@@ -0,0 +1,216 @@
+"""
+MQTT connection manager.
+
+Runs the paho network loop in its own thread (loop_start) and keeps the client
+connected: failed connects and dropped connections are retried with paho's
+exponential reconnect backoff, instead of the subscriber giving up after the
+first error. Listeners are told about every state change, and the manager
+keeps metrics on reconnects and messages lost while the link was down.
+"""
+
+import threading
+import time
+
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+STOPPED = "stopped"
+
+DEFAULT_KEEPALIVE = 60
+DEFAULT_CONNECT_TIMEOUT = 10.0  # Seconds to wait for the TCP/TLS connect and CONNACK
+DEFAULT_MIN_RECONNECT_DELAY = 1
+DEFAULT_MAX_RECONNECT_DELAY = 120
+
+
+class ConnectionManager:
+    """
+    Keeps a paho client connected in the background.
+
+    The client's own on_connect, on_disconnect and on_message callbacks are
+    wrapped, so they must be set before the manager is created.
+    """
+
+    def __init__(self, client, host, port, keepalive=DEFAULT_KEEPALIVE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 min_reconnect_delay=DEFAULT_MIN_RECONNECT_DELAY,
+                 max_reconnect_delay=DEFAULT_MAX_RECONNECT_DELAY, connect_options=None):
+        """
+        Args:
+            client (mqtt.Client): Configured client, not yet connected.
+            host (str): Broker host.
+            port (int): Broker port.
+            keepalive (int): MQTT keepalive in seconds.
+            connect_timeout (float): Seconds before a connect attempt is abandoned.
+            min_reconnect_delay (int): First retry delay in seconds, doubled after each failure.
+            max_reconnect_delay (int): Upper bound on the retry delay in seconds.
+            connect_options (dict): Extra keyword arguments for connect_async,
+                                    e.g. clean_start and properties for MQTT v5.
+        """
+        self.client = client
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.connect_options = connect_options or {}
+
+        self.state = DISCONNECTED
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.connected_event = threading.Event()
+        self.stopped_event = threading.Event()
+
+        # Metrics
+        self.connect_count = 0
+        self.reconnect_count = 0
+        self.disconnected_at = None
+        self.last_reconnect_seconds = None
+        self.total_downtime = 0.0
+        self.sessions_lost = 0
+        self.messages_received = 0
+        self.messages_redelivered = 0
+        self.publishes_dropped = 0
+
+        client.connect_timeout = connect_timeout
+        client.reconnect_delay_set(min_reconnect_delay, max_reconnect_delay)
+
+        self._user_on_connect = client.on_connect
+        self._user_on_disconnect = client.on_disconnect
+        self._user_on_message = client.on_message
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_message = self._on_message
+
+    def add_state_listener(self, listener):
+        """
+        Register a function called as listener(state, manager) on every state change.
+        """
+        self.listeners.append(listener)
+
+    def _set_state(self, state):
+        with self.lock:
+            if state == self.state:
+                return
+            self.state = state
+        for listener in list(self.listeners):
+            try:
+                listener(state, self)
+            except Exception as e:
+                print(f"Error in connection state listener: {e}")
+
+    # MQTT v5 clients pass an extra properties argument to these callbacks
+    def _on_connect(self, client, userdata, flags, rc, *properties):
+        if rc != 0:
+            print(f"Broker refused connection, result code {rc}; retrying")
+            if self._user_on_connect:
+                self._user_on_connect(client, userdata, flags, rc, *properties)
+            return
+
+        with self.lock:
+            self.connect_count += 1
+            if self.disconnected_at is not None:
+                self.reconnect_count += 1
+                self.last_reconnect_seconds = time.monotonic() - self.disconnected_at
+                self.total_downtime += self.last_reconnect_seconds
+                self.disconnected_at = None
+                # Without the old session, anything the broker queued for us during
+                # the outage is gone
+                if not flags.get('session present'):
+                    self.sessions_lost += 1
+
+        self.connected_event.set()
+        if self._user_on_connect:
+            self._user_on_connect(client, userdata, flags, rc, *properties)
+        self._set_state(CONNECTED)
+
+    def _on_disconnect(self, client, userdata, rc, *properties):
+        self.connected_event.clear()
+        with self.lock:
+            if self.disconnected_at is None:
+                self.disconnected_at = time.monotonic()
+        if self._user_on_disconnect:
+            self._user_on_disconnect(client, userdata, rc, *properties)
+
+        if self.stopped_event.is_set():
+            self._set_state(STOPPED)
+        else:
+            print(f"Disconnected from MQTT broker (rc={rc}), reconnecting...")
+            self._set_state(CONNECTING)
+
+    def _on_message(self, client, userdata, msg):
+        with self.lock:
+            self.messages_received += 1
+            if msg.dup:
+                self.messages_redelivered += 1
+        if self._user_on_message:
+            self._user_on_message(client, userdata, msg)
+
+    def start(self):
+        """Start connecting in the background. Returns immediately."""
+        print(f"Connecting to MQTT broker at {self.host}:{self.port}...")
+        self.stopped_event.clear()
+        with self.lock:
+            self.disconnected_at = None
+        self._set_state(CONNECTING)
+        self.client.connect_async(self.host, self.port, self.keepalive, **self.connect_options)
+        self.client.loop_start()
+
+    def wait_connected(self, timeout=None):
+        """
+        Block until the client is connected.
+
+        Returns:
+            bool: True if connected, False on timeout.
+        """
+        return self.connected_event.wait(timeout)
+
+    def wait(self):
+        """Block until stop() is called."""
+        while not self.stopped_event.wait(1):
+            pass
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """
+        Publish through the managed client.
+
+        QoS 0 messages published while disconnected are dropped and counted.
+
+        Returns:
+            bool: True if the message was queued for sending.
+        """
+        if not self.connected_event.is_set() and qos == 0:
+            with self.lock:
+                self.publishes_dropped += 1
+            return False
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        return info.rc == 0
+
+    def stop(self):
+        """Disconnect and stop the network thread."""
+        self.stopped_event.set()
+        self.client.disconnect()
+        self.client.loop_stop()
+        self._set_state(STOPPED)
+
+    def metrics(self):
+        """
+        Get a snapshot of connection metrics.
+
+        Returns:
+            dict: Connection state, reconnect count, last and total time spent
+                  reconnecting (seconds), and counts of lost sessions,
+                  redelivered messages and dropped publishes.
+        """
+        with self.lock:
+            downtime = self.total_downtime
+            if self.disconnected_at is not None and self.connect_count:
+                downtime += time.monotonic() - self.disconnected_at
+            return {
+                'state': self.state,
+                'connects': self.connect_count,
+                'reconnects': self.reconnect_count,
+                'last_reconnect_seconds': self.last_reconnect_seconds,
+                'total_downtime': downtime,
+                'sessions_lost': self.sessions_lost,
+                'messages_received': self.messages_received,
+                'messages_redelivered': self.messages_redelivered,
+                'publishes_dropped': self.publishes_dropped,
+            }
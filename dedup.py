@@ -0,0 +1,148 @@
+"""
+Order-id dedup index for at-least-once purchase delivery.
+
+With QoS 1 and a persistent session the broker may deliver the same purchase
+more than once. Every order id we accepted is kept in an in-memory LRU for O(1)
+checks of recent orders and in an SQLite table so redeliveries are still caught
+after a restart.
+
+Ids are stored as JSON, so the number 5 and the string "5" are different
+orders.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "orders.db")
+DEFAULT_CAPACITY = 4096             # Order ids kept in memory
+DEFAULT_RETENTION = 7 * 24 * 3600   # Seconds an order id is remembered on disk
+SCHEMA_VERSION = 1                  # 1: order ids stored as JSON instead of str()
+
+
+def _key(order_id):
+    return json.dumps(order_id)
+
+
+class DedupIndex:
+    """
+    Remembers which order ids have already been accepted.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, capacity=DEFAULT_CAPACITY, retention=DEFAULT_RETENTION):
+        """
+        Args:
+            path (str): SQLite database file. Opened on first use.
+            capacity (int): Number of recent order ids kept in the in-memory LRU.
+            retention (float): Seconds after which order ids are pruned from disk.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.retention = retention
+        self.recent = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+    def _open(self):
+        """Open the database, prune expired ids and warm the LRU."""
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS seen_orders (order_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._migrate()
+        self.db.execute("DELETE FROM seen_orders WHERE seen_at < ?", (time.time() - self.retention,))
+        self.db.commit()
+
+        rows = self.db.execute(
+            "SELECT order_id FROM seen_orders ORDER BY seen_at DESC LIMIT ?", (self.capacity,)).fetchall()
+        for (order_id,) in reversed(rows):
+            self.recent[order_id] = True
+
+    def _migrate(self):
+        """Rewrite ids saved with str() as JSON keys."""
+        rows = self.db.execute("SELECT order_id, seen_at FROM seen_orders").fetchall()
+        keys = []
+        for order_id, seen_at in rows:
+            keys.append((_key(order_id), seen_at))
+            # "5" may have been the number 5; keep catching redeliveries of either
+            try:
+                if str(int(order_id)) == order_id:
+                    keys.append((_key(int(order_id)), seen_at))
+            except ValueError:
+                pass
+        self.db.execute("DELETE FROM seen_orders")
+        self.db.executemany("INSERT OR IGNORE INTO seen_orders (order_id, seen_at) VALUES (?, ?)", keys)
+        self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.commit()
+
+    def _remember(self, order_id):
+        self.recent[order_id] = True
+        self.recent.move_to_end(order_id)
+        if len(self.recent) > self.capacity:
+            self.recent.popitem(last=False)
+
+    def seen(self, order_id):
+        """
+        Check whether an order id was already accepted.
+
+        Args:
+            order_id (str or int): Order id from the purchase payload.
+
+        Returns:
+            bool: True if this order is a duplicate.
+        """
+        order_id = _key(order_id)
+        with self.lock:
+            if self.db is None:
+                self._open()
+
+            if order_id in self.recent:
+                self.hits += 1
+                self.duplicates += 1
+                self.recent.move_to_end(order_id)
+                return True
+
+            self.misses += 1
+            row = self.db.execute("SELECT 1 FROM seen_orders WHERE order_id = ?", (order_id,)).fetchone()
+            if row is not None:
+                self.duplicates += 1
+                self._remember(order_id)
+                return True
+            return False
+
+    def add(self, order_id):
+        """Record an order id as accepted, in memory and on disk."""
+        order_id = _key(order_id)
+        with self.lock:
+            if self.db is None:
+                self._open()
+            self.db.execute("INSERT OR IGNORE INTO seen_orders (order_id, seen_at) VALUES (?, ?)",
+                            (order_id, time.time()))
+            self.db.commit()
+            self._remember(order_id)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: LRU hits, disk lookups (misses) and duplicates rejected.
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'duplicates': self.duplicates,
+                'cached': len(self.recent),
+            }
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
@@ -0,0 +1,148 @@
+"""
+Device state table for the switched outputs (pumps, LED, fan).
+
+Remote commands set the desired state of an output; the table compares it
+with the state last written to the pin and only writes when they differ, so
+repeated "on" commands and retained messages replayed on reconnect cost no
+GPIO writes. A timed command ("on for 30 s") schedules its switch-off on a
+shared TimerWheel; a newer command for the same output replaces the timer.
+"""
+
+import threading
+
+import RPi.GPIO as GPIO
+
+from timer_wheel import TimerWheel
+
+ON_STATES = {"on", "true", "1", "start", "open"}
+OFF_STATES = {"off", "false", "0", "stop", "close"}
+
+
+def parse_switch(payload):
+    """
+    Read an on/off command.
+
+    Accepts {"state": "on", "duration": 30}, {"state": true} or a bare
+    "on"/"off"/true/false/1/0.
+
+    Returns:
+        tuple: (on, duration seconds or None).
+
+    Raises:
+        ValueError: If the payload is not an on/off command.
+    """
+    duration = None
+    state = payload
+    if isinstance(payload, dict):
+        state = payload.get("state")
+        duration = payload.get("duration")
+        if duration is not None:
+            if isinstance(duration, bool) or not isinstance(duration, (int, float)) or duration <= 0:
+                raise ValueError(f"duration must be a positive number of seconds, got {duration!r}")
+    key = str(state).strip().lower()
+    if key not in ON_STATES | OFF_STATES:
+        raise ValueError(f"state must be on or off, got {state!r}")
+    return key in ON_STATES, duration
+
+
+class DeviceTable:
+    """
+    Desired and applied state of named on/off outputs.
+    """
+
+    def __init__(self, pins, active_low=False, wheel=None, write=None):
+        """
+        Args:
+            pins (dict): Output name -> BCM pin.
+            active_low (bool): True if an output is on when its pin is low.
+            wheel (TimerWheel): Runs the switch-offs of timed commands,
+                                default a new one.
+            write (callable): write(pin, level), default GPIO.output.
+        """
+        self.pins = dict(pins)
+        self.active_low = active_low
+        self.wheel = wheel or TimerWheel()
+        self.write = write or GPIO.output
+        self.lock = threading.Lock()
+        self.desired = {}   # name -> bool
+        self.applied = {}   # name -> bool, missing until first written
+        self.timers = {}    # name -> Timer switching the output off
+
+        self.writes = 0
+        self.skipped = 0
+
+    def setup(self):
+        """Configure the pins as outputs and switch everything off."""
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        for name, pin in self.pins.items():
+            GPIO.setup(pin, GPIO.OUT)
+            self.set(name, False)
+
+    def set(self, name, on, duration=None):
+        """
+        Set the desired state of an output and apply it.
+
+        Args:
+            name (str): Output name.
+            on (bool): Desired state.
+            duration (float): Seconds after which an output switched on is
+                              switched off again. None keeps it on.
+
+        Returns:
+            bool: True if the pin was written, False if it was already in
+                  that state.
+
+        Raises:
+            KeyError: If there is no output of that name.
+        """
+        if name not in self.pins:
+            raise KeyError(f"no output named {name}")
+        with self.lock:
+            timer = self.timers.pop(name, None)
+            if timer is not None:
+                self.wheel.cancel(timer)
+            self.desired[name] = on
+            if on and duration:
+                self.timers[name] = self.wheel.schedule(duration, self._expire, name)
+            return self._apply(name)
+
+    def _expire(self, name):
+        # On the wheel's thread. The timer may have been replaced meanwhile.
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None or not timer.fired:
+                return
+            del self.timers[name]
+            self.desired[name] = False
+            self._apply(name)
+        print(f"Timed command ended, {name} off")
+
+    def _apply(self, name):
+        # Called with the lock held
+        on = self.desired[name]
+        if self.applied.get(name) == on:
+            self.skipped += 1
+            return False
+        self.write(self.pins[name], GPIO.LOW if on == self.active_low else GPIO.HIGH)
+        self.applied[name] = on
+        self.writes += 1
+        return True
+
+    def state(self):
+        """
+        Returns:
+            dict: Output name -> {'on': applied state, 'timed': bool}.
+        """
+        with self.lock:
+            return {name: {'on': self.applied.get(name, False), 'timed': name in self.timers}
+                    for name in self.pins}
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Pin writes made and skipped as redundant, and the timer
+                  wheel's metrics.
+        """
+        with self.lock:
+            return {'writes': self.writes, 'skipped': self.skipped, 'timers': self.wheel.metrics()}
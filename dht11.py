@@ -1,8 +1,9 @@
 import time
-import board
-import adafruit_dht
 import threading
-import requests  # Import requests to perform HTTP POST
+from config import machine_config
+
+# board, adafruit_dht and requests are imported where they are first used:
+# importing them probes the hardware and takes a noticeable part of startup
 
 class DHT11Monitor:
     """
@@ -15,10 +16,13 @@ class DHT11Monitor:
         
         Args:
             pin_list (list): List of board pins to connect to DHT11 sensors.
-                             Default is [board.D19, board.D26] if None is provided.
+                             Default is the dht11.pins in machine.toml if None is provided.
         """
+        import board
+        import adafruit_dht
+
         if pin_list is None:
-            pin_list = [board.D19, board.D26]
+            pin_list = [getattr(board, f"D{pin}") for pin in machine_config().dht11.pins]
         
         self.sensors = []
         for pin in pin_list:
@@ -88,6 +92,7 @@ class DHT11Monitor:
         }
         
         try:
+            import requests  # Import requests to perform HTTP POST
             response = requests.post("http://18.142.255.27:82/data", json=payload, timeout=5)
             # Optionally, you can print the status or response text for debugging:
             print("HTTP POST Response:", response.status_code, response.text)
@@ -135,9 +140,10 @@ class DHT11Monitor:
             print_values (bool): Whether to print readings to console.
             
         Returns:
-            bool: True if monitoring was started, False if already running.
+            bool: True if monitoring was started, False if already running
+                  or there are no sensors.
         """
-        if self.running:
+        if self.running or not self.sensors:
             return False
         
         self.monitor_thread = threading.Thread(
@@ -204,25 +210,36 @@ class DHT11Monitor:
             except:
                 pass
 
-# Create a global instance for easy importing
-monitor = DHT11Monitor()
+# Global instance for easy importing, created by init_monitor() or the first
+# helper call rather than at import time
+monitor = None
+_monitor_lock = threading.Lock()
+
+def init_monitor(pin_list=None):
+    """Create the global monitor instance if it does not exist yet, and return it."""
+    global monitor
+    with _monitor_lock:
+        if monitor is None:
+            monitor = DHT11Monitor(pin_list)
+        return monitor
 
 # Helper functions for simple usage
 def start_monitoring(interval=3.0, print_values=False):
     """Start DHT monitoring with the global instance."""
-    return monitor.start(interval, print_values)
+    return init_monitor().start(interval, print_values)
 
 def get_temperature(sensor_id=1):
     """Get temperature from the global monitor instance."""
-    return monitor.get_temperature(sensor_id)
+    return monitor.get_temperature(sensor_id) if monitor else None
 
 def get_humidity(sensor_id=1):
     """Get humidity from the global monitor instance."""
-    return monitor.get_humidity(sensor_id)
+    return monitor.get_humidity(sensor_id) if monitor else None
 
 def cleanup():
     """Clean up the global monitor instance."""
-    monitor.cleanup()
+    if monitor:
+        monitor.cleanup()
 
 # Example direct usage
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+"""
+Dispatch layer between the MQTT network thread and the event handlers.
+
+paho runs on_message on its network thread, so anything slow done there stops
+keepalives and the delivery of every other message. The Dispatcher hands each
+event to a long-lived worker lane instead. There is one ordered lane per
+actuator, so commands for the same hardware never overtake each other while
+independent hardware (LED, fan, pumps) keeps working during a dispense cycle,
+and one shared lane for everything else.
+"""
+
+import queue
+import threading
+import time
+
+# Maximum number of events waiting on a single lane before new ones are rejected
+DEFAULT_LANE_CAPACITY = 8
+
+# Events that drive the worm, elevator or grabber share one lane so a remote
+# command can never move those motors in the middle of a purchase. The pumps,
+# LED and fan each get a lane of their own. Any other event, e.g. a remote
+# topic nothing handles, goes to one shared lane, so arbitrary topic names
+# can never start more threads.
+DISPENSE_LANE = "dispense"
+DEFAULT_LANE = "default"
+LANE_FOR_EVENT = {
+    "purchase": DISPENSE_LANE,
+    "defarm/remote/elevator": DISPENSE_LANE,
+    "defarm/remote/worm": DISPENSE_LANE,
+    "defarm/remote/grabber": DISPENSE_LANE,
+    "defarm/remote/main_pump": "main_pump",
+    "defarm/remote/drain_pump": "drain_pump",
+    "defarm/remote/peristaltic_pump": "peristaltic_pump",
+    "defarm/remote/led": "led",
+    "defarm/remote/fan": "fan",
+}
+
+# Commands that set the state of an actuator. When several are queued for the
+# same actuator only the latest is applied; the earlier ones are skipped.
+COALESCED_EVENTS = {
+    "defarm/remote/main_pump",
+    "defarm/remote/drain_pump",
+    "defarm/remote/peristaltic_pump",
+    "defarm/remote/led",
+    "defarm/remote/fan",
+}
+
+_STOP = object()
+
+
+class Lane:
+    """
+    A single worker thread draining a bounded FIFO queue.
+    """
+
+    def __init__(self, name, capacity=DEFAULT_LANE_CAPACITY):
+        """
+        Start the worker thread for a lane.
+
+        Args:
+            name (str): Lane name, used in log messages and metrics.
+            capacity (int): Maximum number of queued (not yet running) items.
+        """
+        self.name = name
+        self.queue = queue.Queue(maxsize=capacity)
+        self.lock = threading.Lock()
+
+        self.latest = {}  # coalescing key -> sequence number of its newest item
+        self.sequence = 0
+
+        self.submitted = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        self.thread = threading.Thread(target=self._run, name=f"lane-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, args, timeout=0.0, key=None):
+        """
+        Queue fn(*args) on this lane.
+
+        Args:
+            fn (callable): Function to run on the lane's worker thread.
+            args (tuple): Positional arguments for fn.
+            timeout (float): Seconds to wait for space when the lane is full.
+                             0 rejects immediately.
+            key (str): Coalescing key. If a newer item with the same key is
+                       queued by the time this one reaches the worker, this
+                       one is skipped.
+
+        Returns:
+            bool: True if queued, False if the lane was full.
+        """
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+            if key is not None:
+                # Marked newest before queueing, or the worker could skip it as stale
+                previous = self.latest.get(key)
+                self.latest[key] = sequence
+        item = (fn, args, time.monotonic(), key, sequence)
+        try:
+            if timeout > 0:
+                self.queue.put(item, timeout=timeout)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+                if key is not None and self.latest.get(key) == sequence:
+                    if previous is None:
+                        del self.latest[key]
+                    else:
+                        self.latest[key] = previous
+            return False
+
+        with self.lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def _run(self):
+        """Worker loop, runs queued items one at a time in arrival order."""
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+
+            fn, args, enqueued_at, key, sequence = item
+            wait = time.monotonic() - enqueued_at
+            with self.lock:
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                if key is not None:
+                    if self.latest.get(key) != sequence:
+                        # A newer state for the same actuator is already queued
+                        self.coalesced += 1
+                        continue
+                    del self.latest[key]
+
+            try:
+                fn(*args)
+                with self.lock:
+                    self.completed += 1
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                print(f"Error in dispatch lane {self.name}: {e}")
+
+    def metrics(self):
+        """
+        Get a snapshot of this lane's counters.
+
+        Returns:
+            dict: Queue depth, counters and wait times in seconds.
+        """
+        with self.lock:
+            started = self.completed + self.failed + self.coalesced
+            return {
+                'depth': self.queue.qsize(),
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'coalesced': self.coalesced,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait': self.total_wait / started if started else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+    def stop(self, timeout=5):
+        """Stop the worker once everything already queued has run."""
+        self.queue.put(_STOP)
+        self.thread.join(timeout=timeout)
+
+
+class Dispatcher:
+    """
+    Routes emitted events onto per-actuator lanes.
+    """
+
+    def __init__(self, emitter, capacity=DEFAULT_LANE_CAPACITY, block_timeout=0.0):
+        """
+        Args:
+            emitter (EventEmitter): Emitter whose handlers run on the lanes.
+            capacity (int): Queue capacity of each lane.
+            block_timeout (float): Seconds a producer may block on a full lane
+                                   before the event is rejected.
+        """
+        self.emitter = emitter
+        self.capacity = capacity
+        self.block_timeout = block_timeout
+        self.lanes = {}
+        self._lanes_lock = threading.Lock()
+
+    def lane_for(self, event):
+        """
+        Get the lane name for an event.
+
+        Events not in LANE_FOR_EVENT all run on the DEFAULT_LANE.
+        """
+        return LANE_FOR_EVENT.get(event, DEFAULT_LANE)
+
+    def get_lane(self, name):
+        """Get a lane by name, starting its worker on first use."""
+        with self._lanes_lock:
+            lane = self.lanes.get(name)
+            if lane is None:
+                lane = Lane(name, self.capacity)
+                self.lanes[name] = lane
+            return lane
+
+    def has_room(self, event):
+        """
+        Check whether the lane for an event can take another item right now.
+
+        Only reliable while a single thread emits on that lane (the MQTT
+        network thread does), since only workers take items off it.
+        """
+        return not self.get_lane(self.lane_for(event)).queue.full()
+
+    def emit(self, event, *args):
+        """
+        Emit an event on its lane instead of the calling thread.
+
+        Returns:
+            bool: True if queued, False if rejected because the lane was full.
+        """
+        lane = self.get_lane(self.lane_for(event))
+        key = event if event in COALESCED_EVENTS else None
+        accepted = lane.submit(self.emitter.emit, (event,) + args, self.block_timeout, key)
+        if not accepted:
+            print(f"Dispatch lane {lane.name} full, rejected {event}")
+        return accepted
+
+    def metrics(self):
+        """
+        Get metrics for every lane started so far.
+
+        Returns:
+            dict: Lane name -> metrics dict (see Lane.metrics).
+        """
+        with self._lanes_lock:
+            lanes = list(self.lanes.values())
+        return {lane.name: lane.metrics() for lane in lanes}
+
+    def stop(self, timeout=5):
+        """Stop all lane workers."""
+        with self._lanes_lock:
+            lanes = list(self.lanes.values())
+        for lane in lanes:
+            lane.stop(timeout)
@@ -9,29 +9,30 @@ Integrated Raspberry Pi Stepper Motor Control with VL53L0X Distance Sensor and S
 """
 
 import RPi.GPIO as GPIO
+import threading
 import time
-from smbus2 import SMBus
-from smotor3all import ServoController  # Import ServoController class
+from smotor3all import ServoController, describe_moves  # Import ServoController class
+from status import ELEVATOR_UP, DROPPED
+from tracing import tracer
+from config import machine_config
 
-# Pin definitions
-DIR_PIN = 20    # Direction pin (DIR+)
-PUL_PIN = 21    # Pulse pin (PUL+)
-DISTANCE_THRESHOLD = 608  # 20cm in mm
+# Wiring, from machine.toml. The motion parameters (step delay, distance
+# threshold, servo sequence) are read from machine_config() at the start of
+# each movement, so they follow a reloaded config.
+DIR_PIN = machine_config().elevator.dir_pin    # Direction pin (DIR+)
+PUL_PIN = machine_config().elevator.pul_pin    # Pulse pin (PUL+)
 
 # VL53L0X parameters
-VL53L0X_ADDR = 0x29
+VL53L0X_ADDR = machine_config().elevator.sensor_address
 VL53L0X_REG_ID = 0xC0
 VL53L0X_REG_SYSRANGE_START = 0x00
 VL53L0X_REG_RESULT_RANGE_STATUS = 0x14
-I2C_BUS = 1  # Raspberry Pi 4B uses I2C bus 1
+I2C_BUS = machine_config().elevator.i2c_bus  # Raspberry Pi 4B uses I2C bus 1
 
 # Motor parameters
-STEP_DELAY = 0.0001  # Adjust for desired speed
 FORWARD_DIRECTION = 1  # 1 for clockwise, 0 for counterclockwise
 REVERSE_DIRECTION = 0  # Opposite of FORWARD_DIRECTION
-MICROSTEP_FACTOR = 32  # 32 microsteps per full step
-FULL_STEPS_PER_REV = 200  # Standard for NEMA stepper motors (1.8° per step)
-STEPS_PER_REV = FULL_STEPS_PER_REV * MICROSTEP_FACTOR  # 6400 pulses per revolution
+STEPS_PER_REV = machine_config().elevator.pulses_per_rev
 
 # Initialize GPIO
 def setup_gpio():
@@ -43,6 +44,8 @@ def setup_gpio():
 
 # Initialize VL53L0X sensor
 def setup_sensor():
+    from smbus2 import SMBus
+
     bus = SMBus(I2C_BUS)
     
     # Check if sensor is present
@@ -63,6 +66,25 @@ def setup_sensor():
     print("VL53L0X sensor initialized")
     return bus
 
+# The sensor is set up once, by init_elevator() at startup or by the first ascent
+_bus = None
+_bus_lock = threading.Lock()
+
+def init_elevator():
+    """
+    Set up the stepper pins and, unless that was done already, the distance sensor.
+
+    Returns:
+        SMBus: The sensor's bus, or None if the sensor could not be initialised
+               (it is tried again next time).
+    """
+    global _bus
+    setup_gpio()
+    with _bus_lock:
+        if _bus is None:
+            _bus = setup_sensor()
+        return _bus
+
 # Read distance from VL53L0X (mm)
 def read_distance(bus):
     try:
@@ -86,6 +108,13 @@ def read_distance(bus):
         print(f"Error reading distance: {e}")
         return 0
 
+# Steps above the bottom, counted since startup; the elevator starts at the bottom
+_position = 0
+
+def elevator_position():
+    """Steps the elevator is above the bottom."""
+    return _position
+
 # Function to rotate stepper motor
 def step_motor(steps, direction):
     # Set direction - make sure the direction change is applied
@@ -93,43 +122,35 @@ def step_motor(steps, direction):
     GPIO.output(DIR_PIN, direction)
     time.sleep(0.01)  # Small delay to ensure direction change is registered
     
+    global _position
+    step_delay = machine_config().elevator.step_delay
+    step = 1 if direction == FORWARD_DIRECTION else -1
     for _ in range(steps):
         GPIO.output(PUL_PIN, GPIO.HIGH)
-        time.sleep(STEP_DELAY)
+        time.sleep(step_delay)
         GPIO.output(PUL_PIN, GPIO.LOW)
-        time.sleep(STEP_DELAY)
+        time.sleep(step_delay)
+        _position += step
 
 # Function to run servo sequence
 def run_servo_sequence_partial():
-    """Run steps 1-8 of the servo sequence (excluding the final step)"""
-    print("Running partial servo sequence (steps 1-8)...")
+    """Run the grabber sequence from the machine config, all but the final release step"""
+    grabber = machine_config().grabber
+    print(f"Running partial servo sequence (steps 1-{len(grabber.sequence)})...")
     
     # Create an instance of ServoController
     servo_controller = ServoController()
     
-    steps = [
-        (1, "Setting initial positions (Servo 1: 0°, Servo 2: 45°, Servo 3: 100°)", 
-         [(0, 0), (1, 45), (2, 100)]),
-        (2, "Moving Servo 1 to 90°", [(0, 90)]),
-        (3, "Moving Servo 1 to 180°", [(0, 180)]),
-        (4, "Moving Servo 2 to 130°", [(1, 130)]),
-        (5, "Moving Servo 3 to 180°", [(2, 130)]),
-        (6, "Moving Servo 2 to 45°", [(1, 45)]),
-        (7, "Moving Servo 1 to 90°", [(0, 90)]),
-        (8, "Moving Servo 1 to 0°", [(0, 0)])
-        # Step 9 is excluded and will be run separately
-    ]
-    
     try:
-        for step_num, description, movements in steps:
-            print(f"Step {step_num}: {description}")
+        for step_num, movements in enumerate(grabber.sequence, 1):
+            print(f"Step {step_num}: {describe_moves(movements)}")
             
             for servo_idx, angle in movements:
                 servo_controller.set_angle(servo_idx, angle)
             
-            time.sleep(1)  # Wait between steps
+            time.sleep(grabber.step_pause)  # Wait between steps
         
-        print("Partial servo sequence completed (steps 1-8)!")
+        print(f"Partial servo sequence completed (steps 1-{len(grabber.sequence)})!")
         
         # Return the controller so we can use it again later
         return servo_controller
@@ -140,13 +161,14 @@ def run_servo_sequence_partial():
         return servo_controller
 
 def run_servo_final_step(servo_controller):
-    """Run only the final step (step 9) of the servo sequence"""
-    print("Running final servo step (Step 9: Moving Servo 3 to 100°)...")
+    """Run only the final release step of the servo sequence"""
+    grabber = machine_config().grabber
+    print(f"Running final servo step ({describe_moves(grabber.release)})...")
     
     try:
-        # Execute only step 9
-        servo_controller.set_angle(2, 165)  # Move Servo 3 to 165°
-        time.sleep(0.5)  # Allow time for servo to reach position
+        for servo_idx, angle in grabber.release:
+            servo_controller.set_angle(servo_idx, angle)
+        time.sleep(grabber.move_time)  # Allow time for servo to reach position
         print("Final servo step completed!")
     except Exception as e:
         print(f"Error during final servo step: {e}")
@@ -157,56 +179,113 @@ def run_servo_final_step(servo_controller):
         
     print("Servo sequence fully completed")
 
+def ascend_elevator(on_stage=None):
+    """
+    Raise the elevator until the distance sensor reads above the configured
+    distance_threshold.
+
+    Args:
+        on_stage (function): Optional callback, called with ELEVATOR_UP at the top.
+
+    Returns:
+        int: Steps taken, needed by descend_elevator(). None if the sensor
+             could not be initialised.
+    """
+    # Setup
+    bus = init_elevator()
+    
+    if bus is None:
+        print("Failed to initialize sensor. Exiting.")
+        return None
+    
+    elevator = machine_config().elevator
+    threshold = elevator.distance_threshold
+    print("Starting motor rotation...")
+    print(f"Will stop when distance exceeds {threshold:g} mm, run servo sequence, then return to initial position")
+    
+    total_steps = 0  # Track total steps taken
+    step_increment = elevator.step_increment  # Number of steps to take before checking distance
+    
+    # Step forward until distance threshold is exceeded
+    while True:
+        # Get distance reading in mm
+        distance = read_distance(bus)
+        print(f"Distance: {distance} mm")
+        
+        if distance > threshold:
+            print(f"Distance threshold exceeded ({distance} mm > {threshold:g} mm)")
+            print("Stopping forward movement")
+            if on_stage:
+                on_stage(ELEVATOR_UP)
+            break
+        
+        # Rotate motor forward
+        step_motor(step_increment, FORWARD_DIRECTION)
+        total_steps += step_increment
+        
+    # Change direction for return journey
+    print(f"Changing direction from {FORWARD_DIRECTION} to {REVERSE_DIRECTION}")
+    GPIO.output(DIR_PIN, REVERSE_DIRECTION)
+    return total_steps
+
+def descend_elevator(total_steps):
+    """Return the elevator to its initial position after ascend_elevator()."""
+    print(f"Returning to initial position (steps to reverse: {total_steps})")
+    step_motor(total_steps, REVERSE_DIRECTION)
+    print("Returned to initial position.")
+
+def move_elevator(up):
+    """
+    Send the elevator to the top or the bottom, doing nothing if it is there already.
+
+    Returns:
+        int: Steps moved, None if the distance sensor is not available.
+    """
+    if up:
+        return ascend_elevator()
+    steps = _position
+    if steps > 0:
+        descend_elevator(steps)
+    return steps
+
 # Main function
 
-def run_elevator_with_servo():
+def run_elevator_with_servo(on_stage=None, order_id=None):
+    """
+    Run one full elevator and grabber cycle.
+
+    The pipelined scheduler runs the same steps as separate stages, see
+    ascend_elevator(), run_servo_sequence_partial(), descend_elevator() and
+    run_servo_final_step().
+
+    Args:
+        on_stage (function): Optional callback, called with ELEVATOR_UP once the
+                             elevator reaches the top and DROPPED after the
+                             final servo step.
+        order_id (str): Order the cycle runs for; each step is traced under it.
+    """
     print("Starting integrated elevator and servo control")
     try:
-        # Setup
-        setup_gpio()
-        bus = setup_sensor()
-        
-        if bus is None:
-            print("Failed to initialize sensor. Exiting.")
+        with tracer.span("cycle_ascend", order_id):
+            total_steps = ascend_elevator(on_stage)
+        if total_steps is None:
             return
         
-        print("Starting motor rotation...")
-        print("Will stop when distance exceeds 20cm, run servo sequence, then return to initial position")
-        
-        total_steps = 0  # Track total steps taken
-        step_increment = 500  # Number of steps to take before checking distance
-        
-        # Step forward until distance threshold is exceeded
-        while True:
-            # Get distance reading in mm
-            distance = read_distance(bus)
-            print(f"Distance: {distance} mm")
-            
-            if distance > DISTANCE_THRESHOLD:
-                print(f"Distance threshold exceeded ({distance} mm > {DISTANCE_THRESHOLD} mm)")
-                print("Stopping forward movement")
-                break
-            
-            # Rotate motor forward
-            step_motor(step_increment, FORWARD_DIRECTION)
-            total_steps += step_increment
-            
-        # Change direction for return journey
-        print(f"Changing direction from {FORWARD_DIRECTION} to {REVERSE_DIRECTION}")
-        GPIO.output(DIR_PIN, REVERSE_DIRECTION)
-        
         # Run steps 1-8 of the servo sequence (excluding the final step)
         print("Starting partial servo sequence (steps 1-8) instead of waiting 10 seconds")
-        servo_controller = run_servo_sequence_partial()
+        with tracer.span("cycle_grab", order_id):
+            servo_controller = run_servo_sequence_partial()
         
         # Return to initial position by stepping in reverse direction
-        print(f"Returning to initial position (steps to reverse: {total_steps})")
-        step_motor(total_steps, REVERSE_DIRECTION)
-        print("Returned to initial position.")
+        with tracer.span("cycle_descend", order_id):
+            descend_elevator(total_steps)
         
         # Now run only the final step of the servo sequence
         print("Running final servo step (step 9) after returning to initial position")
-        run_servo_final_step(servo_controller)
+        with tracer.span("cycle_release", order_id):
+            run_servo_final_step(servo_controller)
+        if on_stage:
+            on_stage(DROPPED)
         
         print("Integrated sequence completed successfully.")
             
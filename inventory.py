@@ -0,0 +1,210 @@
+"""
+Per-slot stock model.
+
+Instructions are worm rotations relative to wherever the worm is, so they
+do not say which slot a pot comes from. A purchase names its slots in an
+explicit "slots" field instead, one absolute worm slot (as in
+Worm.move_to_slot) per pot, and stock is kept per slot. Stock counts live
+in memory, so checking an order against them takes microseconds and
+happens in on_message before any motor moves, and are written through to
+an SQLite table so they survive restarts.
+
+Accepted orders reserve their pots until they are dispensed (the stock is
+decremented) or fail (the reservation is released), so two queued orders
+can never both be promised the last pot. Slots that were never stocked are
+not tracked and always accepted, and so are purchases that name no slots,
+which keeps a machine without inventory data working as before.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inventory.db")
+INVENTORY_TOPIC_PREFIX = "defarm/inventory"
+INVENTORY_QOS = 1
+
+
+def slot_for(slot):
+    """Key for a slot id: 3, 3.0 and "3" are the same slot."""
+    if isinstance(slot, float) and slot.is_integer():
+        slot = int(slot)
+    return str(slot)
+
+
+class Inventory:
+    """
+    Stock per slot, with reservations for accepted orders.
+    """
+
+    def __init__(self, device_id, path=DEFAULT_DB_PATH, topic_prefix=INVENTORY_TOPIC_PREFIX):
+        """
+        Args:
+            device_id (str): Device id used in the inventory topic.
+            path (str): SQLite database file. Opened on first use.
+            topic_prefix (str): Stock is published to f"{topic_prefix}/{device_id}".
+        """
+        self.topic = f"{topic_prefix}/{device_id}"
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        self.stock = {}         # slot -> pots left
+        self.reservations = {}  # order id -> Counter of slot -> pots, tracked slots only
+        self.orders = {}        # order id -> Counter of slot -> pots, every slot it names
+        self.reserved = Counter()
+        self.publish_fn = None
+
+        self.accepted = 0
+        self.rejected = 0
+        self.dispensed = 0
+
+    def _open(self):
+        """Open the database and load the stock counts."""
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS stock (slot TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+        self.db.commit()
+        self.stock = dict(self.db.execute("SELECT slot, count FROM stock").fetchall())
+
+    def _ensure_open(self):
+        if self.db is None:
+            self._open()
+
+    def _save(self, slots):
+        self.db.executemany("INSERT OR REPLACE INTO stock (slot, count) VALUES (?, ?)",
+                            [(slot, self.stock[slot]) for slot in slots])
+        self.db.commit()
+
+    def attach(self, publish_fn):
+        """
+        Publish the stock through publish_fn(topic, payload, qos=...) whenever
+        it changes, starting with the current counts.
+        """
+        self.publish_fn = publish_fn
+        self._publish()
+
+    def _publish(self):
+        publish_fn = self.publish_fn
+        if publish_fn is None:
+            return
+        with self.lock:
+            self._ensure_open()
+            payload = json.dumps({'stock': self.stock, 'reserved': dict(self.reserved)})
+        try:
+            publish_fn(self.topic, payload, qos=INVENTORY_QOS)
+        except Exception as e:
+            print(f"Failed to publish inventory: {e}")
+
+    def _shortfall(self, needed):
+        # Called with the lock held
+        return {slot: count for slot, count in needed.items()
+                if slot in self.stock and self.stock[slot] - self.reserved[slot] < count}
+
+    def reserve(self, slots, order_id=None):
+        """
+        Check an order against the stock and hold its pots.
+
+        Orders without an id are only checked; nothing is held for them,
+        and nothing is taken out of stock when they are dispensed.
+
+        Args:
+            slots (list): Slot of each pot in the order.
+            order_id: Id consume() and release() are later called with.
+
+        Returns:
+            dict: Slots that are short (slot -> pots needed), empty if the
+                  order was accepted.
+        """
+        needed = Counter(slot_for(slot) for slot in slots)
+        with self.lock:
+            self._ensure_open()
+            short = self._shortfall(needed)
+            if short:
+                self.rejected += 1
+                return short
+            self.accepted += 1
+            if order_id is not None:
+                tracked = Counter({slot: count for slot, count in needed.items() if slot in self.stock})
+                if order_id in self.reservations:
+                    self.reserved -= self.reservations[order_id]
+                self.reservations[order_id] = tracked
+                self.reserved += tracked
+                self.orders[order_id] = needed
+        return {}
+
+    def release(self, order_id):
+        """Drop an order's reservation without touching the stock (the order failed or was rejected)."""
+        with self.lock:
+            self.orders.pop(order_id, None)
+            held = self.reservations.pop(order_id, None)
+            if held:
+                self.reserved -= held
+
+    def consume(self, order_id):
+        """Take the pots reserve() was given for an order out of stock after a successful dispense."""
+        if order_id is None:
+            return
+        with self.lock:
+            self._ensure_open()
+            needed = self.orders.pop(order_id, Counter())
+            held = self.reservations.pop(order_id, None)
+            if held:
+                self.reserved -= held
+            changed = [slot for slot in needed if slot in self.stock]
+            for slot in changed:
+                self.stock[slot] = max(0, self.stock[slot] - needed[slot])
+            if changed:
+                self._save(changed)
+            self.dispensed += sum(needed.values())
+        if changed:
+            self._publish()
+
+    def set_stock(self, counts):
+        """
+        Set the stock of some slots, e.g. after a refill.
+
+        Args:
+            counts (dict): Slot -> pots. None stops tracking a slot.
+        """
+        with self.lock:
+            self._ensure_open()
+            for slot, count in counts.items():
+                slot = slot_for(slot)
+                if count is None:
+                    self.stock.pop(slot, None)
+                    self.db.execute("DELETE FROM stock WHERE slot = ?", (slot,))
+                else:
+                    self.stock[slot] = max(0, int(count))
+            self._save([slot_for(slot) for slot, count in counts.items() if count is not None])
+        self._publish()
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Slot -> pots available (stock minus reservations).
+        """
+        with self.lock:
+            self._ensure_open()
+            return {slot: count - self.reserved[slot] for slot, count in self.stock.items()}
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Orders accepted and rejected by the stock check, pots
+                  dispensed by orders that named their slots and orders
+                  holding reservations.
+        """
+        with self.lock:
+            return {
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'dispensed': self.dispensed,
+                'reservations': len(self.reservations),
+            }
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
@@ -0,0 +1,214 @@
+"""
+Actuator lease manager.
+
+Everything that drives hardware takes a lease on the actuators it uses first,
+so two purchases, or a purchase and a remote command, can never drive the
+same pins at once. A lease is exclusive: every holder drives what it leases,
+and nothing only reads an actuator. Independent actuators are leased
+separately and run in parallel.
+
+Several actuators are leased all at once or not at all, so two callers
+leasing overlapping sets cannot deadlock each other.
+"""
+
+import contextlib
+import threading
+import time
+
+# Actuator names
+WORM = "worm"
+ELEVATOR = "elevator"
+GRABBER_SERVOS = ("servo1", "servo2", "servo3")
+MAIN_PUMP = "main_pump"
+DRAIN_PUMP = "drain_pump"
+PERISTALTIC_PUMP = "peristaltic_pump"
+LED = "led"
+FAN = "fan"
+
+
+class LeaseTimeout(TimeoutError):
+    """Raised when a lease could not be acquired in time."""
+
+
+class Lease:
+    def __init__(self, manager, actuators, owner, ttl):
+        self.manager = manager
+        self.actuators = actuators
+        self.owner = owner
+        self.acquired_at = time.monotonic()
+        self.expires_at = self.acquired_at + ttl if ttl is not None else None
+        self.active = True
+
+    def release(self):
+        self.manager.release(self)
+
+    def __repr__(self):
+        return f"<Lease {sorted(self.actuators)} owner={self.owner}>"
+
+
+class _ActuatorState:
+    def __init__(self):
+        self.lease = None  # Lease holding the actuator
+
+        self.acquisitions = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.expired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_held = 0.0
+
+
+class LeaseManager:
+    """
+    Hands out exclusive leases keyed by actuator name.
+    """
+
+    def __init__(self, default_timeout=None):
+        """
+        Args:
+            default_timeout (float): Seconds acquire() waits when no timeout
+                                     is given. None waits forever.
+        """
+        self.default_timeout = default_timeout
+        self.condition = threading.Condition()
+        self.actuators = {}  # name -> _ActuatorState
+
+    def _state(self, actuator):
+        state = self.actuators.get(actuator)
+        if state is None:
+            state = _ActuatorState()
+            self.actuators[actuator] = state
+        return state
+
+    def _expire(self, state, now):
+        # Called with the condition held. Drops a lease held past its ttl.
+        lease = state.lease
+        if lease is not None and lease.expires_at is not None and now >= lease.expires_at:
+            print(f"Lease expired: {lease}")
+            self._drop(lease, now)
+            for actuator in lease.actuators:
+                self.actuators[actuator].expired += 1
+
+    def _available(self, states, now):
+        for state in states:
+            self._expire(state, now)
+            if state.lease is not None:
+                return False
+        return True
+
+    def acquire(self, *actuators, owner=None, timeout=None, ttl=None):
+        """
+        Lease one or more actuators.
+
+        Args:
+            *actuators (str): Actuator names.
+            owner (str): Description of the holder, for logs and holders().
+            timeout (float): Seconds to wait, default the manager's default_timeout.
+            ttl (float): Seconds after which the lease lapses and others may
+                         take the actuators. None holds it until release().
+
+        Returns:
+            Lease: The lease, to be released with release().
+
+        Raises:
+            LeaseTimeout: If the actuators did not become free in time.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        names = frozenset(actuators)
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+
+        with self.condition:
+            states = [self._state(name) for name in names]
+            contended = not self._available(states, start)
+            while True:
+                now = time.monotonic()
+                if self._available(states, now):
+                    break
+                if deadline is not None and now >= deadline:
+                    for state in states:
+                        state.timeouts += 1
+                    raise LeaseTimeout(f"{owner or 'lease'} timed out waiting for {sorted(names)}")
+                # Wake up in time to notice expiring leases
+                wait = deadline - now if deadline is not None else None
+                expiries = [state.lease.expires_at - now for state in states
+                            if state.lease is not None and state.lease.expires_at is not None]
+                if expiries:
+                    wait = max(0.0, min([wait] + expiries if wait is not None else expiries))
+                self.condition.wait(wait)
+
+            lease = Lease(self, names, owner, ttl)
+            waited = lease.acquired_at - start
+            for state in states:
+                state.lease = lease
+                state.acquisitions += 1
+                if contended:
+                    state.contended += 1
+                state.total_wait += waited
+                state.max_wait = max(state.max_wait, waited)
+            return lease
+
+    def _drop(self, lease, now):
+        # Called with the condition held
+        if not lease.active:
+            return
+        lease.active = False
+        for actuator in lease.actuators:
+            state = self.actuators[actuator]
+            if state.lease is lease:
+                state.lease = None
+            state.total_held += now - lease.acquired_at
+        self.condition.notify_all()
+
+    def release(self, lease):
+        """Release a lease. Releasing an expired or released lease does nothing."""
+        with self.condition:
+            self._drop(lease, time.monotonic())
+
+    @contextlib.contextmanager
+    def hold(self, *actuators, owner=None, timeout=None, ttl=None):
+        """
+        Context manager form of acquire(), releasing the lease on exit.
+
+        Example:
+            with leases.hold(ELEVATOR, *GRABBER_SERVOS, owner="order 42"):
+                run_elevator_with_servo()
+        """
+        lease = self.acquire(*actuators, owner=owner, timeout=timeout, ttl=ttl)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    def holders(self, actuator):
+        """Leases currently held on an actuator."""
+        with self.condition:
+            state = self.actuators.get(actuator)
+            if state is None:
+                return []
+            return [state.lease] if state.lease else []
+
+    def metrics(self):
+        """
+        Get contention metrics for every actuator leased so far.
+
+        Returns:
+            dict: Actuator name -> counts of acquisitions, contended
+                  acquisitions, timeouts and expired leases, plus wait and
+                  hold times in seconds.
+        """
+        with self.condition:
+            return {
+                name: {
+                    'held': state.lease is not None,
+                    'acquisitions': state.acquisitions,
+                    'contended': state.contended,
+                    'timeouts': state.timeouts,
+                    'expired': state.expired,
+                    'avg_wait': state.total_wait / state.acquisitions if state.acquisitions else 0.0,
+                    'max_wait': state.max_wait,
+                    'total_held': state.total_held,
+                }
+                for name, state in self.actuators.items()
+            }
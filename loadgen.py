@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+End-to-end ingestion benchmark for the MQTT subscriber.
+
+Starts the local broker stand-in (or uses an external broker), runs the real
+subscriber.start_subscriber path against it and publishes a mix of purchase
+and defarm/remote/* messages at increasing rates. For every message it records
+the latency from publish to the matching `ee` event and reports p50/p95/p99
+per rate, plus the highest rate the subscriber sustained.
+
+The exit status is non-zero if the sustained rate is below --min-rate, so the
+script can be used as a regression gate for changes to the ingestion path.
+
+Usage: python loadgen.py [--rates 50,100,200,400] [--duration 3] [--min-rate 100]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import subscriber
+from dedup import DedupIndex
+from inventory import Inventory
+from tracing import Tracer
+from local_broker import LocalBroker
+
+REMOTE_TOPICS = ["defarm/remote/led", "defarm/remote/fan", "defarm/remote/main_pump"]
+DRAIN_TIMEOUT = 5.0  # Seconds to wait for in-flight messages after publishing stops
+
+
+class LatencyRecorder:
+    """Matches received events to publish times by sequence number."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.latencies = []
+
+    def reset(self):
+        with self.lock:
+            self.sent = {}
+            self.latencies = []
+
+    def published(self, seq):
+        with self.lock:
+            self.sent[seq] = time.monotonic()
+
+    def received(self, seq):
+        now = time.monotonic()
+        with self.lock:
+            sent_at = self.sent.pop(seq, None)
+            if sent_at is not None:
+                self.latencies.append(now - sent_at)
+
+    def outstanding(self):
+        with self.lock:
+            return len(self.sent)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def install_handlers(recorder):
+    @subscriber.ee.on("purchase")
+    def on_purchase(instructions, order_id=None):
+        recorder.received(instructions[0])
+
+    for topic in REMOTE_TOPICS:
+        subscriber.ee.on(topic, lambda payload: recorder.received(payload["seq"]))
+
+
+def run_rate(publisher, recorder, rate, duration, purchase_every, run_id):
+    """
+    Publish at a fixed rate for `duration` seconds.
+
+    Returns:
+        dict: Target and achieved rate, message counts and latency percentiles.
+    """
+    recorder.reset()
+    total = int(rate * duration)
+    interval = 1.0 / rate
+    start = time.monotonic()
+
+    for seq in range(total):
+        # Pace against the schedule, not the previous send, so slow sends don't drift the rate
+        delay = start + seq * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        recorder.published(seq)
+        if seq % purchase_every == 0:
+            payload = {"instructions": [seq], "order_id": f"loadgen-{run_id}-{rate}-{seq}"}
+            publisher.publish("defarm/product/purchased", json.dumps(payload), qos=1)
+        else:
+            topic = REMOTE_TOPICS[seq % len(REMOTE_TOPICS)]
+            publisher.publish(topic, json.dumps({"seq": seq, "state": seq % 2}), qos=0)
+
+    elapsed = time.monotonic() - start
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while recorder.outstanding() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    latencies = recorder.latencies
+    return {
+        'rate': rate,
+        'achieved': total / elapsed if elapsed > 0 else float("inf"),
+        'sent': total,
+        'received': len(latencies),
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': max(latencies) if latencies else float("nan"),
+    }
+
+
+def format_header():
+    return (f"{'rate':>8} {'achieved':>9} {'recv/sent':>13} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'max ms':>8}\n")
+
+
+def format_row(result):
+    received = f"{result['received']}/{result['sent']}"
+    return (f"{result['rate']:>8.0f} {result['achieved']:>9.0f} {received:>13} {result['p50'] * 1000:>8.2f} "
+            f"{result['p95'] * 1000:>8.2f} {result['p99'] * 1000:>8.2f} {result['max'] * 1000:>8.2f}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rates", default="50,100,200,400,800",
+                        help="comma separated publish rates in messages/sec")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per rate step")
+    parser.add_argument("--purchase-every", type=int, default=4,
+                        help="every Nth message is a purchase, the rest remote commands")
+    parser.add_argument("--p99-budget", type=float, default=0.050,
+                        help="p99 latency in seconds a rate must stay under to count as sustained")
+    parser.add_argument("--min-rate", type=float, default=0,
+                        help="fail if the sustained rate is below this")
+    parser.add_argument("--broker", default=None,
+                        help="host:port of an existing plain-TCP broker instead of the local stand-in")
+    parser.add_argument("--verbose", action="store_true", help="keep the subscriber's console output")
+    args = parser.parse_args()
+
+    rates = [float(rate) for rate in args.rates.split(",")]
+
+    broker = None
+    if args.broker:
+        host, port = args.broker.rsplit(":", 1)
+        port = int(port)
+    else:
+        broker = LocalBroker()
+        host, port = "127.0.0.1", broker.start()
+
+    # Keep benchmark order ids, stock and traces out of the real files
+    state_dir = tempfile.mkdtemp()
+    subscriber.dedup = DedupIndex(os.path.join(state_dir, "orders.db"))
+    subscriber.inventory = Inventory(subscriber.DEVICE_ID, os.path.join(state_dir, "inventory.db"))
+    subscriber.tracer = Tracer(os.path.join(state_dir, "trace.bin"))
+
+    recorder = LatencyRecorder()
+    install_handlers(recorder)
+
+    out = sys.stdout
+    quiet = open(os.devnull, "w") if not args.verbose else sys.stdout
+    results = []
+    with contextlib.redirect_stdout(quiet):
+        manager = subscriber.start_subscriber(host, port, client_id="loadgen-subscriber", block=False, tls=False)
+        if not manager.wait_connected(10):
+            print("Subscriber failed to connect", file=out)
+            return 1
+        time.sleep(0.5)  # let the subscriptions settle
+
+        publisher = mqtt.Client(client_id="loadgen-publisher")
+        publisher.max_queued_messages_set(0)
+        publisher.max_inflight_messages_set(1000)
+        publisher.connect(host, port)
+        # Nagle on the publisher's socket would otherwise add tens of ms to the numbers
+        publisher.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        publisher.loop_start()
+
+        run_id = int(time.time())
+        out.write(format_header())
+        for rate in rates:
+            result = run_rate(publisher, recorder, rate, args.duration, args.purchase_every, run_id)
+            results.append(result)
+            out.write(format_row(result))
+            out.flush()
+
+        publisher.disconnect()
+        publisher.loop_stop()
+        manager.stop()
+    if broker is not None:
+        broker.stop()
+
+    sustained = 0
+    for result in results:
+        if (result['received'] == result['sent'] and result['p99'] <= args.p99_budget
+                and result['achieved'] >= 0.95 * result['rate']):
+            sustained = max(sustained, result['rate'])
+
+    print(f"\nMax sustained rate: {sustained:.0f} msg/s (p99 <= {args.p99_budget * 1000:.0f} ms, no loss)")
+    print(f"Dispatcher lanes: {subscriber.dispatcher.metrics()}")
+    if sustained < args.min_rate:
+        print(f"FAIL: below the required {args.min_rate:.0f} msg/s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
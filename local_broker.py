@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Minimal in-process MQTT 3.1.1 / 5.0 broker stand-in for local testing.
+
+Supports what the subscriber needs: CONNECT with clean or persistent sessions,
+SUBSCRIBE/UNSUBSCRIBE with + and # wildcards, PUBLISH at QoS 0, 1 and 2,
+keepalive pings and DISCONNECT. Shared subscriptions ($share/<group>/<filter>)
+deliver each message to one member of the group, round robin, preferring
+members that are connected. MQTT v5 publish properties (such as the
+content type) are passed through to v5 subscribers unchanged; other v5
+properties are ignored. No TLS, no authentication checks, no retained
+messages. The broker can be stopped and started again on the same port to
+simulate an outage; persistent sessions survive the restart unless
+`forget_sessions` is passed to stop().
+
+Usage: python local_broker.py [port]
+"""
+
+import socket
+import struct
+import sys
+import threading
+import time
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+DEFAULT_PORT = 1883
+MQTT_V5 = 5
+SHARE_PREFIX = "$share/"
+
+
+def topic_matches(topic_filter, topic):
+    """
+    Check whether a concrete topic matches an MQTT topic filter.
+
+    Args:
+        topic_filter (str): Filter, may contain + and #.
+        topic (str): Topic of a published message.
+
+    Returns:
+        bool: True if the filter matches.
+    """
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    if topic.startswith("$") and filter_levels[0] in ("+", "#"):
+        return False
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def _decode_varint(data, pos):
+    """Decode an MQTT variable byte integer. Returns (value, next position)."""
+    multiplier = 1
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            return value, pos
+        multiplier *= 128
+
+
+def _encode_string(value):
+    data = value.encode("utf-8") if isinstance(value, str) else value
+    return struct.pack("!H", len(data)) + data
+
+
+def _packet(packet_type, flags, body):
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _recv_exact(sock, count):
+    data = bytearray()
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _read_packet(sock):
+    header = _recv_exact(sock, 1)[0]
+    multiplier = 1
+    length = 0
+    while True:
+        byte = _recv_exact(sock, 1)[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    body = _recv_exact(sock, length) if length else b""
+    return header >> 4, header & 0x0F, body
+
+
+class Session:
+    """Subscriptions and undelivered messages of one client id."""
+
+    def __init__(self, client_id, clean):
+        self.client_id = client_id
+        self.clean = clean
+        self.subscriptions = {}  # topic filter -> granted QoS
+        self.pending = []        # (topic, payload, qos, properties, dup) queued while offline
+        self.inflight = {}       # packet id -> (topic, payload, qos, properties) awaiting ack
+        self.next_packet_id = 1
+        self.connection = None
+
+    def allocate_packet_id(self):
+        packet_id = self.next_packet_id
+        self.next_packet_id = packet_id % 65535 + 1
+        return packet_id
+
+
+class Connection:
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.session = None
+        self.protocol_level = 4
+        self.write_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def send(self, data):
+        with self.write_lock:
+            self.sock.sendall(data)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _run(self):
+        try:
+            while True:
+                packet_type, flags, body = _read_packet(self.sock)
+                if not self._handle(packet_type, flags, body):
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.close()
+            self.broker._connection_closed(self)
+
+    def _handle(self, packet_type, flags, body):
+        if packet_type == CONNECT:
+            self._handle_connect(body)
+        elif packet_type == PUBLISH:
+            self._handle_publish(flags, body)
+        elif packet_type == PUBACK or packet_type == PUBCOMP:
+            packet_id = struct.unpack("!H", body[:2])[0]
+            self.broker._acknowledged(self.session, packet_id)
+        elif packet_type == PUBREC:
+            self.send(_packet(PUBREL, 0x02, body[:2]))
+        elif packet_type == PUBREL:
+            self.send(_packet(PUBCOMP, 0, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            self._handle_subscribe(body)
+        elif packet_type == UNSUBSCRIBE:
+            self._handle_unsubscribe(body)
+        elif packet_type == PINGREQ:
+            self.send(_packet(PINGRESP, 0, b""))
+        elif packet_type == DISCONNECT:
+            return False
+        return True
+
+    def _handle_connect(self, body):
+        pos = 2 + struct.unpack("!H", body[:2])[0]  # protocol name
+        self.protocol_level = body[pos]
+        pos += 1
+        connect_flags = body[pos]
+        pos += 3                                     # flags + keepalive
+        if self.protocol_level == MQTT_V5:
+            length, pos = _decode_varint(body, pos)  # connect properties
+            pos += length
+        id_length = struct.unpack("!H", body[pos:pos + 2])[0]
+        client_id = body[pos + 2:pos + 2 + id_length].decode("utf-8")
+        clean = bool(connect_flags & 0x02)
+        self.session, session_present = self.broker._attach(self, client_id, clean)
+        connack = bytes([1 if session_present else 0, 0])
+        if self.protocol_level == MQTT_V5:
+            connack += b"\x00"  # no properties
+        self.send(_packet(CONNACK, 0, connack))
+        self.broker._flush_pending(self.session)
+
+    def _handle_publish(self, flags, body):
+        qos = (flags >> 1) & 0x03
+        topic_length = struct.unpack("!H", body[:2])[0]
+        topic = body[2:2 + topic_length].decode("utf-8")
+        pos = 2 + topic_length
+        packet_id = None
+        if qos:
+            packet_id = struct.unpack("!H", body[pos:pos + 2])[0]
+            pos += 2
+        properties = b""
+        if self.protocol_level == MQTT_V5:
+            length, start = _decode_varint(body, pos)
+            properties = body[start:start + length]
+            pos = start + length
+        payload = body[pos:]
+
+        self.broker.publish(topic, payload, qos, properties)
+        if qos == 1:
+            self.send(_packet(PUBACK, 0, struct.pack("!H", packet_id)))
+        elif qos == 2:
+            self.send(_packet(PUBREC, 0, struct.pack("!H", packet_id)))
+
+    def _handle_subscribe(self, body):
+        packet_id = body[:2]
+        pos = 2
+        if self.protocol_level == MQTT_V5:
+            length, pos = _decode_varint(body, pos)
+            pos += length
+        granted = bytearray()
+        while pos < len(body):
+            length = struct.unpack("!H", body[pos:pos + 2])[0]
+            topic_filter = body[pos + 2:pos + 2 + length].decode("utf-8")
+            qos = body[pos + 2 + length] & 0x03
+            pos += 3 + length
+            self.broker._subscribe(self.session, topic_filter, qos)
+            granted.append(qos)
+        properties = b"\x00" if self.protocol_level == MQTT_V5 else b""
+        self.send(_packet(SUBACK, 0, packet_id + properties + bytes(granted)))
+
+    def _handle_unsubscribe(self, body):
+        packet_id = body[:2]
+        pos = 2
+        if self.protocol_level == MQTT_V5:
+            length, pos = _decode_varint(body, pos)
+            pos += length
+        count = 0
+        while pos < len(body):
+            length = struct.unpack("!H", body[pos:pos + 2])[0]
+            self.broker._unsubscribe(self.session, body[pos + 2:pos + 2 + length].decode("utf-8"))
+            pos += 2 + length
+            count += 1
+        if self.protocol_level == MQTT_V5:
+            packet_id += b"\x00" + b"\x00" * count  # no properties, success per filter
+        self.send(_packet(UNSUBACK, 0, packet_id))
+
+
+class LocalBroker:
+    """
+    A tiny MQTT broker running in background threads.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        """
+        Args:
+            host (str): Interface to listen on.
+            port (int): Port to listen on. 0 picks a free port on first start,
+                        which is then reused across restarts.
+        """
+        self.host = host
+        self.port = port
+        self.lock = threading.RLock()
+        self.sessions = {}
+        self.connections = set()
+        self.server = None
+        self.accept_thread = None
+        self.messages_published = 0
+        self.share_cursor = {}  # (group, filter) -> number of messages handed out
+
+    def start(self):
+        """Start listening. Returns the port in use."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen(16)
+        self.port = server.getsockname()[1]
+        self.server = server
+        self.accept_thread = threading.Thread(target=self._accept_loop, args=(server,), daemon=True)
+        self.accept_thread.start()
+        return self.port
+
+    def stop(self, forget_sessions=False):
+        """
+        Kill the broker: close the listener and drop every client connection.
+
+        Args:
+            forget_sessions (bool): Also discard persistent sessions, as a
+                                    broker restart without persistence would.
+        """
+        if self.server is not None:
+            try:
+                self.server.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server.close()
+            self.server = None
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.close()
+        if self.accept_thread is not None:
+            self.accept_thread.join(timeout=2)
+        with self.lock:
+            self.connections.clear()
+            for session in self.sessions.values():
+                session.connection = None
+            if forget_sessions:
+                self.sessions.clear()
+
+    def restart(self, downtime=0.0, forget_sessions=False):
+        """Stop, wait `downtime` seconds, then start again on the same port."""
+        self.stop(forget_sessions)
+        time.sleep(downtime)
+        return self.start()
+
+    def _accept_loop(self, server):
+        while True:
+            try:
+                sock, _ = server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = Connection(self, sock)
+            with self.lock:
+                self.connections.add(connection)
+            connection.thread.start()
+
+    def _attach(self, connection, client_id, clean):
+        with self.lock:
+            session = self.sessions.get(client_id)
+            if session is not None and session.connection is not None:
+                # Same client id connected twice: the older connection is dropped
+                session.connection.close()
+            session_present = session is not None and not clean
+            if session is None or clean:
+                session = Session(client_id, clean)
+                self.sessions[client_id] = session
+            session.clean = clean
+            session.connection = connection
+            # Messages sent but never acknowledged go out again as duplicates
+            resend = [message + (True,) for _, message in sorted(session.inflight.items())]
+            session.pending = resend + session.pending
+            session.inflight.clear()
+            return session, session_present
+
+    def _connection_closed(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+            session = connection.session
+            if session is not None and session.connection is connection:
+                session.connection = None
+                if session.clean:
+                    self.sessions.pop(session.client_id, None)
+
+    def _subscribe(self, session, topic_filter, qos):
+        with self.lock:
+            session.subscriptions[topic_filter] = min(qos, 2)
+
+    def _unsubscribe(self, session, topic_filter):
+        with self.lock:
+            session.subscriptions.pop(topic_filter, None)
+
+    def _acknowledged(self, session, packet_id):
+        with self.lock:
+            session.inflight.pop(packet_id, None)
+
+    def _flush_pending(self, session):
+        with self.lock:
+            pending = session.pending
+            session.pending = []
+        for topic, payload, qos, properties, dup in pending:
+            self._deliver(session, topic, payload, qos, properties, dup)
+
+    def _deliver(self, session, topic, payload, qos, properties=b"", dup=False):
+        with self.lock:
+            connection = session.connection
+            if connection is None:
+                if qos and not session.clean:
+                    session.pending.append((topic, payload, qos, properties, dup))
+                return
+            body = _encode_string(topic)
+            if qos:
+                packet_id = session.allocate_packet_id()
+                session.inflight[packet_id] = (topic, payload, qos, properties)
+                body += struct.pack("!H", packet_id)
+            if connection.protocol_level == MQTT_V5:
+                body += _encode_length(len(properties)) + properties
+        flags = (qos << 1) | (0x08 if dup else 0)
+        try:
+            connection.send(_packet(PUBLISH, flags, body + payload))
+        except OSError:
+            pass
+
+    def _pick_member(self, key, members):
+        # Round robin over the group, skipping members that are offline unless all are
+        connected = [member for member in members if member[0].connection is not None] or members
+        connected.sort(key=lambda member: member[0].client_id)
+        cursor = self.share_cursor.get(key, 0)
+        self.share_cursor[key] = cursor + 1
+        return connected[cursor % len(connected)]
+
+    def publish(self, topic, payload, qos=0, properties=b""):
+        """
+        Deliver a message to every matching subscription.
+
+        Args:
+            topic (str): Topic to publish on.
+            payload (bytes): Message payload.
+            qos (int): Publish QoS, capped per subscriber at their granted QoS.
+            properties (bytes): Encoded MQTT v5 publish properties, passed to
+                                v5 subscribers as they are.
+        """
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self.lock:
+            self.messages_published += 1
+            targets = []
+            groups = {}  # (group, filter) -> [(session, granted QoS)]
+            for session in self.sessions.values():
+                granted = []
+                for topic_filter, sub_qos in session.subscriptions.items():
+                    if topic_filter.startswith(SHARE_PREFIX):
+                        group, _, shared_filter = topic_filter[len(SHARE_PREFIX):].partition("/")
+                        if topic_matches(shared_filter, topic):
+                            groups.setdefault((group, shared_filter), []).append((session, sub_qos))
+                    elif topic_matches(topic_filter, topic):
+                        granted.append(sub_qos)
+                if granted:
+                    targets.append((session, min(qos, max(granted))))
+            for key, members in groups.items():
+                session, sub_qos = self._pick_member(key, members)
+                targets.append((session, min(qos, sub_qos)))
+        for session, delivery_qos in targets:
+            self._deliver(session, topic, payload, delivery_qos, properties)
+
+
+if __name__ == "__main__":
+    broker = LocalBroker(host="0.0.0.0", port=int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT)
+    print(f"Local MQTT broker listening on port {broker.start()}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        broker.stop()
@@ -1,118 +1,364 @@
+import time
+STARTED_AT = time.monotonic()  # Taken before the other imports so the startup report includes them
+
 from dotenv import load_dotenv
 import os
-from subscriber import ee, start_subscriber
-import RPi.GPIO as GPIO          
-import time
-from worm import Worm
-from elevator import run_elevator_with_servo
-from dht11 import start_monitoring
 import threading
+from subscriber import ee, start_subscriber, status, inventory
+from status import BUSY, IDLE, WORM_DONE, DROPPED, FAILED
+from worm import Worm, WormFault
+from elevator import (run_elevator_with_servo, ascend_elevator, descend_elevator, run_servo_sequence_partial,
+                      run_servo_final_step, init_elevator, move_elevator)
+from scheduler import OrderScheduler, purchase_plan, DEFAULT_MAX_IN_FLIGHT
+from batching import PurchaseBatcher
+from tracing import tracer
+from leases import (LeaseManager, WORM, ELEVATOR, GRABBER_SERVOS, MAIN_PUMP, DRAIN_PUMP, PERISTALTIC_PUMP,
+                    LED, FAN)
+from dht11 import start_monitoring
+from startup import init_parallel, print_report
+from config import machine_config, watch as watch_config
+from devices import DeviceTable, parse_switch
+from smotor3all import move_servos
 
 
 # Load environment variables
 load_dotenv()
 
+def report(order, state, **details):
+    # A merged order reports to every purchase in it
+    for order_id, _ in order.parts:
+        status.update(state, order_id, **details)
+
+def rotate_stage(order, index):
+    # One worm rotation; the graph runs them in instruction order
+    worm.rotate_degrees(order.instructions[index])
+    end = 0
+    for order_id, instructions in order.parts:
+        end += len(instructions)
+        if index == end - 1:
+            status.update(WORM_DONE, order_id)
+
+def execute_elevator_instructions(order_id=None):
+    print("THREAD ELEVATOR STARTED")
+    run_elevator_with_servo(order_id=order_id)
+
+# Nodes of a purchase graph, run by the order scheduler. Values one node needs
+# from an earlier one are passed through order.context.
+def ascend_stage(order):
+    total_steps = ascend_elevator(on_stage=lambda stage: report(order, stage))
+    if total_steps is None:
+        raise RuntimeError("elevator distance sensor not available")
+    order.context["total_steps"] = total_steps
+
+def grab_stage(order):
+    # grabber servo steps 1-8
+    order.context["servo_controller"] = run_servo_sequence_partial()
+
+def descend_stage(order):
+    descend_elevator(order.context["total_steps"])
+
+def release_stage(order):
+    # grabber swivel drop
+    run_servo_final_step(order.context["servo_controller"])
+    for order_id, _ in order.parts:
+        inventory.consume(order_id)
+    report(order, DROPPED)
+
+def on_order_done(order):
+    if order.error is not None:
+        # A jammed or unaligned worm reports where it is, so the backend can tell it from other failures
+        details = order.error.details() if isinstance(order.error, WormFault) else {}
+        report(order, FAILED, error=str(order.error), **details)
+        for order_id, _ in order.parts:
+            if order_id is not None:
+                inventory.release(order_id)
+    # Purchases the batcher still holds are orders too; it hands them to the
+    # scheduler, so it is checked first
+    if (batcher is None or batcher.idle()) and scheduler.idle():
+        # Lets the backend release the next order straight away
+        status.update(IDLE)
+
+# Every node and remote command leases the actuators it drives, so nothing
+# else can drive the same pins at the same time
+leases = LeaseManager()
+REMOTE_LEASE_TIMEOUT = 5.0  # Seconds a remote command waits for a busy actuator
+REMOTE_MAX_SLOTS = 20  # Worm slots one remote command may turn
+
+# Pumps, LED and fan. Only pin writes that change an output are made, and
+# timed commands share one timer wheel thread, see devices.py. Outputs without
+# a pin in machine.toml are left alone and their commands rejected.
+outputs = DeviceTable(machine_config().outputs.configured(), active_low=machine_config().outputs.active_low)
+
+# The next order's worm rotations start while the previous order's elevator is
+# still returning; MAX_ORDERS_IN_FLIGHT=1 runs one order at a time instead
+scheduler = OrderScheduler(purchase_plan({
+    "worm": rotate_stage,
+    "elevator_cycle": lambda order: execute_elevator_instructions(order.order_id),
+    "ascend": ascend_stage,
+    "grab": grab_stage,
+    "descend": descend_stage,
+    "release": release_stage,
+}), max_in_flight=int(os.getenv("MAX_ORDERS_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT)), on_order_done=on_order_done,
+   leases=leases, tracer=tracer)
+
+# With BATCH_MAX_ORDERS above 1, purchases that queue up while the machine is
+# busy share one worm pass and one elevator trip (at most BATCH_MAX_INSTRUCTIONS
+# rotations, if set); each still gets its own status updates
+BATCH_MAX_ORDERS = int(os.getenv("BATCH_MAX_ORDERS", 1))
+BATCH_MAX_INSTRUCTIONS = int(os.getenv("BATCH_MAX_INSTRUCTIONS", 0)) or None
+batcher = (PurchaseBatcher(scheduler, BATCH_MAX_ORDERS, BATCH_MAX_INSTRUCTIONS)
+           if BATCH_MAX_ORDERS > 1 else None)
+
+STARTUP_CONNECT_TIMEOUT = 30.0  # Seconds the startup report waits for the broker; it keeps retrying after
+
+# Set once init_hardware() has finished. Purchases that arrive earlier, while
+# the broker connection came up faster than the hardware, wait for it.
+hardware_ready = threading.Event()
+hardware_errors = {}  # init step name -> exception, for hardware that failed to come up
+HARDWARE_STEPS = ("worm", "elevator", "dht11", "outputs")
+ORDER_HARDWARE = ("worm", "elevator")  # needed by every purchase
+worm = None
+
+def hardware_error(*names):
+    """Why the named hardware cannot be used, None if it all came up (or is not up yet)."""
+    failed = [f"{name}: {hardware_errors[name]}" for name in names if name in hardware_errors]
+    return f"hardware failed to initialise ({'; '.join(failed)})" if failed else None
+
+def wait_hardware(*names):
+    """Wait for init_hardware() to finish, then return hardware_error(*names)."""
+    hardware_ready.wait()
+    return hardware_error(*names)
+
+def init_worm():
+    """Set up the worm and load its coast calibration."""
+    wiring = machine_config().worm
+    motor = Worm(wiring.enable_pin, wiring.in1_pin, wiring.in2_pin, wiring.encoder_a_pin, wiring.encoder_b_pin)
+    motor.coast.load()
+    return motor
+
+def init_hardware(also=None):
+    """
+    Bring up the DHT11 monitor, the worm (GPIO and the pigpio connection),
+    the elevator (GPIO and the I2C distance sensor) and the switched outputs
+    in parallel.
+
+    Hardware that fails is recorded in hardware_errors and reported as a
+    FAILED machine status; commands that need it are refused from then on.
+
+    Args:
+        also (dict): More name -> callable steps to run alongside, e.g.
+                     waiting for the broker connection.
+
+    Returns:
+        dict: Name -> StartupStep, see startup.init_parallel().
+    """
+    global worm
+    steps = init_parallel({
+        "worm": init_worm,
+        "elevator": init_elevator,
+        "dht11": start_monitoring,
+        "outputs": outputs.setup,
+        **(also or {}),
+    })
+    worm = steps["worm"].result
+    hardware_errors.update({name: steps[name].error for name in HARDWARE_STEPS if steps[name].error is not None})
+    if hardware_errors:
+        # Machine status, so the backend stops sending orders the machine cannot run
+        status.update(FAILED, error=hardware_error(*HARDWARE_STEPS), hardware=sorted(hardware_errors))
+    hardware_ready.set()
+    return steps
+
 # This function will be called when a purchase is made
 @ee.on("purchase")
-def on_purchase(instructions):
+def on_purchase(instructions, order_id=None):
+    tracer.end("queue_wait", order_id)
+    error = wait_hardware(*ORDER_HARDWARE)
+    if error:
+        print(f"Refusing order {order_id}: {error}")
+        status.update(FAILED, order_id, error=error)
+        if order_id is not None:
+            inventory.release(order_id)
+        return
     print(f"RECEIVED MESSAGE = {instructions}")
+    status.update(BUSY, order_id=None, current_order=order_id)
     
     # Optionally read temperature if needed
     # temp = dht_monitor.get_temperature()
     # humid = dht_monitor.get_humidity()
 
-    worm_thread = threading.Thread(target=execute_worm_instructions, args=(instructions,))
-    elevator_ascend_thread = threading.Thread(target=execute_elevator_instructions)
-
-    worm_thread.start()
-    elevator_ascend_thread.start()
-
-    worm_thread.join()
-    elevator_ascend_thread.join()
-
-    # grabber swivel drop
-    run_elevator_with_servo()
+    # Waits while the pipeline is full, so the dispense lane still backs up
+    # and rejects orders when the machine cannot keep up
+    with tracer.span("admission", order_id):
+        (batcher or scheduler).submit(instructions, order_id)
 
-
-def execute_worm_instructions(instructions):
-    print("THREAD WORM STARTED")
-    for instruction in instructions:
-        worm.rotate_degrees(instruction)
-
-def execute_elevator_instructions():
-    print("THREAD ELEVATOR STARTED")
-    run_elevator_with_servo()
+def switch_output(name, payload):
+    # Pumps, LED and fan: {"state": "on", "duration": 30} or a bare "on"/"off"
+    try:
+        on, duration = parse_switch(payload)
+    except ValueError as e:
+        print(f"Ignoring {name} command {payload!r}: {e}")
+        return
+    if name not in outputs.pins:
+        print(f"Ignoring {name} command {payload!r}: no pin configured for it in [outputs]")
+        return
+    error = wait_hardware("outputs")
+    if error:
+        print(f"Ignoring {name} command {payload!r}: {error}")
+        return
+    with leases.hold(name, owner=f"remote {name}", timeout=REMOTE_LEASE_TIMEOUT):
+        written = outputs.set(name, on, duration)
+    print(f"{name.upper()} {'ON' if on else 'OFF'}{f' for {duration:g} s' if duration else ''}"
+          f"{'' if written else ' (no change)'}")
 
 # This function will be called when a main pump command is received
 @ee.on("defarm/remote/main_pump")
 def on_main_pump(payload):
-    print(f"MAIN PUMP COMMAND RECEIVED: {payload}")
+    switch_output(MAIN_PUMP, payload)
 
 # This function will be called when a drain pump command is received
 @ee.on("defarm/remote/drain_pump")
 def on_drain_pump(payload):
-    print(f"DRAIN PUMP COMMAND RECEIVED: {payload}")
+    switch_output(DRAIN_PUMP, payload)
 
 # This function will be called when a peristaltic pump command is received
 @ee.on("defarm/remote/peristaltic_pump")
 def on_peristaltic_pump(payload):
-    print(f"PERISTALTIC PUMP COMMAND RECEIVED: {payload}")
+    switch_output(PERISTALTIC_PUMP, payload)
 
 # This function will be called when an LED command is received
 @ee.on("defarm/remote/led")
 def on_led(payload):
-    print(f"LED COMMAND RECEIVED: {payload}")
+    switch_output(LED, payload)
 
 # This function will be called when a fan command is received
 @ee.on("defarm/remote/fan")
 def on_fan(payload):
-    print(f"FAN COMMAND RECEIVED: {payload}")
+    switch_output(FAN, payload)
 
 # This function will be called when an elevator command is received
 @ee.on("defarm/remote/elevator")
 def on_elevator(payload):
-    print(f"ELEVATOR COMMAND RECEIVED: {payload}")
+    # {"position": "up"} or {"position": "down"}; no move if it is there already
+    position = payload.get("position") if isinstance(payload, dict) else payload
+    if position not in ("up", "down"):
+        print(f"Ignoring elevator command {payload!r}: position must be up or down")
+        return
+    error = wait_hardware("elevator")
+    if error:
+        print(f"Ignoring elevator command {payload!r}: {error}")
+        return
+    with leases.hold(ELEVATOR, owner="remote elevator", timeout=REMOTE_LEASE_TIMEOUT):
+        steps = move_elevator(position == "up")
+    print(f"ELEVATOR {position.upper()}: {steps} steps")
 
 # This function will be called when a worm command is received
 @ee.on("defarm/remote/worm")
 def on_worm(payload):
-    print(f"WORM COMMAND RECEIVED: {payload}")
+    # {"slots": 2} turns the worm two slots on, {"counts": 500} by encoder counts,
+    # {"slot": 7} to slot 7, counted from slot 0; {"home": 0} marks the worm as
+    # being at slot 0 after aligning it by hand. After a stall only "slot" and
+    # "home" are taken, until one of them has realigned the worm
+    payload = payload if isinstance(payload, dict) else {"slots": payload}
+    if "slot" in payload or "home" in payload:
+        key = "home" if "home" in payload else "slot"
+        slot = payload[key]
+        if not isinstance(slot, int) or isinstance(slot, bool) or slot < 0:
+            print(f"Ignoring worm command {payload!r}: {key} must be a slot number")
+            return
+        error = wait_hardware("worm")
+        if error:
+            print(f"Ignoring worm command {payload!r}: {error}")
+            return
+        with leases.hold(WORM, owner="remote worm", timeout=REMOTE_LEASE_TIMEOUT):
+            if key == "home":
+                worm.set_home(slot)
+                print(f"WORM HOMED at slot {slot}")
+                return
+            turn = worm.slot_position(slot) - worm.goal
+            if not 0 <= turn <= REMOTE_MAX_SLOTS * machine_config().worm.rotation_counts:
+                print(f"Ignoring worm command {payload!r}: slot {slot} is behind the worm "
+                      f"or more than {REMOTE_MAX_SLOTS} slots on")
+                return
+            try:
+                worm.move_to_slot(slot)
+            except WormFault as e:
+                print(f"WORM COMMAND FAILED: {e}")
+                return
+        print(f"WORM AT SLOT {slot}: turned {turn:g} counts")
+        return
+    slots, counts = payload.get("slots"), payload.get("counts")
+    if counts is not None:
+        if not isinstance(counts, (int, float)) or isinstance(counts, bool) or counts <= 0:
+            print(f"Ignoring worm command {payload!r}: counts must be a positive number")
+            return
+        rotations = [counts]
+    else:
+        slots = 1 if slots is None else slots
+        if not isinstance(slots, int) or isinstance(slots, bool) or not 1 <= slots <= REMOTE_MAX_SLOTS:
+            print(f"Ignoring worm command {payload!r}: slots must be a whole number from 1 to {REMOTE_MAX_SLOTS}")
+            return
+        rotations = [machine_config().worm.rotation_counts] * slots
+    error = wait_hardware("worm")
+    if error:
+        print(f"Ignoring worm command {payload!r}: {error}")
+        return
+    with leases.hold(WORM, owner="remote worm", timeout=REMOTE_LEASE_TIMEOUT):
+        try:
+            for count in rotations:
+                worm.rotate_degrees(count)
+        except WormFault as e:
+            print(f"WORM COMMAND FAILED: {e}")
+            return
+    print(f"WORM TURNED {sum(rotations):g} counts")
 
 # This function will be called when a grabber command is received
 @ee.on("defarm/remote/grabber")
 def on_grabber(payload):
-    print(f"GRABBER COMMAND RECEIVED: {payload}")
+    # {"angles": [0, 45, null]} moves servo 1 and 2 unless they are there already
+    angles = payload.get("angles") if isinstance(payload, dict) else None
+    if (not isinstance(angles, list) or not angles
+            or not all(angle is None or (isinstance(angle, (int, float)) and not isinstance(angle, bool)
+                                         and 0 <= angle <= 180) for angle in angles)):
+        print(f"Ignoring grabber command {payload!r}: angles must be a list of 0-180 or null")
+        return
+    hardware_ready.wait()
+    with leases.hold(*GRABBER_SERVOS, owner="remote grabber", timeout=REMOTE_LEASE_TIMEOUT):
+        moved = move_servos(angles)
+    print(f"GRABBER: moved {moved} servos")
 
 # Set up subscriber
 if __name__ == "__main__":
-	# start all sensors
-	
-    start_monitoring()
-	
-    ENABLE_PIN = 22    # PWM pin (BCM numbering)
-    IN1_PIN = 23       # Direction pin 1
-    IN2_PIN = 24       # Direction pin 2
-    ENCODER_A_PIN = 17 # Encoder channel A
-    ENCODER_B_PIN = 27
-    ROTATION_DEGREES = 2335  # Default rotation angle
-    
-    worm = Worm(ENABLE_PIN, IN1_PIN, IN2_PIN, ENCODER_A_PIN, ENCODER_B_PIN)
-
     broker_host = os.getenv("MQTT_HOST")
     broker_port = int(os.getenv("MQTT_PORT"))
     username = os.getenv("MQTT_USERNAME")
     password = os.getenv("MQTT_PASSWORD")
-   
-    # Start DHT monitoring in the background
-    #dht_monitor.start_monitoring(interval=3.0, print_values=True)
-    
+    imported_at = time.monotonic()
+
+    # The broker connection (DNS, TLS) comes up while the hardware initialises
     print("Start MQTT subscriber...")
+    manager = start_subscriber(broker_host, broker_port, username, password, block=False)
+    steps = init_hardware(also={"mqtt connect": lambda: manager.wait_connected(STARTUP_CONNECT_TIMEOUT)})
+    connected = steps["mqtt connect"].result
+    ready = connected and hardware_error(*ORDER_HARDWARE) is None
+    print_report([("imports", imported_at - STARTED_AT, None)]
+                 + [(name, step.seconds if name != "mqtt connect" or connected else None, step.error)
+                    for name, step in steps.items()],
+                 STARTED_AT, time.monotonic() if ready else None)
+
+    # Edits to the motion parameters in machine.toml apply from the next
+    # movement on, without restarting and dropping the MQTT session
+    watch_config()
+
     try:
-        start_subscriber(broker_host, broker_port, username, password)
+        manager.wait()
     except KeyboardInterrupt:
         print("Program terminated by user")
     finally:
         # Clean up resources
+        manager.stop()
         #dht_monitor.cleanup()
+        if worm is not None:
+            worm.store.close()  # Position to disk now rather than when the OS gets round to it
+        import RPi.GPIO as GPIO
         GPIO.cleanup()
         print("Cleanup complete")
@@ -0,0 +1,92 @@
+"""
+Closed-loop speed control for the worm's DC motor.
+
+A fixed duty cycle turns the worm at whatever speed its load allows, and
+cutting the power at the target leaves it to coast on by a distance that
+grows with that speed. Instead the worm follows a trapezoidal speed profile:
+it accelerates to a cruise speed, then decelerates so it reaches the target
+at a low creep speed and coasts only a few counts once stopped. A PID on the
+speed measured from the encoder holds the worm to the profile whatever the
+load; a feed-forward term gives it the duty cycle the profile speed needs on
+an unloaded worm, so the PID only has to correct for the load.
+"""
+
+import math
+
+
+class TrapezoidProfile:
+    """
+    Speed setpoint for a move, from the time since it started and the
+    distance left to go.
+    """
+
+    def __init__(self, cruise, acceleration, creep):
+        """
+        Args:
+            cruise (float): Top speed, counts per second.
+            acceleration (float): Counts per second squared, speeding up and
+                                  slowing down.
+            creep (float): Speed the move starts from and reaches the target
+                           at, counts per second.
+        """
+        self.cruise = cruise
+        self.acceleration = acceleration
+        self.creep = creep
+
+    def velocity(self, elapsed, remaining):
+        """
+        Args:
+            elapsed (float): Seconds since the move started.
+            remaining (float): Counts left to the target.
+
+        Returns:
+            float: Speed setpoint, counts per second.
+        """
+        speeding_up = self.creep + self.acceleration * elapsed
+        # Fastest speed from which the worm can still slow to creep by the target
+        slowing_down = math.sqrt(self.creep ** 2 + 2 * self.acceleration * max(0.0, remaining))
+        return min(self.cruise, speeding_up, slowing_down)
+
+
+class PID:
+    """
+    PID controller with a feed-forward input, output limits and anti-windup.
+    """
+
+    def __init__(self, kp, ki, kd, minimum, maximum):
+        """
+        Args:
+            kp, ki, kd (float): Gains, output per unit of error, of error
+                                times seconds and of error per second.
+            minimum, maximum (float): Output limits.
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.minimum = minimum
+        self.maximum = maximum
+        self.integral = 0.0
+        self.last_error = None
+
+    def update(self, setpoint, measured, dt, feedforward=0.0):
+        """
+        Args:
+            setpoint (float): Wanted value.
+            measured (float): Measured value.
+            dt (float): Seconds since the last update.
+            feedforward (float): Output expected to hold the setpoint, to
+                                 which the PID's correction is added.
+
+        Returns:
+            float: Output, within the limits.
+        """
+        error = setpoint - measured
+        derivative = (error - self.last_error) / dt if self.last_error is not None and dt > 0 else 0.0
+        self.last_error = error
+        integral = self.integral + error * dt
+        output = feedforward + self.kp * error + self.ki * integral + self.kd * derivative
+        if self.minimum < output < self.maximum:
+            # Only integrate while the output is not saturated, so the integral
+            # does not wind up while the motor is already flat out
+            self.integral = integral
+        return max(self.minimum, min(self.maximum, output))
@@ -0,0 +1,97 @@
+"""
+Payload decoders keyed by MQTT v5 content type.
+
+JSON is always available and is used whenever a message has no content type
+(MQTT 3.1.1, or a v5 publisher that did not set one). CBOR and MessagePack are
+used when the optional cbor2 / msgpack packages are installed (listed in
+requirements-optional.txt); they give smaller payloads on the metered
+cellular link and decode large instruction lists faster than JSON.
+"""
+
+import json
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+CBOR = "application/cbor"
+MSGPACK = "application/msgpack"
+
+# Other names publishers use for the same encodings
+ALIASES = {
+    "text/json": JSON,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+
+class UnsupportedContentType(ValueError):
+    """Raised for a content type with no decoder installed."""
+
+
+def _json_is_object(payload):
+    return payload.lstrip()[:1] == b"{"
+
+
+def _cbor_is_object(payload):
+    # Major type 5 (map) is 0xa0-0xbf; 0xd9d9f7 is the optional self-describe tag
+    if payload[:3] == b"\xd9\xd9\xf7":
+        payload = payload[3:]
+    return payload[:1] != b"" and 0xa0 <= payload[0] <= 0xbf
+
+
+def _msgpack_is_object(payload):
+    # fixmap 0x80-0x8f, map16 0xde, map32 0xdf
+    return payload[:1] != b"" and (0x80 <= payload[0] <= 0x8f or payload[0] in (0xde, 0xdf))
+
+
+class Codec:
+    def __init__(self, content_type, decode, is_object):
+        self.content_type = content_type
+        self.decode = decode
+        # Cheap check on the first bytes, used to reject payloads before decoding
+        self.is_object = is_object
+
+
+CODECS = {JSON: Codec(JSON, json.loads, _json_is_object)}
+if cbor2 is not None:
+    CODECS[CBOR] = Codec(CBOR, cbor2.loads, _cbor_is_object)
+if msgpack is not None:
+    CODECS[MSGPACK] = Codec(MSGPACK, lambda payload: msgpack.unpackb(payload, raw=False), _msgpack_is_object)
+
+
+def get_codec(content_type=None):
+    """
+    Get the decoder for a content type.
+
+    Args:
+        content_type (str): MQTT v5 content type, may include parameters such
+                            as "; charset=utf-8". None means JSON.
+
+    Returns:
+        Codec: Decoder and object check for the content type.
+
+    Raises:
+        UnsupportedContentType: If no decoder is installed for it.
+    """
+    if not content_type:
+        return CODECS[JSON]
+    name = content_type.split(";", 1)[0].strip().lower()
+    name = ALIASES.get(name, name)
+    codec = CODECS.get(name)
+    if codec is None:
+        raise UnsupportedContentType(f"no decoder for content type {content_type}")
+    return codec
+
+
+def supported_content_types():
+    """Content types this controller can decode, preferred first."""
+    preferred = [CBOR, MSGPACK, JSON]
+    return [content_type for content_type in preferred if content_type in CODECS]
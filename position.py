@@ -0,0 +1,103 @@
+"""
+Absolute worm position, persisted across restarts.
+
+The worm's encoder count is kept as an absolute position from the slot the
+worm was last aligned at, together with the goal, the position the last
+command asked for. Each command moves to a new goal rather than a distance
+from wherever the worm came to rest, so coast and rounding errors do not add
+up over a day of orders. A flag records whether the worm is aligned with its
+slots; a rotation that stalled part way clears it until the worm is sent to
+a slot or homed.
+
+Both are stored in a small file mapped into memory, so the encoder callback
+can store the position on every count for the price of a memory write. The
+position reaches the disk when the OS writes the mapped page back, so it
+survives the process crashing but not necessarily a power cut.
+"""
+
+import mmap
+import os
+import struct
+import threading
+
+DEFAULT_POSITION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worm_position.bin")
+
+MAGIC = b"DFWP"
+VERSION = 2
+HEADER = struct.Struct("<4sI")  # magic, version
+POSITION = struct.Struct("<q")  # encoder counts, or 1/0 for the aligned flag
+POSITION_OFFSET = HEADER.size
+GOAL_OFFSET = POSITION_OFFSET + POSITION.size
+ALIGNED_OFFSET = GOAL_OFFSET + POSITION.size
+SIZE = ALIGNED_OFFSET + POSITION.size
+
+
+class PositionStore:
+    """
+    Worm position, goal and aligned flag in a memory-mapped file.
+    """
+
+    def __init__(self, path=DEFAULT_POSITION_PATH):
+        """
+        Args:
+            path (str): Position file. Created on first use.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.map = None
+
+    def load(self):
+        """
+        Map the file and read the stored position.
+
+        Returns:
+            tuple: (position, goal, aligned), the first two in encoder counts,
+                   or None if there was no valid file and the worm's position
+                   is not known.
+        """
+        with self.lock:
+            self.file = open(self.path, "a+b")
+            self.file.seek(0)
+            data = self.file.read(SIZE)
+            stored = None
+            if len(data) == SIZE and HEADER.unpack_from(data) == (MAGIC, VERSION):
+                stored = (POSITION.unpack_from(data, POSITION_OFFSET)[0], POSITION.unpack_from(data, GOAL_OFFSET)[0],
+                          bool(POSITION.unpack_from(data, ALIGNED_OFFSET)[0]))
+            else:
+                self.file.truncate(0)
+                self.file.truncate(SIZE)
+            self.map = mmap.mmap(self.file.fileno(), SIZE)
+            self.map[:HEADER.size] = HEADER.pack(MAGIC, VERSION)
+            if stored is None:
+                self.store(0, 0, aligned=True)
+            return stored
+
+    def store(self, position, goal=None, aligned=None):
+        """
+        Store the position, and the goal and aligned flag unless they are
+        None. Does nothing before load().
+        """
+        buffer = self.map
+        if buffer is None:
+            return
+        POSITION.pack_into(buffer, POSITION_OFFSET, position)
+        if goal is not None:
+            POSITION.pack_into(buffer, GOAL_OFFSET, round(goal))
+        if aligned is not None:
+            POSITION.pack_into(buffer, ALIGNED_OFFSET, int(aligned))
+
+    def flush(self):
+        """Write the mapped page to disk now."""
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+                self.map.close()
+                self.file.close()
+                self.map = None
+                self.file = None
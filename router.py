@@ -0,0 +1,269 @@
+"""
+MQTT topic router.
+
+Handlers are bound to MQTT topic filters (with + and # wildcards) and matched
+through a trie built at registration time. Each route can carry a payload
+schema that is compiled once into a validator, and payloads that are too large
+or clearly not an object are rejected before they are decoded. Payloads are
+JSON unless the message carries another content type (see payload_codecs).
+"""
+
+from payload_codecs import get_codec, UnsupportedContentType
+
+# Payloads larger than this are rejected without being decoded
+DEFAULT_MAX_PAYLOAD = 8192
+
+# Number of distinct topics whose matching routes are remembered
+MATCH_CACHE_SIZE = 1024
+
+# Shorthand spec for any JSON number
+NUMBER = (int, float)
+
+
+class optional:
+    """Marks a schema field that may be missing or null."""
+
+    def __init__(self, spec):
+        self.spec = spec
+
+
+def _compile_spec(spec, path):
+    """Compile one schema spec into a function returning an error string or None."""
+    if isinstance(spec, dict):
+        fields = [(name, _compile_field(name, field_spec, f"{path}.{name}"))
+                  for name, field_spec in spec.items()]
+
+        def check_object(value):
+            if not isinstance(value, dict):
+                return f"{path} must be an object"
+            for name, check in fields:
+                error = check(value)
+                if error:
+                    return error
+            return None
+        return check_object
+
+    if isinstance(spec, list):
+        if len(spec) != 1:
+            raise ValueError(f"List spec at {path} must have exactly one item spec")
+        check_item = _compile_spec(spec[0], f"{path}[]")
+
+        def check_list(value):
+            if not isinstance(value, list):
+                return f"{path} must be a list"
+            for item in value:
+                error = check_item(item)
+                if error:
+                    return error
+            return None
+        return check_list
+
+    if isinstance(spec, (type, tuple)):
+        # bool is an int subclass, but true/false is never a valid number here
+        types = spec if isinstance(spec, tuple) else (spec,)
+        reject_bool = bool not in types and object not in types
+
+        def check_type(value):
+            if not isinstance(value, spec) or (reject_bool and isinstance(value, bool)):
+                return f"{path} has wrong type {type(value).__name__}"
+            return None
+        return check_type
+
+    raise ValueError(f"Unsupported schema spec at {path}: {spec!r}")
+
+
+def _compile_field(name, spec, path):
+    required = not isinstance(spec, optional)
+    check_value = _compile_spec(spec if required else spec.spec, path)
+
+    def check_field(obj):
+        value = obj.get(name)
+        if value is None:
+            return f"{path} is required" if required else None
+        return check_value(value)
+    return check_field
+
+
+def compile_schema(schema):
+    """
+    Compile a payload schema into a validator.
+
+    A schema is a dict mapping field names to specs. A spec is a type or tuple
+    of types (object accepts any value), a one-item list [spec] for a list of
+    items, a nested dict, or optional(spec) for a field that may be left out.
+
+    Args:
+        schema (dict): Schema for the top-level JSON object.
+
+    Returns:
+        function: validator(payload) returning an error message, or None if valid.
+    """
+    return _compile_spec(schema, "payload")
+
+
+class Route:
+    def __init__(self, topic_filter, handler, validator, max_size):
+        self.topic_filter = topic_filter
+        self.handler = handler
+        self.validator = validator
+        self.max_size = max_size
+
+
+class _Node:
+    __slots__ = ("children", "plus", "hash_routes", "routes")
+
+    def __init__(self):
+        self.children = {}
+        self.plus = None
+        self.hash_routes = []
+        self.routes = []
+
+
+class TopicRouter:
+    """
+    Routes MQTT messages to handlers registered on topic filters.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._filters = []
+        self._cache = {}
+
+    def add(self, topic_filter, handler, schema=None, max_size=DEFAULT_MAX_PAYLOAD):
+        """
+        Register a handler for a topic filter.
+
+        Args:
+            topic_filter (str): MQTT topic filter, may contain + and #.
+            handler (function): Called as handler(*context, topic, payload)
+                                with the decoded JSON payload.
+            schema (dict): Optional schema, compiled now (see compile_schema).
+            max_size (int): Largest accepted payload in bytes.
+        """
+        levels = topic_filter.split("/")
+        if "#" in levels[:-1]:
+            raise ValueError(f"'#' must be the last level of {topic_filter}")
+
+        validator = compile_schema(schema) if schema is not None else None
+        route = Route(topic_filter, handler, validator, max_size)
+
+        node = self._root
+        for level in levels:
+            if level == "#":
+                node.hash_routes.append(route)
+                break
+            if level == "+":
+                if node.plus is None:
+                    node.plus = _Node()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, _Node())
+        else:
+            node.routes.append(route)
+
+        self._filters.append(topic_filter)
+        self._cache.clear()
+
+    def route(self, topic_filter, schema=None, max_size=DEFAULT_MAX_PAYLOAD):
+        """Decorator form of add()."""
+        def decorator(handler):
+            self.add(topic_filter, handler, schema, max_size)
+            return handler
+        return decorator
+
+    def filters(self):
+        """Get all registered topic filters in registration order."""
+        return list(self._filters)
+
+    def match(self, topic):
+        """
+        Find the routes whose filter matches a topic.
+
+        Args:
+            topic (str): Concrete topic of a received message.
+
+        Returns:
+            list: Matching Route objects.
+        """
+        matched = []
+        nodes = [self._root]
+        for level in topic.split("/"):
+            next_nodes = []
+            for node in nodes:
+                matched.extend(node.hash_routes)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.plus is not None:
+                    next_nodes.append(node.plus)
+            if not next_nodes:
+                return matched
+            nodes = next_nodes
+
+        for node in nodes:
+            matched.extend(node.routes)
+            # "a/#" also matches "a" itself
+            matched.extend(node.hash_routes)
+        return matched
+
+    def dispatch(self, topic, payload, *context, content_type=None):
+        """
+        Validate a raw payload and pass it to every matching handler.
+
+        Args:
+            topic (str): Topic the message arrived on.
+            payload (bytes): Raw message payload.
+            *context: Extra leading arguments passed to each handler.
+            content_type (str): MQTT v5 content type of the payload, None for JSON.
+
+        Returns:
+            bool: True if at least one route matched the topic, even if the
+                  payload was then rejected.
+        """
+        routes = self._cache.get(topic)
+        if routes is None:
+            routes = self.match(topic)
+            if len(self._cache) < MATCH_CACHE_SIZE:
+                self._cache[topic] = routes
+        if not routes:
+            return False
+
+        try:
+            codec = get_codec(content_type)
+        except UnsupportedContentType as e:
+            print(f"Rejected payload on {topic}: {e}")
+            return True
+
+        # Checked once against the most generous route, so a payload one route
+        # takes is not also logged as rejected by a catch-all with a lower limit
+        max_size = max(route.max_size for route in routes)
+        if len(payload) > max_size:
+            print(f"Rejected {len(payload)} byte payload on {topic}: larger than {max_size} bytes")
+            return True
+
+        decoded = None
+        for route in routes:
+            if len(payload) > route.max_size:
+                continue
+
+            if decoded is None:
+                if route.validator is not None and not codec.is_object(payload):
+                    print(f"Rejected payload on {topic}: not a {codec.content_type} object")
+                    continue
+                try:
+                    decoded = codec.decode(payload)
+                except Exception as e:
+                    print(f"Rejected payload on {topic}: invalid {codec.content_type} ({e})")
+                    return True
+
+            if route.validator is not None:
+                error = route.validator(decoded)
+                if error:
+                    print(f"Rejected payload on {topic}: {error}")
+                    continue
+
+            try:
+                route.handler(*context, topic, decoded)
+            except Exception as e:
+                print(f"Error handling message on {topic}: {e}")
+        return True
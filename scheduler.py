@@ -0,0 +1,507 @@
+"""
+Pipelined order scheduler.
+
+Every purchase is compiled into a dependency graph of motion steps: one node
+per worm rotation, the elevator ascent, grabber servo steps 1-8, the descent
+and the final servo step. Each node names the actuators it needs, the nodes
+of the same order it has to follow, and the nodes of the previous order that
+must have finished before it may start. A fixed pool of worker threads runs
+whichever nodes are ready and have their actuators free, so the next order's
+worm rotations can run while the previous order's elevator is still
+returning, and no threads are created per order.
+
+When several nodes are ready, older orders go first, and within an order the
+node with the longest estimated path to the end of the order (the critical
+path) goes first. A node never takes an actuator that an older order still
+needs for a node it has not started yet, so orders finish in the order they
+were submitted.
+
+The same rules drive simulate(), which replays a list of orders in virtual
+time to estimate throughput without any hardware.
+"""
+
+import heapq
+import threading
+import time
+
+from leases import WORM, ELEVATOR, GRABBER_SERVOS
+
+DEFAULT_MAX_IN_FLIGHT = 2  # Orders allowed in the pipeline at once; 1 is the old serial flow
+DEFAULT_WORKERS = 4  # Nodes that can run at once; more than the actuator groups that can move together
+DEFAULT_LEASE_TIMEOUT = 120.0  # Seconds a node waits for its actuators before the order fails
+
+
+class Stage:
+    """
+    One node of an order's graph.
+    """
+
+    def __init__(self, name, resources, run=None, after=(), gate=(), duration=0.0, kind=None, keep_lease=False):
+        """
+        Args:
+            name (str): Node name, unique within an order.
+            resources (iterable): Actuators the node uses exclusively.
+            run (callable): Called as run(order) on a worker thread.
+            after (iterable): Nodes of the same order that must finish first.
+            gate (iterable): Nodes of the previous order that must finish first.
+            duration (float or callable): Estimated seconds, or duration(order).
+                                          Used for critical-path priority and
+                                          by simulate().
+            kind (str): Name metrics are grouped under, default the node name.
+            keep_lease (bool): Keep the lease on the node's actuators after it
+                               succeeds, for the next node of the order on
+                               the same actuators, so no remote command can
+                               take them in between. Released when that node
+                               finishes or the order ends.
+        """
+        self.name = name
+        self.resources = frozenset(resources)
+        self.run = run
+        self.after = frozenset(after)
+        self.gate = frozenset(gate)
+        self.duration = duration
+        self.kind = kind or name
+        self.keep_lease = keep_lease
+
+    def estimate(self, order):
+        """Estimated run time of this node for an order, in seconds."""
+        return self.duration(order) if callable(self.duration) else self.duration
+
+
+class Order:
+    """
+    An order moving through the pipeline.
+    """
+
+    def __init__(self, sequence, instructions, order_id=None, parts=None):
+        self.sequence = sequence
+        self.instructions = instructions
+        self.order_id = order_id
+        # (order id, instructions) of each purchase merged into this order, see batching.py
+        self.parts = parts or [(order_id, instructions)]
+        self.context = {}   # values handed from one node to the next
+        self.leases = {}    # actuators -> lease kept from one node to the next, see Stage.keep_lease
+        self.stages = []    # compiled graph, in priority order
+        self.rank = {}      # node name -> estimated seconds from its start to the end of the order
+        self.started = set()
+        self.running = set()
+        self.done = set()
+        self.error = None
+        self.finished = False
+        self.previous = None  # previous order, until this one finishes
+        self.submitted_at = None
+        self.submitted_ns = None
+        self.finished_at = None
+
+
+def critical_path(stages, order):
+    """
+    Rank every node by the longest estimated path from its start to the end
+    of the order.
+
+    Returns:
+        dict: Node name -> seconds.
+
+    Raises:
+        ValueError: If the graph has unknown dependencies or a cycle.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("stage names must be unique")
+    children = {name: [] for name in by_name}
+    for stage in stages:
+        unknown = stage.after - set(by_name)
+        if unknown:
+            raise ValueError(f"stage {stage.name} depends on unknown stages {sorted(unknown)}")
+        for parent in stage.after:
+            children[parent].append(stage.name)
+
+    rank = {}
+    visiting = set()
+
+    def visit(name):
+        if name in rank:
+            return rank[name]
+        if name in visiting:
+            raise ValueError(f"dependency cycle through stage {name}")
+        visiting.add(name)
+        rank[name] = by_name[name].estimate(order) + max((visit(child) for child in children[name]), default=0.0)
+        visiting.discard(name)
+        return rank[name]
+
+    for name in by_name:
+        visit(name)
+    return rank
+
+
+class Pipeline:
+    """
+    Readiness rules shared by OrderScheduler and simulate(). Not thread safe.
+    """
+
+    def __init__(self, plan, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """
+        Args:
+            plan (callable or list): plan(order) returning the order's nodes,
+                                     or one node list used for every order.
+            max_in_flight (int): Orders allowed in the pipeline at once.
+        """
+        self.plan = plan if callable(plan) else (lambda order: list(plan))
+        self.max_in_flight = max_in_flight
+        self.orders = []  # in flight, oldest first
+        self.busy = set()  # actuators in use
+        self.last = None
+
+    def has_room(self):
+        return len(self.orders) < self.max_in_flight
+
+    def admit(self, order):
+        """
+        Compile an order's graph and add it to the pipeline.
+
+        Raises:
+            ValueError: If the compiled graph is invalid.
+        """
+        stages = self.plan(order)
+        order.rank = critical_path(stages, order)
+        order.stages = sorted(stages, key=lambda stage: -order.rank[stage.name])
+        order.previous = self.last
+        self.last = order
+        self.orders.append(order)
+
+    def ready(self, limit=None):
+        """
+        Claim the actuators of nodes that can start now, highest priority first.
+
+        Args:
+            limit (int): Claim at most this many nodes, None for all of them.
+
+        Returns:
+            list: (order, stage) pairs, to be run and then passed to finish().
+        """
+        startable = []
+        reserved = set()  # actuators older orders still need for unstarted nodes
+        for order in self.orders:
+            previous = order.previous
+            pending = set()
+            for stage in order.stages:
+                if limit is not None and len(startable) >= limit:
+                    return startable
+                if stage.name in order.started or order.error is not None:
+                    continue
+                pending |= stage.resources
+                if not stage.after <= order.done:
+                    continue
+                if previous is not None and not previous.finished and not stage.gate <= previous.done:
+                    continue
+                if stage.resources & (self.busy | reserved):
+                    continue
+                self.busy |= stage.resources
+                order.started.add(stage.name)
+                order.running.add(stage.name)
+                startable.append((order, stage))
+            reserved |= pending
+        return startable
+
+    def finish(self, order, stage, error=None):
+        """
+        Record a node as done and release its actuators.
+
+        A failed node fails the whole order: its remaining nodes are skipped.
+
+        Returns:
+            bool: True if this finished the order.
+        """
+        self.busy -= stage.resources
+        order.running.discard(stage.name)
+        order.done.add(stage.name)
+        if error is not None and order.error is None:
+            order.error = error
+        if order.running or (order.error is None and len(order.done) < len(order.stages)):
+            return False
+        order.finished = True
+        order.previous = None
+        self.orders.remove(order)
+        return True
+
+    def idle(self):
+        return not self.orders
+
+
+class OrderScheduler:
+    """
+    Runs orders through a Pipeline on a fixed pool of worker threads.
+    """
+
+    def __init__(self, plan, max_in_flight=DEFAULT_MAX_IN_FLIGHT, on_order_done=None, leases=None,
+                 lease_timeout=DEFAULT_LEASE_TIMEOUT, workers=DEFAULT_WORKERS, tracer=None):
+        """
+        Args:
+            plan (callable or list): Compiles an order into nodes, see purchase_plan().
+            max_in_flight (int): Orders allowed in the pipeline at once.
+            on_order_done (callable): Called as on_order_done(order) once an
+                                      order has finished or failed; order.error
+                                      is the exception, if any.
+            leases (LeaseManager): If given, each node runs holding an
+                                   exclusive lease on its actuators, which
+                                   keeps remote commands off them meanwhile.
+            lease_timeout (float): Seconds a node waits for its lease.
+            workers (int): Worker threads, started here and kept for the
+                           scheduler's lifetime.
+            tracer (Tracer): If given, every node is traced as a span named
+                             after its kind, and every order as "order".
+        """
+        self.pipeline = Pipeline(plan, max_in_flight)
+        self.on_order_done = on_order_done
+        self.leases = leases
+        self.lease_timeout = lease_timeout
+        self.tracer = tracer
+        self.condition = threading.Condition()
+        self.sequence = 0
+
+        self.completed = 0
+        self.failed = 0
+        self.first_submitted_at = None
+        self.stage_seconds = {}  # stage kind -> total seconds
+
+        self.workers = [threading.Thread(target=self._work, name=f"scheduler-{i}", daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, instructions, order_id=None, timeout=None, parts=None):
+        """
+        Add an order to the pipeline, waiting while it is full.
+
+        Args:
+            instructions (list): Worm rotations for the order.
+            order_id (str): Order id, passed through to the nodes.
+            timeout (float): Seconds to wait for room, None waits forever.
+            parts (list): (order id, instructions) of each purchase merged
+                          into this order, default just this one.
+
+        Returns:
+            Order: The admitted order, or None on timeout.
+
+        Raises:
+            ValueError: If the order's graph is invalid.
+        """
+        with self.condition:
+            if not self.condition.wait_for(self.pipeline.has_room, timeout):
+                return None
+            self.sequence += 1
+            order = Order(self.sequence, instructions, order_id, parts)
+            order.submitted_at = time.monotonic()
+            order.submitted_ns = time.monotonic_ns()
+            self.pipeline.admit(order)
+            if self.first_submitted_at is None:
+                self.first_submitted_at = order.submitted_at
+            self.condition.notify_all()
+        return order
+
+    def wait_room(self, timeout=None):
+        """
+        Block until the pipeline can take another order.
+
+        Returns:
+            bool: True if there is room, False on timeout.
+        """
+        with self.condition:
+            return self.condition.wait_for(self.pipeline.has_room, timeout)
+
+    def _work(self):
+        while True:
+            with self.condition:
+                claimed = self.pipeline.ready(limit=1)
+                while not claimed:
+                    self.condition.wait()
+                    claimed = self.pipeline.ready(limit=1)
+            order, stage = claimed[0]
+            self._run_stage(order, stage)
+
+    def _run_stage(self, order, stage):
+        started = time.monotonic()
+        started_ns = time.monotonic_ns()
+        error = None
+        lease = None
+        try:
+            if stage.run is not None:
+                if self.leases is not None:
+                    lease = order.leases.pop(stage.resources, None)
+                    if lease is None or not lease.active:
+                        lease = self.leases.acquire(*stage.resources, owner=f"order {order.order_id} {stage.name}",
+                                                    timeout=self.lease_timeout)
+                stage.run(order)
+        except Exception as e:
+            print(f"Error in stage {stage.name} of order {order.order_id}: {e}")
+            error = e
+        if lease is not None:
+            if stage.keep_lease and error is None:
+                order.leases[stage.resources] = lease
+            else:
+                lease.release()
+
+        with self.condition:
+            self.stage_seconds[stage.kind] = self.stage_seconds.get(stage.kind, 0.0) + time.monotonic() - started
+            finished = self.pipeline.finish(order, stage, error)
+            if finished:
+                order.finished_at = time.monotonic()
+                # A failed order never reaches the node a kept lease was meant for
+                for kept in order.leases.values():
+                    kept.release()
+                order.leases.clear()
+                if order.error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            self.condition.notify_all()
+
+        if self.tracer is not None:
+            end_ns = time.monotonic_ns()
+            for order_id, _ in order.parts:
+                self.tracer.record(stage.kind, order_id, started_ns, end_ns)
+                if finished:
+                    self.tracer.record("order", order_id, order.submitted_ns, end_ns)
+
+        if finished and self.on_order_done:
+            try:
+                self.on_order_done(order)
+            except Exception as e:
+                print(f"Error in order done callback: {e}")
+
+    def idle(self):
+        """True if no order is in the pipeline."""
+        with self.condition:
+            return self.pipeline.idle()
+
+    def wait_idle(self, timeout=None):
+        """
+        Block until every submitted order has finished.
+
+        Returns:
+            bool: True if idle, False on timeout.
+        """
+        with self.condition:
+            return self.condition.wait_for(self.pipeline.idle, timeout)
+
+    def metrics(self):
+        """
+        Get a snapshot of scheduler metrics.
+
+        Returns:
+            dict: Order counts, orders per hour since the first order, and
+                  total seconds spent in each kind of node.
+        """
+        with self.condition:
+            elapsed = time.monotonic() - self.first_submitted_at if self.first_submitted_at else 0.0
+            return {
+                'in_flight': len(self.pipeline.orders),
+                'completed': self.completed,
+                'failed': self.failed,
+                'orders_per_hour': self.completed * 3600 / elapsed if elapsed else 0.0,
+                'stage_seconds': dict(self.stage_seconds),
+            }
+
+
+def purchase_plan(runners=None, durations=None):
+    """
+    Compiler for purchases, matching main.on_purchase.
+
+    Each worm rotation is a node, run in instruction order alongside a full
+    elevator and grabber cycle. Once both are done the elevator ascends, the
+    grabber runs servo steps 1-8, the elevator descends and the grabber runs
+    the final servo step. The grabber servos stay leased from the grab to the
+    final step, since the pot is held while the elevator descends. The next
+    order's first rotation may start as soon as this order's grabber
+    sequence is done.
+
+    Args:
+        runners (dict): Node kind -> callable. "worm" is called as
+                        run(order, index) for each instruction, the others
+                        ("elevator_cycle", "ascend", "grab", "descend",
+                        "release") as run(order). Missing ones do nothing.
+        durations (dict): Estimated seconds: "worm" per instruction, plus
+                          "ascend", "grab", "descend" and "release". The
+                          parallel elevator cycle is their sum.
+
+    Returns:
+        callable: plan(order) returning the order's nodes.
+    """
+    runners = runners or {}
+    durations = durations or {}
+    cycle = sum(durations.get(name, 0.0) for name in ("ascend", "grab", "descend", "release"))
+    rotate = runners.get("worm")
+
+    def plan(order):
+        stages = []
+        previous = None
+        for index in range(len(order.instructions)):
+            name = f"worm{index}"
+            stages.append(Stage(
+                name, {WORM}, (lambda order, index=index: rotate(order, index)) if rotate else None,
+                after={previous} if previous else (), gate=() if previous else {"grab"},
+                duration=durations.get("worm", 0.0), kind="worm"))
+            previous = name
+
+        stages.append(Stage("elevator_cycle", {ELEVATOR, *GRABBER_SERVOS}, runners.get("elevator_cycle"),
+                            duration=cycle))
+        stages.append(Stage("ascend", {ELEVATOR}, runners.get("ascend"),
+                            after={"elevator_cycle", previous} if previous else {"elevator_cycle"},
+                            duration=durations.get("ascend", 0.0)))
+        stages.append(Stage("grab", set(GRABBER_SERVOS), runners.get("grab"), after={"ascend"},
+                            duration=durations.get("grab", 0.0), keep_lease=True))
+        stages.append(Stage("descend", {ELEVATOR}, runners.get("descend"), after={"grab"},
+                            duration=durations.get("descend", 0.0)))
+        stages.append(Stage("release", set(GRABBER_SERVOS), runners.get("release"), after={"descend"},
+                            duration=durations.get("release", 0.0)))
+        return stages
+
+    return plan
+
+
+def simulate(plan, orders, max_in_flight=DEFAULT_MAX_IN_FLIGHT, workers=DEFAULT_WORKERS):
+    """
+    Run orders through the pipeline in virtual time, all submitted at time 0.
+
+    Args:
+        plan (callable or list): Order compiler with duration estimates.
+        orders (list): Instruction list of each order.
+        max_in_flight (int): Orders allowed in the pipeline at once.
+        workers (int): Nodes that may run at once.
+
+    Returns:
+        dict: Total time, orders per hour, average order latency (seconds
+              from entering the pipeline to finishing) and the
+              (order sequence, node, start, end) timeline.
+    """
+    pipeline = Pipeline(plan, max_in_flight)
+    waiting = [Order(sequence, instructions) for sequence, instructions in enumerate(orders, 1)]
+    waiting.reverse()
+    events = []  # (end time, tie breaker, order, stage)
+    timeline = []
+    latencies = []
+    now = 0.0
+
+    def start_ready():
+        while waiting and pipeline.has_room():
+            order = waiting.pop()
+            order.submitted_at = now
+            pipeline.admit(order)
+        for order, stage in pipeline.ready(limit=workers - len(events)):
+            end = now + stage.estimate(order)
+            heapq.heappush(events, (end, len(timeline), order, stage))
+            timeline.append((order.sequence, stage.name, now, end))
+
+    start_ready()
+    while events:
+        now, _, order, stage = heapq.heappop(events)
+        if pipeline.finish(order, stage):
+            latencies.append(now - order.submitted_at)
+        start_ready()
+
+    return {
+        'seconds': now,
+        'orders_per_hour': len(orders) * 3600 / now if now else 0.0,
+        'avg_latency': sum(latencies) / len(latencies) if latencies else 0.0,
+        'timeline': timeline,
+    }
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""
+Virtual-time whole-machine simulator.
+
+Replaces the hardware libraries (RPi.GPIO, pigpio, smbus2, board,
+adafruit_dht, keyboard) with models of the machine and runs the real main.py
+purchase path against them, so the purchase flow can be exercised and
+benchmarked on any computer:
+
+- the worm motor spins up and coasts down with a time constant, at a speed
+  set by its PWM duty cycle, and produces quadrature edges on the encoder
+  pins through the pigpio callbacks, so rotary_encoder and Worm count them
+  exactly as on the machine; Machine.jam() jams it at a count, to exercise
+  the stall recovery;
+- the elevator stepper counts PUL pulses in the direction of the DIR pin,
+  and the VL53L0X reports a distance that follows the elevator's travel;
+- the grabber servos follow their PWM angle at a fixed speed, and a new
+  command arriving before the last move finished is counted.
+
+Time runs faster than real time by --speedup: time.sleep(), time.monotonic()
+and friends are replaced with a virtual clock. Sleeps are gathered per
+thread and only slept for real once they add up to more than a few virtual
+milliseconds, so the elevator's 0.1 ms step delays cost next to nothing.
+Computation is not free though: it takes real time, which is scaled up like
+everything else, so a speedup much above the ratio between this computer and
+the Pi makes busy loops (the elevator pulsing its stepper) look slower than
+they are. The report flags the run when the encoder model fell behind.
+
+The exit status is non-zero if the throughput is below --min-orders-per-hour,
+so the script can be used as a regression gate for timing changes.
+
+Usage: python simulator.py [--orders 20] [--instructions 1] [--speedup 20] [--min-orders-per-hour 0]
+"""
+
+import argparse
+import contextlib
+import importlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from config import machine_config
+
+DEFAULT_SPEEDUP = 20.0
+SLEEP_QUANTUM = 0.005  # Virtual seconds of sleep gathered before sleeping for real
+
+# Pins, as the controller reads them from machine.toml
+WORM_ENABLE_PIN = machine_config().worm.enable_pin
+WORM_IN1_PIN = machine_config().worm.in1_pin
+WORM_IN2_PIN = machine_config().worm.in2_pin
+ENCODER_A_PIN = machine_config().worm.encoder_a_pin
+ENCODER_B_PIN = machine_config().worm.encoder_b_pin
+ELEVATOR_DIR_PIN = machine_config().elevator.dir_pin
+ELEVATOR_PUL_PIN = machine_config().elevator.pul_pin
+SERVO_PINS = machine_config().grabber.pins
+VL53L0X_ADDR = machine_config().elevator.sensor_address
+
+# Machine model
+WORM_COUNTS_PER_SECOND = 1300.0  # Encoder counts per second at 100% duty
+WORM_TIME_CONSTANT = 0.05        # Seconds for the worm to reach 63% of a new speed
+ENCODER_TICK = 0.001             # Virtual seconds between encoder model updates
+ENCODER_LATE = 0.050             # Virtual seconds between updates that cost the worm visible overshoot
+ELEVATOR_FLOOR_MM = 50.0         # VL53L0X reading with the elevator at the bottom
+ELEVATOR_MM_PER_STEP = 0.02      # Travel per microstep
+VL53L0X_RANGE_TIME = 0.03        # Seconds per ranging measurement
+SERVO_DEGREES_PER_SECOND = 300.0
+
+
+class VirtualClock:
+    """
+    Clock running --speedup times faster than real time, installed over the
+    time module's functions.
+    """
+
+    def __init__(self, speedup=DEFAULT_SPEEDUP, quantum=SLEEP_QUANTUM):
+        self.speedup = speedup
+        self.quantum = quantum
+        self.real_monotonic = time.monotonic
+        self.real_sleep = time.sleep
+        self.real_time = time.time
+        self.start_real = self.real_monotonic()
+        self.wall_offset = self.real_time() - self.start_real
+        self.local = threading.local()  # per thread: virtual time its sleeps run until, oversleep
+        self.saved = None
+
+    def monotonic(self):
+        return self.start_real + (self.real_monotonic() - self.start_real) * self.speedup
+
+    def monotonic_ns(self):
+        return int(self.monotonic() * 1e9)
+
+    def time(self):
+        return self.monotonic() + self.wall_offset
+
+    def time_ns(self):
+        return int(self.time() * 1e9)
+
+    def sleep(self, seconds):
+        """
+        Sleep in virtual time. Short sleeps add up per thread, so a thread
+        sleeping 0.1 ms a thousand times sleeps for real once or twice.
+        """
+        now = self.monotonic()
+        # Time since the last sleep was spent computing and counts; time the
+        # last real sleep overran by does not
+        due = max(getattr(self.local, "due", 0.0), now - getattr(self.local, "overslept", 0.0))
+        due += max(0.0, seconds)
+        self.local.due = due
+        if due - now > self.quantum:
+            self.real_sleep((due - now) / self.speedup)
+            self.local.overslept = max(0.0, self.monotonic() - due)
+
+    def install(self):
+        """Replace time.sleep(), time.monotonic() etc. with the virtual clock."""
+        names = ("sleep", "monotonic", "monotonic_ns", "perf_counter", "perf_counter_ns", "time", "time_ns")
+        self.saved = {name: getattr(time, name) for name in names}
+        time.sleep = self.sleep
+        time.monotonic = time.perf_counter = self.monotonic
+        time.monotonic_ns = time.perf_counter_ns = self.monotonic_ns
+        time.time = self.time
+        time.time_ns = self.time_ns
+
+    def uninstall(self):
+        if self.saved:
+            for name, function in self.saved.items():
+                setattr(time, name, function)
+            self.saved = None
+
+
+class Machine:
+    """
+    State of the simulated hardware, driven through the fake libraries.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.levels = {}        # pin -> output level
+        self.duty = {}          # pin -> PWM duty cycle
+        self.edge_callbacks = {}  # pin -> [pigpio callback functions]
+
+        # Worm
+        self.worm_speed = 0.0     # counts per second, signed
+        self.worm_position = 0.0  # counts
+        self.encoder_count = 0    # whole counts already sent as edges
+        self.worm_updated = None
+        self.worm_late = 0
+        self.worm_max_late = 0.0
+        self.jam_at = None           # count the worm jams at going forwards, None if it turns freely
+        self.jam_clears = False      # whether turning back frees the jam
+        self.jam_chatter = False     # whether the encoder rocks back and forth by a count while jammed
+
+        # Elevator
+        self.elevator_steps = 0
+        self.elevator_max_steps = 0
+        self.elevator_trips = 0
+        self.range_ready_at = 0.0
+        self.range_mm = 0
+
+        # Servos
+        self.servo_moves = 0
+        self.servo_cut_short = 0
+        self.servo_angle = {}     # pin -> angle at the start of the current move
+        self.servo_target = {}    # pin -> commanded angle
+        self.servo_moved_at = {}  # pin -> virtual time of the last command
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.worm_updated = self.clock.monotonic()
+        self.thread = threading.Thread(target=self._run_encoder, name="sim-encoder", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    # GPIO
+
+    def output(self, pin, level):
+        level = 1 if level else 0
+        with self.lock:
+            previous = self.levels.get(pin, 0)
+            self.levels[pin] = level
+            if pin == ELEVATOR_PUL_PIN and level and not previous:
+                self.elevator_steps += 1 if self.levels.get(ELEVATOR_DIR_PIN, 1) else -1
+                if self.elevator_steps > self.elevator_max_steps:
+                    self.elevator_max_steps = self.elevator_steps
+                if self.elevator_steps == 0:
+                    self.elevator_trips += 1
+
+    def input(self, pin):
+        with self.lock:
+            return self.levels.get(pin, 0)
+
+    def set_duty(self, pin, duty):
+        now = self.clock.monotonic()
+        with self.lock:
+            if pin in SERVO_PINS and duty > 0:
+                self._move_servo(pin, (duty - 2.5) * 18.0, now)
+            self.duty[pin] = duty
+
+    def _move_servo(self, pin, angle, now):
+        # Called with the lock held
+        target = self.servo_target.get(pin)
+        if target is not None:
+            start = self.servo_angle[pin]
+            travelled = (now - self.servo_moved_at[pin]) * SERVO_DEGREES_PER_SECOND
+            if travelled < abs(target - start):
+                self.servo_cut_short += 1
+                target = start + travelled * (1 if target > start else -1)
+            self.servo_angle[pin] = target
+        else:
+            self.servo_angle[pin] = angle
+        self.servo_target[pin] = angle
+        self.servo_moved_at[pin] = now
+        self.servo_moves += 1
+
+    # Worm and encoder
+
+    def jam(self, at, clears_on_reverse=False, chatter=False):
+        """
+        Jam the worm at a count, as a product caught in it would.
+
+        Args:
+            at (float): Count the worm stops at going forwards, None to clear
+                        the jam.
+            clears_on_reverse (bool): Turning the worm back frees it.
+            chatter (bool): The encoder rocks back and forth by one count
+                            while the worm is driven into the jam.
+        """
+        with self.lock:
+            self.jam_at = at
+            self.jam_clears = clears_on_reverse
+            self.jam_chatter = chatter
+
+    def _worm_drive(self):
+        # Called with the lock held. L298N: IN1 low and IN2 high turns the worm
+        # counter-clockwise, which Worm counts upwards.
+        in1 = self.levels.get(WORM_IN1_PIN, 0)
+        in2 = self.levels.get(WORM_IN2_PIN, 0)
+        direction = 1 if (in2 and not in1) else -1 if (in1 and not in2) else 0
+        return direction * self.duty.get(WORM_ENABLE_PIN, 0) / 100.0 * WORM_COUNTS_PER_SECOND
+
+    def _run_encoder(self):
+        while self.running:
+            self.clock.real_sleep(ENCODER_TICK / self.clock.speedup)
+            now = self.clock.monotonic()
+            with self.lock:
+                dt = now - self.worm_updated
+                self.worm_updated = now
+                target = self._worm_drive()
+                # Only matters while the worm is moving
+                if dt > ENCODER_LATE and (target or abs(self.worm_speed) > 1.0):
+                    self.worm_late += 1
+                    self.worm_max_late = max(self.worm_max_late, dt)
+                if target < 0 and self.jam_clears:
+                    self.jam_at = None
+                self.worm_speed += (target - self.worm_speed) * min(1.0, dt / WORM_TIME_CONSTANT)
+                self.worm_position += self.worm_speed * dt
+                counts = int(self.worm_position) - self.encoder_count
+                if self.jam_at is not None and self.worm_position >= self.jam_at and self.worm_speed >= 0:
+                    self.worm_speed = 0.0
+                    self.worm_position = float(self.jam_at)
+                    counts = int(self.worm_position) - self.encoder_count
+                    if self.jam_chatter and target > 0 and not counts:
+                        counts = -1 if self.encoder_count >= int(self.worm_position) else 1
+                self.encoder_count += counts
+                callbacks_a = list(self.edge_callbacks.get(ENCODER_A_PIN, ()))
+                callbacks_b = list(self.edge_callbacks.get(ENCODER_B_PIN, ()))
+            tick = int(now * 1e6) & 0xFFFFFFFF
+            # One count is a full quadrature cycle; B leads A going forwards
+            if counts > 0:
+                edges = ((ENCODER_B_PIN, 1), (ENCODER_A_PIN, 1), (ENCODER_B_PIN, 0), (ENCODER_A_PIN, 0))
+            else:
+                edges = ((ENCODER_A_PIN, 1), (ENCODER_B_PIN, 1), (ENCODER_A_PIN, 0), (ENCODER_B_PIN, 0))
+            for _ in range(abs(counts)):
+                for pin, level in edges:
+                    for callback in (callbacks_a if pin == ENCODER_A_PIN else callbacks_b):
+                        callback(pin, level, tick)
+
+    # VL53L0X
+
+    def i2c_write(self, address, register, value):
+        if address == VL53L0X_ADDR and register == 0x00 and value & 0x01:
+            now = self.clock.monotonic()
+            with self.lock:
+                self.range_ready_at = now + VL53L0X_RANGE_TIME
+                self.range_mm = int(ELEVATOR_FLOOR_MM + self.elevator_steps * ELEVATOR_MM_PER_STEP)
+
+    def i2c_read(self, address, register):
+        if address != VL53L0X_ADDR:
+            raise OSError(121, "Remote I/O error")
+        with self.lock:
+            if register == 0xC0:
+                return 0xEE
+            if register == 0x14:
+                return 0x01 if self.clock.monotonic() >= self.range_ready_at else 0x00
+            if register == 0x14 + 10:
+                return (self.range_mm >> 8) & 0xFF
+            if register == 0x14 + 11:
+                return self.range_mm & 0xFF
+        return 0
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'encoder_counts': self.encoder_count,
+                'encoder_late': self.worm_late,
+                'encoder_max_late': self.worm_max_late,
+                'elevator_trips': self.elevator_trips,
+                'elevator_max_steps': self.elevator_max_steps,
+                'servo_moves': self.servo_moves,
+                'servo_cut_short': self.servo_cut_short,
+            }
+
+
+def fake_modules(machine):
+    """
+    Build stand-ins for the hardware libraries, backed by machine.
+
+    Returns:
+        dict: Module name -> module, for sys.modules.
+    """
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BCM, gpio.BOARD = 11, 10
+    gpio.OUT, gpio.IN = 0, 1
+    gpio.LOW, gpio.HIGH = 0, 1
+    gpio.PUD_OFF, gpio.PUD_DOWN, gpio.PUD_UP = 20, 21, 22
+    gpio.setmode = lambda mode: None
+    gpio.setwarnings = lambda flag: None
+    gpio.setup = lambda pin, mode, pull_up_down=None, initial=None: None
+    gpio.output = machine.output
+    gpio.input = machine.input
+    gpio.cleanup = lambda *pins: None
+
+    class PWM:
+        def __init__(self, pin, frequency):
+            self.pin = pin
+
+        def start(self, duty):
+            machine.set_duty(self.pin, duty)
+
+        def ChangeDutyCycle(self, duty):
+            machine.set_duty(self.pin, duty)
+
+        def ChangeFrequency(self, frequency):
+            pass
+
+        def stop(self):
+            machine.set_duty(self.pin, 0)
+
+    gpio.PWM = PWM
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+
+    pigpio = types.ModuleType("pigpio")
+    pigpio.INPUT, pigpio.OUTPUT = 0, 1
+    pigpio.PUD_OFF, pigpio.PUD_DOWN, pigpio.PUD_UP = 0, 1, 2
+    pigpio.RISING_EDGE, pigpio.FALLING_EDGE, pigpio.EITHER_EDGE = 0, 1, 2
+
+    class _Callback:
+        def __init__(self, pin, function):
+            self.pin = pin
+            self.function = function
+
+        def cancel(self):
+            with machine.lock:
+                callbacks = machine.edge_callbacks.get(self.pin, [])
+                if self.function in callbacks:
+                    callbacks.remove(self.function)
+
+    class Pi:
+        connected = True
+
+        def set_mode(self, pin, mode):
+            pass
+
+        def set_pull_up_down(self, pin, pud):
+            pass
+
+        def read(self, pin):
+            return machine.input(pin)
+
+        def callback(self, pin, edge=0, function=None):
+            with machine.lock:
+                machine.edge_callbacks.setdefault(pin, []).append(function)
+            return _Callback(pin, function)
+
+        def stop(self):
+            pass
+
+    pigpio.pi = Pi
+
+    smbus2 = types.ModuleType("smbus2")
+
+    class SMBus:
+        def __init__(self, bus=None):
+            self.bus = bus
+
+        def read_byte_data(self, address, register):
+            return machine.i2c_read(address, register)
+
+        def write_byte_data(self, address, register, value):
+            machine.i2c_write(address, register, value)
+
+        def close(self):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.close()
+
+    smbus2.SMBus = SMBus
+
+    board = types.ModuleType("board")
+    for pin in range(28):
+        setattr(board, f"D{pin}", pin)
+
+    adafruit_dht = types.ModuleType("adafruit_dht")
+
+    class DHT11:
+        temperature = 22.0
+        humidity = 55.0
+
+        def __init__(self, pin, use_pulseio=True):
+            self.pin = pin
+
+        def exit(self):
+            pass
+
+    adafruit_dht.DHT11 = DHT11
+
+    keyboard = types.ModuleType("keyboard")
+    keyboard.is_pressed = lambda key: False
+
+    return {
+        "RPi": rpi,
+        "RPi.GPIO": gpio,
+        "pigpio": pigpio,
+        "smbus2": smbus2,
+        "board": board,
+        "adafruit_dht": adafruit_dht,
+        "keyboard": keyboard,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--orders", type=int, default=20, help="purchases to run")
+    parser.add_argument("--instructions", type=int, default=1, help="worm rotations per purchase")
+    parser.add_argument("--rotation", type=float, default=machine_config().worm.rotation_counts,
+                        help="encoder counts per worm rotation")
+    parser.add_argument("--interval", type=float, default=0.0,
+                        help="virtual seconds between purchases, 0 queues them all at once")
+    parser.add_argument("--in-flight", type=int, default=None, help="MAX_ORDERS_IN_FLIGHT for main.py")
+    parser.add_argument("--batch", type=int, default=None, help="BATCH_MAX_ORDERS for main.py")
+    parser.add_argument("--speedup", type=float, default=DEFAULT_SPEEDUP, help="virtual seconds per real second")
+    parser.add_argument("--min-orders-per-hour", type=float, default=0,
+                        help="fail if the throughput is below this")
+    parser.add_argument("--verbose", action="store_true", help="keep main.py's console output")
+    args = parser.parse_args()
+
+    if args.in_flight is not None:
+        os.environ["MAX_ORDERS_IN_FLIGHT"] = str(args.in_flight)
+    if args.batch is not None:
+        os.environ["BATCH_MAX_ORDERS"] = str(args.batch)
+
+    clock = VirtualClock(args.speedup)
+    machine = Machine(clock)
+    sys.modules.update(fake_modules(machine))
+    # Busy threads hold the GIL between encoder updates otherwise
+    sys.setswitchinterval(0.0002)
+
+    out = sys.stdout
+    quiet = open(os.devnull, "w") if not args.verbose else sys.stdout
+    done = threading.Event()
+    finished = []
+    with contextlib.redirect_stdout(quiet):
+        clock.install()
+        try:
+            purchase = importlib.import_module("main")
+            import subscriber
+            from inventory import Inventory
+            from tracing import summarise
+            from coast import CoastTable
+            from position import PositionStore
+
+            # Keep simulated stock, traces, coast calibration and worm position out of the real files
+            state_dir = tempfile.mkdtemp()
+            purchase.inventory = subscriber.inventory = Inventory(
+                subscriber.DEVICE_ID, os.path.join(state_dir, "inventory.db"))
+            purchase.tracer.path = os.path.join(state_dir, "trace.bin")
+            # As main.init_hardware(), without the DHT11 monitor posting readings
+            purchase.worm = purchase.Worm(WORM_ENABLE_PIN, WORM_IN1_PIN, WORM_IN2_PIN, ENCODER_A_PIN, ENCODER_B_PIN,
+                                          CoastTable(os.path.join(state_dir, "coast.db")),
+                                          PositionStore(os.path.join(state_dir, "worm_position.bin")))
+            purchase.init_elevator()
+            purchase.hardware_ready.set()
+
+            on_order_done = purchase.scheduler.on_order_done
+
+            def count_done(order):
+                on_order_done(order)
+                finished.extend(order.parts)
+                if len(finished) >= args.orders:
+                    done.set()
+
+            purchase.scheduler.on_order_done = count_done
+            machine.start()
+
+            instructions = [args.rotation] * args.instructions
+            start_real = clock.real_monotonic()
+            start = time.monotonic()
+            for i in range(args.orders):
+                purchase.on_purchase(list(instructions), f"sim-{i + 1}")
+                if args.interval and i < args.orders - 1:
+                    time.sleep(args.interval)
+            done.wait()
+            elapsed = time.monotonic() - start
+            elapsed_real = clock.real_monotonic() - start_real
+            machine.stop()
+            rows = summarise(purchase.tracer.records(), args.orders)
+            scheduler = purchase.scheduler.metrics()
+            hardware = machine.metrics()
+        finally:
+            clock.uninstall()
+
+    orders_per_hour = len(finished) * 3600 / elapsed if elapsed else 0.0
+    print(f"Simulated {len(finished)} purchases of {args.instructions} rotation(s) in {elapsed:.1f} virtual s "
+          f"({elapsed_real:.1f} real s, x{elapsed / elapsed_real:.0f})", file=out)
+    print(f"Throughput: {orders_per_hour:.1f} orders/h "
+          f"({scheduler['completed']} orders completed, {scheduler['failed']} failed)", file=out)
+    print(f"Worm: {hardware['encoder_counts']} encoder counts, "
+          f"{hardware['encoder_counts'] / max(1, args.orders * args.instructions) - args.rotation:+.1f} "
+          f"counts per rotation past target", file=out)
+    print(f"Elevator: {hardware['elevator_trips']} trips of {hardware['elevator_max_steps']} steps", file=out)
+    print(f"Servos: {hardware['servo_moves']} moves, {hardware['servo_cut_short']} commanded before the last "
+          f"one finished", file=out)
+    print(f"\n{'stage':<16} {'orders':>7} {'p50 s':>9} {'p95 s':>9}", file=out)
+    for stage, count, p50, p95 in rows:
+        print(f"{stage:<16} {count:>7} {p50:>9.3f} {p95:>9.3f}", file=out)
+
+    if hardware['encoder_late']:
+        print(f"\nWARNING: the encoder model went up to {hardware['encoder_max_late'] * 1000:.0f} ms "
+              f"between updates {hardware['encoder_late']} times; lower --speedup for accurate worm timing", file=out)
+    if orders_per_hour < args.min_orders_per_hour:
+        print(f"FAIL: below the required {args.min_orders_per_hour:.0f} orders/h", file=out)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
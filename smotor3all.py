@@ -1,17 +1,28 @@
 import RPi.GPIO as GPIO
 import time
+from config import machine_config
+
+
+def describe_moves(moves):
+    """Describe (servo index, angle) moves for the console, e.g. "Servo 1 to 90°"."""
+    return ", ".join(f"Servo {servo_idx + 1} to {angle:g}°" for servo_idx, angle in moves)
+
 
 class ServoController:
+    # Last angle set on each pin, by any controller
+    angles = {}
+
     def __init__(self, servo_pins=None):
         """
         Initialize the servo controller with specified GPIO pins.
         
         Args:
             servo_pins (list): List of GPIO pins for servos [servo1_pin, servo2_pin, servo3_pin]
-                              Defaults to [17, 18, 27] if not specified
+                              Defaults to grabber.pins in machine.toml if not specified
         """
+        grabber = machine_config().grabber
         # Default pin configuration if none provided
-        self.servo_pins = servo_pins if servo_pins else [6, 13, 19]
+        self.servo_pins = list(servo_pins) if servo_pins else list(grabber.pins)
         
         # Set up GPIO
         GPIO.setmode(GPIO.BCM)
@@ -21,10 +32,10 @@ class ServoController:
         for pin in self.servo_pins:
             GPIO.setup(pin, GPIO.OUT)
         
-        # Create PWM instances for each servo (50Hz frequency)
+        # Create PWM instances for each servo (grabber.pwm_frequency, 50Hz)
         self.servos = []
         for pin in self.servo_pins:
-            servo = GPIO.PWM(pin, 50)
+            servo = GPIO.PWM(pin, grabber.pwm_frequency)
             servo.start(0)
             self.servos.append(servo)
     
@@ -39,39 +50,30 @@ class ServoController:
         if 0 <= servo_index < len(self.servos):
             duty_cycle = 2.5 + (angle / 18.0)
             self.servos[servo_index].ChangeDutyCycle(duty_cycle)
-            time.sleep(0.5)  # Allow time for the servo to reach position
+            ServoController.angles[self.servo_pins[servo_index]] = angle
+            time.sleep(machine_config().grabber.move_time)  # Allow time for the servo to reach position
         else:
             print(f"Error: Invalid servo index {servo_index}")
     
     def run_sequence(self, verbose=True):
         """
-        Run the predefined sequence of servo movements.
+        Run the grabber sequence from the machine config, release step included.
         
         Args:
             verbose (bool): Whether to print status messages
         """
-        steps = [
-            (1, "Setting initial positions (Servo 1: 0°, Servo 2: 45°, Servo 3: 165°)", 
-             [(0, 0), (1, 45), (2, 100)]),
-            (2, "Moving Servo 1 to 90°", [(0, 90)]),
-            (3, "Moving Servo 1 to 180°", [(0, 180)]),
-            (4, "Moving Servo 2 to 130°", [(1, 130)]),
-            (5, "Moving Servo 3 to 180°", [(2, 130)]),
-            (6, "Moving Servo 2 to 45°", [(1, 45)]),
-            (7, "Moving Servo 1 to 90°", [(0, 90)]),
-            (8, "Moving Servo 1 to 0°", [(0, 0)]),
-            (9, "Moving Servo 3 to 165°", [(2, 100)])
-        ]
+        grabber = machine_config().grabber
+        steps = list(grabber.sequence) + [grabber.release]
         
         try:
-            for step_num, description, movements in steps:
+            for step_num, movements in enumerate(steps, 1):
                 if verbose:
-                    print(f"Step {step_num}: {description}")
+                    print(f"Step {step_num}: {describe_moves(movements)}")
                 
                 for servo_idx, angle in movements:
                     self.set_angle(servo_idx, angle)
                 
-                time.sleep(1)  # Wait between steps
+                time.sleep(grabber.step_pause)  # Wait between steps
             
             if verbose:
                 print("Sequence completed!")
@@ -80,6 +82,32 @@ class ServoController:
             print(f"An error occurred: {e}")
     
 
+def move_servos(angles):
+    """
+    Move the grabber servos to the given angles, skipping those already there.
+
+    Args:
+        angles (list): Angle per servo, None to leave a servo where it is.
+
+    Returns:
+        int: Number of servos moved.
+    """
+    pins = machine_config().grabber.pins
+    moves = [(servo_idx, angle) for servo_idx, angle in enumerate(angles[:len(pins)])
+             if angle is not None and ServoController.angles.get(pins[servo_idx]) != angle]
+    if not moves:
+        return 0
+    controller = ServoController()
+    try:
+        for servo_idx, angle in moves:
+            controller.set_angle(servo_idx, angle)
+    finally:
+        # Stop the pulses so the servos do not jitter while holding
+        for servo in controller.servos:
+            servo.stop()
+    return len(moves)
+
+
 # Add this main function and if __name__ block
 def main():
     controller = ServoController()
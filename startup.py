@@ -0,0 +1,76 @@
+"""
+Parallel hardware initialisation with a startup timing report.
+
+Bringing up the hardware is mostly waiting: for the pigpio daemon socket,
+the DHT11 sensors and the I2C bus. Each part is initialised on its own
+thread, so startup takes as long as the slowest part rather than the sum of
+all of them, and the time each one took is printed so a slow boot can be
+traced to the part responsible.
+"""
+
+import threading
+import time
+
+
+class StartupStep:
+    def __init__(self, name):
+        self.name = name
+        self.seconds = None
+        self.result = None
+        self.error = None
+
+
+def init_parallel(tasks):
+    """
+    Run initialisers on parallel threads and wait for all of them.
+
+    A failing initialiser does not stop the others; its exception is kept on
+    its step and printed.
+
+    Args:
+        tasks (dict): Name -> callable taking no arguments.
+
+    Returns:
+        dict: Name -> StartupStep with the seconds taken and the callable's
+              result or exception.
+    """
+    steps = {name: StartupStep(name) for name in tasks}
+
+    def run(name, task):
+        step = steps[name]
+        started = time.monotonic()
+        try:
+            step.result = task()
+        except Exception as e:
+            print(f"Failed to initialise {name}: {e}")
+            step.error = e
+        step.seconds = time.monotonic() - started
+
+    threads = [threading.Thread(target=run, args=(name, task), name=f"init-{name}", daemon=True)
+               for name, task in tasks.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return steps
+
+
+def print_report(phases, started_at, ready_at=None):
+    """
+    Print the startup timing report.
+
+    Args:
+        phases (list): (name, seconds, error) rows, in the order they are printed.
+                       seconds None means the phase did not finish.
+        started_at (float): time.monotonic() when startup began.
+        ready_at (float): time.monotonic() when the controller could take
+                          orders, None if it cannot yet.
+    """
+    print("Startup timing:")
+    for name, seconds, error in phases:
+        took = f"{seconds:7.3f} s" if seconds is not None else "    ---  "
+        print(f"  {name:<16} {took}{'  FAILED: ' + str(error) if error is not None else ''}")
+    if ready_at is not None:
+        print(f"Ready for orders {ready_at - started_at:.3f} s after start")
+    else:
+        print("Not ready for orders")
@@ -0,0 +1,126 @@
+"""
+Order progress publisher.
+
+Publishes what the machine is doing (accepted, worm_done, elevator_up, dropped,
+idle, ...) to a per-device status topic over the subscriber's MQTT connection,
+so the backend can release the next order as soon as the machine is idle.
+
+Updates are coalesced: everything reported within one flush interval is sent
+as a single message per order, carrying the latest state and its details plus
+every state passed through since the previous message. Machine states are
+coalesced per state, so details of one (BUSY's current_order) never go out
+with another, and messages go out in the order of their latest update.
+"""
+
+import json
+import threading
+import time
+
+STATUS_TOPIC_PREFIX = "defarm/status"
+DEFAULT_FLUSH_INTERVAL = 0.2  # Seconds updates are gathered before publishing
+STATUS_QOS = 1
+
+# Order states, in the order a purchase normally goes through them
+ACCEPTED = "accepted"
+REJECTED = "rejected"
+DUPLICATE = "duplicate"
+WORM_DONE = "worm_done"
+ELEVATOR_UP = "elevator_up"
+DROPPED = "dropped"
+FAILED = "failed"
+# Machine state, published with no order id
+ONLINE = "online"
+IDLE = "idle"
+BUSY = "busy"
+
+
+class StatusPublisher:
+    """
+    Coalescing publisher for order and machine status.
+    """
+
+    def __init__(self, device_id, interval=DEFAULT_FLUSH_INTERVAL, topic_prefix=STATUS_TOPIC_PREFIX):
+        """
+        Args:
+            device_id (str): Device id used in the status topic.
+            interval (float): Seconds updates are gathered before publishing.
+            topic_prefix (str): Status topic is f"{topic_prefix}/{device_id}".
+        """
+        self.topic = f"{topic_prefix}/{device_id}"
+        self.interval = interval
+        self.publish_fn = None
+        self.pending = {}  # (order id, None) or (None, machine state) -> status dict
+        self.condition = threading.Condition()
+        self.thread = None
+
+        self.updates = 0
+        self.published = 0
+
+    def attach(self, publish_fn):
+        """
+        Start publishing through publish_fn(topic, payload, qos=...), for
+        example ConnectionManager.publish. Updates made before this are kept
+        and sent on the first flush.
+        """
+        with self.condition:
+            self.publish_fn = publish_fn
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="status-publisher", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def update(self, state, order_id=None, **details):
+        """
+        Report a new state. Never blocks on the network.
+
+        Args:
+            state (str): New state, e.g. ACCEPTED or IDLE.
+            order_id (str): Order the state belongs to, None for machine state.
+            **details: Extra JSON-serialisable fields to include.
+        """
+        now = time.time()
+        key = (order_id, None) if order_id is not None else (None, state)
+        with self.condition:
+            self.updates += 1
+            # Moved to the end, so the latest machine state is published last
+            previous = self.pending.pop(key, None)
+            states = previous['states'] if previous else []
+            self.pending[key] = {'order_id': order_id, 'state': state, 'states': states + [state],
+                                 'timestamp': now, **details}
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending or self.publish_fn is None:
+                    self.condition.wait()
+            # Let more updates arrive so they go out together
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Publish everything pending now."""
+        with self.condition:
+            if self.publish_fn is None:
+                return
+            pending = list(self.pending.values())
+            self.pending = {}
+            publish_fn = self.publish_fn
+
+        for entry in pending:
+            if entry['order_id'] is None:
+                del entry['order_id']
+            try:
+                publish_fn(self.topic, json.dumps(entry), qos=STATUS_QOS)
+                with self.condition:
+                    self.published += 1
+            except Exception as e:
+                print(f"Failed to publish status: {e}")
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Number of updates reported and messages actually published.
+        """
+        with self.condition:
+            return {'updates': self.updates, 'published': self.published}
@@ -7,15 +7,16 @@ Stepper Motor Control Module for TB6600 Driver
 
 import RPi.GPIO as GPIO
 import time
+from config import machine_config
 
-# GPIO pin configuration
-PUL_PIN = 21  # Pulse pin
-DIR_PIN = 20  # Direction pin
+# GPIO pin configuration, from machine.toml
+PUL_PIN = machine_config().elevator.pul_pin  # Pulse pin
+DIR_PIN = machine_config().elevator.dir_pin  # Direction pin
 # ENA_PIN = 16  # Enable pin (uncomment if using)
 
 # Motor configuration
 # Using the driver's configured pulse/rev directly instead of calculating from steps and microstepping
-TOTAL_STEPS = 6400  # TB6600 configured for 6400 pulses per revolution with 32 microstepping
+TOTAL_STEPS = machine_config().elevator.pulses_per_rev  # TB6600 configured for 6400 pulses per revolution with 32 microstepping
 
 def setup_stepper():
     """Initialize GPIO pins for stepper motor"""
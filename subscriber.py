@@ -1,53 +1,240 @@
-import json
+import asyncio
+import functools
+import os
+import socket
+import threading
+import time
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from pyee import EventEmitter
+from pyee.asyncio import AsyncIOEventEmitter
+from dispatcher import Dispatcher, COALESCED_EVENTS
+from router import TopicRouter, NUMBER, optional
+from dedup import DedupIndex
+from connection import (ConnectionManager, DEFAULT_KEEPALIVE, DEFAULT_MIN_RECONNECT_DELAY,
+                        DEFAULT_MAX_RECONNECT_DELAY)
+from status import StatusPublisher, ACCEPTED, REJECTED, DUPLICATE, ONLINE
+from payload_codecs import supported_content_types
+from inventory import Inventory
+from tracing import tracer
+
+# Identifies this machine in client ids, status topics and device-specific topics
+DEVICE_ID = os.getenv("DEVICE_ID") or socket.gethostname()
+
+# Fleet topics reach every controller. Topics under defarm/device/<DEVICE_ID>/
+# reach only this one and are handled like their fleet equivalent, e.g.
+# defarm/device/<DEVICE_ID>/remote/led is handled as defarm/remote/led.
+PURCHASE_TOPIC = "defarm/product/purchased"
+REMOTE_TOPICS = "defarm/remote/#"
+DEVICE_TOPIC_PREFIX = f"defarm/device/{DEVICE_ID}/"
+
+# With MQTT_SHARE_GROUP set, fleet purchases are subscribed as
+# $share/<group>/defarm/product/purchased, so the broker hands each order to
+# one controller in the group instead of all of them
+SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP")
+
+# MQTT_VERSION=5 switches to MQTT v5, which lets publishers send binary payloads
+# tagged with a content type; anything else keeps MQTT 3.1.1 with JSON only
+MQTT_PROTOCOL = mqtt.MQTTv5 if os.getenv("MQTT_VERSION") == "5" else mqtt.MQTTv311
+SESSION_EXPIRY = 7 * 24 * 3600  # Seconds a v5 broker keeps our session while we are offline
 
 # Event emitter used by your motor control logic
 ee = EventEmitter()
 
-def on_connect(client, userdata, flags, rc):
+# Handlers run on the dispatcher's worker lanes, never on paho's network thread,
+# so a long dispense cycle cannot stall keepalives or other commands
+dispatcher = Dispatcher(ee)
+
+# Event emitter used by start_subscriber_async(). Coroutine handlers are scheduled
+# on the subscriber's event loop; plain functions run inline on it, so keep them short.
+aee = AsyncIOEventEmitter()
+
+@aee.on("error")
+def on_async_handler_error(error):
+    print("Error in async event handler:", error)
+
+def _emitter_for(userdata):
+    # The async client passes its emitter as userdata; the threaded client goes
+    # through the dispatcher lanes. Both expose emit(event, *args).
+    return userdata if userdata is not None else dispatcher
+
+# At-least-once delivery: the broker keeps our session and redelivers anything
+# not acknowledged, and `dedup` stops a redelivered purchase dispensing twice
+SUBSCRIBE_QOS = 1
+dedup = DedupIndex()
+
+# Order progress and machine state, published over the subscriber's own connection
+status = StatusPublisher(DEVICE_ID)
+
+# Stock per worm slot; orders for empty slots are rejected here, before any motor moves
+inventory = Inventory(DEVICE_ID)
+
+def subscriptions():
+    """Topic filters this controller subscribes to."""
+    purchase = f"$share/{SHARE_GROUP}/{PURCHASE_TOPIC}" if SHARE_GROUP else PURCHASE_TOPIC
+    return [
+        purchase,
+        REMOTE_TOPICS,
+        DEVICE_TOPIC_PREFIX + "product/purchased",
+        DEVICE_TOPIC_PREFIX + "remote/#",
+    ]
+
+def _fleet_topic(topic):
+    # Map a device-specific topic onto the fleet topic its handler is registered for
+    if topic.startswith(DEVICE_TOPIC_PREFIX):
+        return "defarm/" + topic[len(DEVICE_TOPIC_PREFIX):]
+    return topic
+
+def on_connect(client, userdata, flags, rc, properties=None):
     print("Connected with result code", rc)
-    # Subscribe to your existing product purchase topic
-    client.subscribe("defarm/product/purchased")
-    # Additionally subscribe to all remote control topics
-    client.subscribe("defarm/remote/#")
+    # Purchases (possibly shared with the rest of the fleet) and remote control
+    # topics, both fleet-wide and addressed to this device
+    client.subscribe([(topic_filter, SUBSCRIBE_QOS) for topic_filter in subscriptions()])
+    # Tell the backend which payload encodings it may send us
+    status.update(ONLINE, content_types=supported_content_types())
 
-def on_message(client, userdata, msg):
-    topic = msg.topic
-    if topic == "defarm/product/purchased":
-        # Original product purchase logic
-        try:
-            payload = json.loads(msg.payload.decode('utf-8'))
-            instructions = payload.get("instructions")
-
-            if not isinstance(instructions, list):
-                print("Received invalid instruction payload:", payload)
-                return
-
-            print("Received instruction sequence:", instructions)
-            # Emit instruction sequence to the motor controller
-            ee.emit("purchase", instructions)
-        except Exception as e:
-            print("Error processing MQTT message:", e)
-    elif topic.startswith("defarm/remote/"):
-        # New remote control logic: handle any message published under defarm/remote/...
-        try:
-            payload = json.loads(msg.payload.decode('utf-8'))
-            print("Received remote control command on {}: {}".format(topic, payload))
-            # Emit an event with the topic as key and payload as value
-            ee.emit(topic, payload)
-        except Exception as e:
-            print("Error processing remote MQTT message on topic {}: {}".format(topic, e))
+# Routes from topic filter to handler. Schemas are compiled once, here at import.
+router = TopicRouter()
+
+PURCHASE_SCHEMA = {
+    "instructions": [NUMBER],
+    "order_id": optional((str, int)),
+    "slots": optional([int]),  # worm slot of each pot, for the stock check
+}
+
+@router.route(PURCHASE_TOPIC, schema=PURCHASE_SCHEMA)
+def on_purchase_message(userdata, topic, payload):
+    instructions = payload["instructions"]
+    order_id = payload.get("order_id")
+    if order_id is not None and dedup.seen(order_id):
+        print(f"Ignoring duplicate delivery of order {order_id}")
+        status.update(DUPLICATE, order_id)
+        return
+
+    print("Received instruction sequence:", instructions)
+    slots = payload.get("slots") or []
+    if slots and len(slots) != len(instructions):
+        print(f"Rejected purchase, {len(slots)} slots for {len(instructions)} instructions")
+        status.update(REJECTED, order_id, reason="invalid_slots")
+        return
+    short = inventory.reserve(slots, order_id)
+    if short:
+        print("Rejected purchase, out of stock:", short)
+        status.update(REJECTED, order_id, reason="out_of_stock", slots=short)
+        return
+
+    emitter = _emitter_for(userdata)
+    if emitter is dispatcher and not dispatcher.has_room("purchase"):
+        print("Rejected purchase, machine is busy:", instructions)
+        status.update(REJECTED, order_id, reason="busy")
+        if order_id is not None:
+            inventory.release(order_id)
+        return
+
+    # From on_message to here: decode, validation, dedup and stock checks
+    tracer.record("decode", order_id, _receiving.started_ns)
+    # Reported before queueing so it can never arrive after the order's own progress
+    status.update(ACCEPTED, order_id)
+    tracer.begin("queue_wait", order_id)
+    # Queue instruction sequence for the motor controller. Only orders that were
+    # actually accepted are recorded, so a rejected one can be sent again.
+    if emitter.emit("purchase", instructions, order_id):
+        if order_id is not None:
+            dedup.add(order_id)
     else:
-        print("Received message on unexpected topic {}: {}".format(topic, msg.payload))
+        tracer.cancel("queue_wait", order_id)
+        status.update(REJECTED, order_id, reason="busy")
+        if order_id is not None:
+            inventory.release(order_id)
+
+REMOTE_PREFIX = "defarm/remote/"
+BATCH_TOPIC = REMOTE_PREFIX + "batch"
+INVENTORY_TOPIC = REMOTE_PREFIX + "inventory"
+
+BATCH_SCHEMA = {
+    "commands": [{
+        "topic": str,
+        "payload": optional(object),
+    }],
+}
+
+@router.route(REMOTE_TOPICS)
+def on_remote_message(userdata, topic, payload):
+    if topic in (BATCH_TOPIC, INVENTORY_TOPIC):
+        return  # handled by on_batch_message / on_inventory_message
+    # Remote control logic: handle any message published under defarm/remote/...
+    print("Received remote control command on {}: {}".format(topic, payload))
+    # Emit an event with the topic as key and payload as value
+    _emitter_for(userdata).emit(topic, payload)
 
-def start_subscriber(broker_host, broker_port, username=None, password=None):
-    client = mqtt.Client()
+@router.route(BATCH_TOPIC, schema=BATCH_SCHEMA, max_size=32768)
+def on_batch_message(userdata, topic, payload):
+    # Several remote commands in one message, applied in order. Of the state
+    # commands (pumps, LED, fan) only the last for each actuator is applied, as
+    # the earlier ones would be overwritten anyway; movements (worm, elevator,
+    # grabber) are relative, so every one of them is applied.
+    commands = []
+    for command in payload["commands"]:
+        command_topic = command["topic"]
+        if not command_topic.startswith(REMOTE_PREFIX):
+            command_topic = REMOTE_PREFIX + command_topic
+        if command_topic == BATCH_TOPIC:
+            print("Ignoring nested batch command")
+            continue
+        commands.append((command_topic, command.get("payload")))
+    last = {command_topic: i for i, (command_topic, _) in enumerate(commands) if command_topic in COALESCED_EVENTS}
+    applied = [(command_topic, command_payload) for i, (command_topic, command_payload) in enumerate(commands)
+               if last.get(command_topic, i) == i]
+
+    print("Received batch of {} remote commands, applying {}".format(len(payload["commands"]), len(applied)))
+    emitter = _emitter_for(userdata)
+    for command_topic, command_payload in applied:
+        emitter.emit(command_topic, command_payload)
+
+INVENTORY_SCHEMA = {
+    "stock": dict,
+}
+
+@router.route(INVENTORY_TOPIC, schema=INVENTORY_SCHEMA)
+def on_inventory_message(userdata, topic, payload):
+    # Refill: {"stock": {"<slot>": <pots>, ...}}, a null count stops tracking the slot
+    stock = payload["stock"]
+    if not all(count is None or (isinstance(count, int) and not isinstance(count, bool))
+               for count in stock.values()):
+        print("Rejected inventory update, counts must be integers or null:", stock)
+        return
+    print("Received inventory update:", stock)
+    inventory.set_stock(stock)
+
+# When the message being handled on this thread arrived, for the "decode" span
+_receiving = threading.local()
+
+def on_message(client, userdata, msg):
+    _receiving.started_ns = time.monotonic_ns()
+    # Only MQTT v5 messages have properties; without a content type the payload is JSON
+    content_type = getattr(msg.properties, "ContentType", None)
+    if not router.dispatch(_fleet_topic(msg.topic), msg.payload, userdata, content_type=content_type):
+        print("Received message on unexpected topic {}: {}".format(msg.topic, msg.payload))
+
+def _default_client_id():
+    # A persistent session is keyed by client id, so it must be stable across restarts
+    return os.getenv("MQTT_CLIENT_ID") or f"defarm-{DEVICE_ID}"
+
+def _create_client(username=None, password=None, userdata=None, client_id=None, tls=True, protocol=None):
+    protocol = protocol or MQTT_PROTOCOL
+    client_id = client_id or _default_client_id()
+    if protocol == mqtt.MQTTv5:
+        # v5 has no clean_session; the session is kept via clean_start/SessionExpiryInterval
+        client = mqtt.Client(client_id=client_id, protocol=protocol, userdata=userdata)
+    else:
+        client = mqtt.Client(client_id=client_id, clean_session=False, userdata=userdata, protocol=protocol)
 
     if username and password:
         client.username_pw_set(username, password)
 
-    client.tls_set()  # uses default TLS configuration
+    if tls:
+        client.tls_set()  # uses default TLS configuration
 
     def on_log(client, userdata, level, buf):
         print("LOG:", buf)
@@ -55,14 +242,155 @@ def start_subscriber(broker_host, broker_port, username=None, password=None):
     client.on_log = on_log
     client.on_connect = on_connect
     client.on_message = on_message
+    return client
+
+def _connect_options(client):
+    """Extra connect arguments: MQTT v5 needs the persistent session and our accepted encodings here."""
+    if client.protocol != mqtt.MQTTv5:
+        return {}
+    properties = Properties(PacketTypes.CONNECT)
+    properties.SessionExpiryInterval = SESSION_EXPIRY
+    properties.UserProperty = ("accept", ", ".join(supported_content_types()))
+    return {'clean_start': False, 'properties': properties}
+
+def start_subscriber(broker_host, broker_port, username=None, password=None, client_id=None, block=True,
+                     tls=True, protocol=None):
+    """
+    Connect to the broker and keep the connection alive in the background.
+
+    Failed connects and dropped connections are retried with exponential
+    backoff, see ConnectionManager.
+
+    Args:
+        block (bool): If True, wait here until the manager is stopped (or
+                      KeyboardInterrupt), then disconnect. If False, return
+                      the running ConnectionManager straight away.
+        tls (bool): Connect over TLS. Only a local test broker should need False.
+        protocol (int): mqtt.MQTTv311 or mqtt.MQTTv5, default from MQTT_VERSION.
+    """
+    client = _create_client(username, password, client_id=client_id, tls=tls, protocol=protocol)
+    manager = ConnectionManager(client, broker_host, broker_port, connect_options=_connect_options(client))
+    manager.add_state_listener(lambda state, manager: print("MQTT connection", state))
+    status.attach(manager.publish)
+    inventory.attach(manager.publish)
+    manager.start()
+
+    if not block:
+        return manager
 
-    print(f"Connecting to MQTT broker at {broker_host}:{broker_port}...")
     try:
-        client.connect(broker_host, broker_port, 60)
-    except Exception as e:
-        print("Connection error:", e)
-        return
+        manager.wait()
+    finally:
+        manager.stop()
+
+class _AsyncioHelper:
+    """
+    Drives a paho client from an asyncio loop through its socket callbacks
+    instead of a dedicated network thread.
 
-    client.loop_forever()
+    Created once the client has connected, for the socket it opened; a new
+    helper is needed for every connection.
+    """
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc_task = None
+        self.established = False  # CONNACK seen, so the next reconnect starts from the shortest delay
+        self.disconnected = loop.create_future()
+
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+        # The socket was opened off the loop, before these callbacks were set
+        sock = client.socket()
+        self.on_socket_open(client, None, sock)
+        if client.want_write():
+            self.on_socket_register_write(client, None, sock)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, self.read, sock)
+        self.misc_task = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        if self.misc_task is not None:
+            self.misc_task.cancel()
+        if not self.disconnected.done():
+            self.disconnected.set_result(True)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def read(self, sock):
+        self.client.loop_read()
+        self.established = self.established or self.client.is_connected()
+        # TLS can hold decrypted bytes that never make the socket readable again
+        if hasattr(sock, "pending") and sock.pending():
+            self.loop.call_soon(self.read, sock)
+
+    async def misc_loop(self):
+        # Keepalive pings and retries, which loop_forever would otherwise handle
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+async def _connect_off_loop(loop, client, broker_host, broker_port):
+    """Run the blocking DNS lookup, TCP/TLS handshake and CONNECT write on an executor thread."""
+    # paho calls the socket callbacks from the connecting thread, so none may be set meanwhile
+    client.on_socket_open = client.on_socket_close = None
+    client.on_socket_register_write = client.on_socket_unregister_write = None
+    await loop.run_in_executor(None, functools.partial(
+        client.connect, broker_host, broker_port, DEFAULT_KEEPALIVE, **_connect_options(client)))
+    return _AsyncioHelper(loop, client)
+
+async def start_subscriber_async(broker_host, broker_port, username=None, password=None, emitter=None,
+                                 client_id=None, tls=True, protocol=None,
+                                 min_reconnect_delay=DEFAULT_MIN_RECONNECT_DELAY,
+                                 max_reconnect_delay=DEFAULT_MAX_RECONNECT_DELAY):
+    """
+    Run the subscriber inside the current asyncio event loop.
+
+    Messages are emitted on `emitter` (default `aee`), so handlers can be
+    coroutines sharing the loop with other async tasks. The connect runs on
+    an executor thread so it never blocks the loop, and failed connects and
+    dropped connections are retried with exponential backoff, like
+    ConnectionManager does for start_subscriber. Runs until cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    client = _create_client(username, password, userdata=emitter or aee, client_id=client_id, tls=tls,
+                            protocol=protocol)
+    # The client belongs to the loop, so publishes from other threads are handed over to it
+    publish = lambda topic, payload, qos=0: loop.call_soon_threadsafe(
+        lambda: client.publish(topic, payload, qos=qos))
+    status.attach(publish)
+    inventory.attach(publish)
+
+    delay = min_reconnect_delay
+    try:
+        while True:
+            print(f"Connecting to MQTT broker at {broker_host}:{broker_port}...")
+            try:
+                helper = await _connect_off_loop(loop, client, broker_host, broker_port)
+            except Exception as e:
+                print("Connection error:", e)
+            else:
+                await helper.disconnected
+                print("MQTT connection lost")
+                if helper.established:
+                    delay = min_reconnect_delay
+            print(f"Reconnecting in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_reconnect_delay)
+    finally:
+        client.disconnect()
 
-__all__ = ['ee', 'start_subscriber']
\ No newline at end of file
+__all__ = ['ee', 'aee', 'dispatcher', 'router', 'dedup', 'status', 'inventory', 'subscriptions', 'start_subscriber',
+           'start_subscriber_async']
\ No newline at end of file
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for the asyncio subscriber against the local broker stand-in.
+
+- Starts the subscriber before the broker exists, so the first connects must
+  be retried, and checks the event loop keeps running meanwhile
+- A purchase reaches a coroutine handler on aee
+- Kills and restarts the broker, and checks purchases arrive again after the
+  subscriber reconnects by itself
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+import paho.mqtt.client as mqtt
+
+import subscriber
+from local_broker import LocalBroker
+from testing import check, isolate_subscriber
+
+DELIVERY_TIMEOUT = 10  # Seconds a purchase may take to arrive, reconnects included
+OUTAGE = 2.0           # Seconds the broker stays down
+TICK = 0.05            # Seconds between heartbeats of the event loop
+
+received = {}  # order id -> instructions
+
+
+@subscriber.aee.on("purchase")
+async def on_purchase(instructions, order_id=None):
+    await asyncio.sleep(0)  # a real coroutine, scheduled on the subscriber's loop
+    received[order_id] = instructions
+
+
+def publish_purchase(port, order_id):
+    """Publish one purchase with its own short-lived client."""
+    publisher = mqtt.Client(client_id=f"publisher-{order_id}")
+    publisher.connect("127.0.0.1", port)
+    publisher.loop_start()
+    info = publisher.publish("defarm/product/purchased",
+                             json.dumps({"instructions": [1], "order_id": order_id}), qos=1)
+    info.wait_for_publish(5)
+    publisher.disconnect()
+    publisher.loop_stop()
+
+
+async def expect_purchase(port, order_id):
+    """Keep publishing until the purchase arrives, since the subscription may not be up yet."""
+    deadline = time.monotonic() + DELIVERY_TIMEOUT
+    while order_id not in received and time.monotonic() < deadline:
+        await asyncio.to_thread(publish_purchase, port, order_id)
+        for _ in range(10):
+            if order_id in received:
+                break
+            await asyncio.sleep(0.1)
+    return received.get(order_id)
+
+
+async def heartbeat(gaps):
+    """Record how late each tick of the event loop runs."""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(TICK)
+        gaps.append(time.monotonic() - started - TICK)
+
+
+async def run(broker, port):
+    gaps = []
+    beat = asyncio.create_task(heartbeat(gaps))
+    task = asyncio.create_task(subscriber.start_subscriber_async(
+        "127.0.0.1", port, client_id="async-test", tls=False, min_reconnect_delay=0.5, max_reconnect_delay=1))
+    ok = True
+
+    print("\n1. Starting the subscriber while the broker is down...")
+    await asyncio.sleep(OUTAGE)
+    ok = check(not task.done(), "still retrying") and ok
+    await asyncio.to_thread(broker.start)
+    instructions = await expect_purchase(port, "async-1")
+    ok = check(instructions == [1], f"purchase on a coroutine handler: {instructions}") and ok
+
+    print("\n2. Killing and restarting the broker...")
+    await asyncio.to_thread(broker.restart, OUTAGE)
+    instructions = await expect_purchase(port, "async-2")
+    ok = check(instructions == [1], f"purchase after reconnecting: {instructions}") and ok
+
+    worst = max(gaps, default=0.0)
+    ok = check(worst < 0.5, f"event loop never stalled, worst heartbeat {worst * 1000:.0f} ms late") and ok
+
+    task.cancel()
+    beat.cancel()
+    await asyncio.gather(task, beat, return_exceptions=True)
+    return ok
+
+
+def main():
+    """Main test function"""
+    print("Testing the asyncio subscriber with the local broker stand-in")
+
+    isolate_subscriber()  # keeps the test's order ids, stock and traces out of the real files
+
+    broker = LocalBroker()
+    port = broker.start()
+    broker.stop()
+    try:
+        return asyncio.run(run(broker, port))
+    finally:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nAsync subscriber test completed successfully!")
+        else:
+            print("\nAsync subscriber test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script for defarm/remote/batch handling, without a broker.
+
+- Two worm moves in one batch must both be applied, in order
+- Of several state commands for one output only the last is applied, and
+  movements around them keep their order
+- Short topic names are expanded and nested batches ignored
+- A batch over the catch-all route's 8192 byte limit is applied without a
+  rejection being logged, and a payload over every limit is rejected once
+"""
+
+import contextlib
+import io
+import json
+import sys
+
+from subscriber import router, BATCH_TOPIC
+from testing import RecordingEmitter, check
+
+
+def run_batch(commands):
+    emitter = RecordingEmitter()
+    router.dispatch(BATCH_TOPIC, json.dumps({"commands": commands}).encode(), emitter)
+    return emitter.events
+
+
+def rejections(topic, payload):
+    """Dispatch quietly; returns the rejection lines logged."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        router.dispatch(topic, payload, RecordingEmitter())
+    return [line for line in output.getvalue().splitlines() if line.startswith("Rejected")]
+
+
+def main():
+    """Main test function"""
+    print("Testing remote command batches")
+    ok = True
+
+    print("\n1. Two worm moves in one batch...")
+    events = run_batch([
+        {"topic": "defarm/remote/worm", "payload": {"counts": 500}},
+        {"topic": "defarm/remote/elevator", "payload": {"position": "up"}},
+        {"topic": "defarm/remote/worm", "payload": {"slots": 1}},
+    ])
+    ok = check(events == [
+        ("defarm/remote/worm", {"counts": 500}),
+        ("defarm/remote/elevator", {"position": "up"}),
+        ("defarm/remote/worm", {"slots": 1}),
+    ], f"every move applied in order: {events}") and ok
+
+    print("\n2. State commands around a move...")
+    events = run_batch([
+        {"topic": "defarm/remote/led", "payload": "on"},
+        {"topic": "defarm/remote/worm", "payload": {"counts": 100}},
+        {"topic": "defarm/remote/fan", "payload": "on"},
+        {"topic": "defarm/remote/led", "payload": "off"},
+    ])
+    ok = check(events == [
+        ("defarm/remote/worm", {"counts": 100}),
+        ("defarm/remote/fan", "on"),
+        ("defarm/remote/led", "off"),
+    ], f"only the last LED command applied: {events}") and ok
+
+    print("\n3. Short topic names and a nested batch...")
+    events = run_batch([
+        {"topic": "worm", "payload": {"counts": 10}},
+        {"topic": "batch", "payload": {"commands": []}},
+        {"topic": "worm", "payload": {"counts": 20}},
+    ])
+    ok = check(events == [
+        ("defarm/remote/worm", {"counts": 10}),
+        ("defarm/remote/worm", {"counts": 20}),
+    ], f"expanded, nested batch skipped: {events}") and ok
+
+    print("\n4. Payload sizes...")
+    commands = [{"topic": "worm", "payload": {"counts": 1, "note": "x" * 100}}] * 100
+    payload = json.dumps({"commands": commands}).encode()
+    lines = rejections(BATCH_TOPIC, payload)
+    ok = check(8192 < len(payload) <= 32768 and not lines,
+               f"{len(payload)} byte batch, rejections logged: {lines}") and ok
+    ok = check(len(run_batch(commands)) == 100, "every command applied") and ok
+    lines = rejections(BATCH_TOPIC, json.dumps({"commands": commands * 4}).encode())
+    ok = check(len(lines) == 1, f"oversized batch rejected once: {lines}") and ok
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nBatch test completed successfully!")
+        else:
+            print("\nBatch test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
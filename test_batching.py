@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test script for PurchaseBatcher.idle(), against a stand-in scheduler.
+
+- A batcher with nothing queued is idle
+- Purchases waiting for room in the scheduler keep it busy
+- So does a merged order on its way into the scheduler
+- Once the scheduler has taken the order the batcher is idle again
+"""
+
+import sys
+import threading
+import time
+
+from batching import PurchaseBatcher
+from testing import check
+
+
+class GatedScheduler:
+    """Stands in for OrderScheduler; room and submit() are opened by the test."""
+
+    def __init__(self):
+        self.room = threading.Event()
+        self.accept = threading.Event()
+        self.submitting = threading.Event()
+        self.orders = []
+
+    def wait_room(self, timeout=None):
+        return self.room.wait(timeout)
+
+    def submit(self, instructions, order_id=None, timeout=None, parts=None):
+        self.submitting.set()
+        self.accept.wait(5)
+        self.orders.append(parts)
+        return True
+
+
+def main():
+    """Main test function"""
+    print("Testing PurchaseBatcher.idle()")
+    scheduler = GatedScheduler()
+    batcher = PurchaseBatcher(scheduler, max_orders=4)
+    ok = True
+
+    print("\n1. Nothing queued...")
+    ok = check(batcher.idle(), "idle") and ok
+
+    print("\n2. Purchases waiting for room...")
+    batcher.submit([2335], "batch-1")
+    batcher.submit([2335], "batch-2")
+    ok = check(not batcher.idle(), f"busy with {batcher.metrics()['waiting']} waiting") and ok
+
+    print("\n3. Merged order on its way into the scheduler...")
+    scheduler.room.set()
+    scheduler.submitting.wait(5)
+    ok = check(batcher.metrics()["waiting"] == 0, "nothing left waiting") and ok
+    ok = check(not batcher.idle(), "still busy") and ok
+
+    print("\n4. Order taken by the scheduler...")
+    scheduler.accept.set()
+    for _ in range(100):
+        if batcher.idle():
+            break
+        time.sleep(0.01)
+    ok = check(batcher.idle(), "idle") and ok
+    ok = check(scheduler.orders == [[("batch-1", [2335]), ("batch-2", [2335])]],
+               f"one merged order: {scheduler.orders}") and ok
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nBatching test completed successfully!")
+        else:
+            print("\nBatching test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
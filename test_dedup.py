@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test script for the order-id dedup index, on a temporary database.
+
+- The number 5 and the string "5" are different orders, in memory and
+  after reopening the database
+- A database written before ids were stored as JSON is migrated, and its
+  ids are still caught as duplicates
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from dedup import DedupIndex
+from testing import check
+
+
+def main():
+    """Main test function"""
+    print("Testing the dedup index")
+    state_dir = tempfile.mkdtemp()
+    ok = True
+
+    print("\n1. Numeric and string ids...")
+    path = os.path.join(state_dir, "orders.db")
+    dedup = DedupIndex(path)
+    dedup.add(5)
+    ok = check(dedup.seen(5) and not dedup.seen("5"), "5 seen, \"5\" not") and ok
+    dedup.add("6")
+    ok = check(dedup.seen("6") and not dedup.seen(6), "\"6\" seen, 6 not") and ok
+    dedup.close()
+    dedup = DedupIndex(path, capacity=0)  # every lookup goes to disk
+    ok = check(dedup.seen(5) and not dedup.seen("5") and dedup.seen("6") and not dedup.seen(6),
+               "kept apart after reopening") and ok
+    dedup.close()
+
+    print("\n2. A database from before JSON ids...")
+    path = os.path.join(state_dir, "old.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE seen_orders (order_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+    db.executemany("INSERT INTO seen_orders VALUES (?, ?)", [("7", time.time()), ("order-8", time.time())])
+    db.commit()
+    db.close()
+    dedup = DedupIndex(path)
+    ok = check(dedup.seen("7") and dedup.seen(7), "old \"7\" caught as either type") and ok
+    ok = check(dedup.seen("order-8") and not dedup.seen("order-9"), "old string id caught") and ok
+    dedup.close()
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nDedup test completed successfully!")
+        else:
+            print("\nDedup test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
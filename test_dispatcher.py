@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test script for the dispatcher's lanes, without a broker or hardware.
+
+- Known actuators run on their own lanes, worm/elevator/grabber on one
+- Remote topics nothing lists share one default lane, however many there are,
+  and are rejected once it is full
+"""
+
+import sys
+import threading
+
+from pyee import EventEmitter
+
+from dispatcher import Dispatcher, DISPENSE_LANE, DEFAULT_LANE
+from testing import check
+
+
+def main():
+    """Main test function"""
+    print("Testing dispatcher lanes")
+    ok = True
+
+    print("\n1. Known actuators...")
+    dispatcher = Dispatcher(EventEmitter())
+    lanes = {event: dispatcher.lane_for(event) for event in
+             ("purchase", "defarm/remote/worm", "defarm/remote/grabber", "defarm/remote/led", "defarm/remote/fan")}
+    ok = check(lanes["purchase"] == lanes["defarm/remote/worm"] == lanes["defarm/remote/grabber"] == DISPENSE_LANE,
+               f"motors share the dispense lane: {lanes}") and ok
+    ok = check(lanes["defarm/remote/led"] != lanes["defarm/remote/fan"], "LED and fan on separate lanes") and ok
+    dispatcher.stop()
+
+    print("\n2. Unknown remote topics...")
+    running = threading.Event()
+    release = threading.Event()
+    emitter = EventEmitter()
+    dispatcher = Dispatcher(emitter, capacity=4)
+    emitter.on("defarm/remote/x0", lambda payload: (running.set(), release.wait(5)))
+    threads = threading.active_count()
+    accepted = [dispatcher.emit("defarm/remote/x0", "on")]
+    running.wait(5)
+    accepted += [dispatcher.emit(f"defarm/remote/x{i}", "on") for i in range(1, 100)]
+    ok = check(list(dispatcher.lanes) == [DEFAULT_LANE], f"one lane started: {list(dispatcher.lanes)}") and ok
+    ok = check(threading.active_count() - threads == 1,
+               f"{threading.active_count() - threads} thread(s) started for 100 topics") and ok
+    # The first is running, blocked on release; four more fill the queue
+    ok = check(accepted.count(True) == 5, f"{accepted.count(True)} accepted, the rest rejected") and ok
+    release.set()
+    dispatcher.stop()
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nDispatcher test completed successfully!")
+        else:
+            print("\nDispatcher test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
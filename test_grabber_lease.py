@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Test script for the grabber servo lease across a purchase, without hardware.
+
+- The servos stay leased to the order from the grab to the final servo
+  step, so a remote grabber command cannot take them while the elevator
+  descends with the pot
+- A remote grabber command gets the servos once the order is done
+- An order that fails between the grab and the final step gives the
+  servos back
+"""
+
+import contextlib
+import io
+import sys
+
+from leases import LeaseManager, LeaseTimeout, GRABBER_SERVOS
+from scheduler import OrderScheduler, purchase_plan
+from testing import check
+
+TIMEOUT = 5  # Seconds an order may take
+
+
+def remote_grabber(leases):
+    """Try the servos the way a remote grabber command does; True if it got them."""
+    try:
+        with leases.hold(*GRABBER_SERVOS, owner="remote grabber", timeout=0):
+            return True
+    except LeaseTimeout:
+        return False
+
+
+def main():
+    """Main test function"""
+    print("Testing the grabber lease across a purchase")
+    leases = LeaseManager()
+    seen = {}
+    ok = True
+
+    def descend(order):
+        seen["holders"] = leases.holders(GRABBER_SERVOS[0])
+        seen["remote"] = remote_grabber(leases)
+        if order.order_id == "fails":
+            raise RuntimeError("elevator stalled")
+
+    scheduler = OrderScheduler(purchase_plan({
+        "worm": lambda order, index: None,
+        "grab": lambda order: None,
+        "descend": descend,
+        "release": lambda order: None,
+    }), leases=leases)
+
+    print("\n1. While the elevator descends...")
+    scheduler.submit([1], "holds")
+    ok = check(scheduler.wait_idle(TIMEOUT), "order done") and ok
+    holders = [lease.owner for lease in seen.get("holders", [])]
+    ok = check(holders == ["order holds grab"], f"servos held by {holders}") and ok
+    ok = check(seen.get("remote") is False, "remote grabber command kept off") and ok
+
+    print("\n2. After the order...")
+    ok = check(remote_grabber(leases), "remote grabber command gets the servos") and ok
+
+    print("\n3. An order failing after the grab...")
+    with contextlib.redirect_stdout(io.StringIO()):
+        scheduler.submit([1], "fails")
+        ok = check(scheduler.wait_idle(TIMEOUT), "order done") and ok
+    ok = check(scheduler.metrics()["failed"] == 1, "counted as failed") and ok
+    ok = check(leases.holders(GRABBER_SERVOS[0]) == [] and remote_grabber(leases), "servos given back") and ok
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nGrabber lease test completed successfully!")
+        else:
+            print("\nGrabber lease test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Test script for the per-slot stock check on purchases, without a broker.
+
+- Two purchases with the same rotation but different slots are checked
+  against their own slot's stock, not against the rotation counts
+- A dispensed order takes its pots out of the slots it named, a failed one
+  gives its reservation back, and the counts survive reopening the database
+- A purchase whose slots do not match its instructions is rejected
+- A purchase that names no slots is accepted as before
+- Orders 5 and "5" hold separate reservations
+"""
+
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import subscriber
+from inventory import Inventory
+from subscriber import PURCHASE_TOPIC
+from testing import RecordingEmitter, check, isolate_subscriber
+
+ROTATION = 2335
+
+
+def purchase(emitter, order_id, instructions, slots=None):
+    """Deliver a purchase to on_message; returns the state reported for the order."""
+    payload = {"instructions": instructions, "order_id": order_id}
+    if slots is not None:
+        payload["slots"] = slots
+    msg = SimpleNamespace(topic=PURCHASE_TOPIC, payload=json.dumps(payload).encode(), properties=None)
+    subscriber.on_message(None, emitter, msg)
+    return subscriber.status.pending.get((order_id, None), {})
+
+
+def main():
+    """Main test function"""
+    print("Testing the per-slot stock check")
+
+    state_dir = isolate_subscriber()
+    db_path = os.path.join(state_dir, "inventory.db")
+    inventory = subscriber.inventory
+    inventory.set_stock({3: 1, 4: 2})
+    emitter = RecordingEmitter()
+    ok = True
+
+    print("\n1. Same rotation, different slots...")
+    entry = purchase(emitter, "inv-1", [ROTATION], slots=[3])
+    ok = check(entry.get("state") == "accepted", f"last pot of slot 3 accepted: {entry.get('state')}") and ok
+    entry = purchase(emitter, "inv-2", [ROTATION], slots=[3])
+    ok = check(entry.get("state") == "rejected" and entry.get("slots") == {"3": 1},
+               f"slot 3 now short: {entry.get('state')} {entry.get('slots')}") and ok
+    entry = purchase(emitter, "inv-3", [ROTATION, ROTATION], slots=[4, 4])
+    ok = check(entry.get("state") == "accepted", f"two pots of slot 4 accepted: {entry.get('state')}") and ok
+    ok = check(inventory.snapshot() == {"3": 0, "4": 0}, f"all pots reserved: {inventory.snapshot()}") and ok
+
+    print("\n2. Dispensed and failed orders...")
+    inventory.consume("inv-1")
+    inventory.release("inv-3")
+    ok = check(inventory.stock == {"3": 0, "4": 2}, f"slot 3 taken out, slot 4 untouched: {inventory.stock}") and ok
+    ok = check(inventory.snapshot() == {"3": 0, "4": 2}, f"no reservations left: {inventory.snapshot()}") and ok
+    inventory.close()
+    reopened = Inventory(subscriber.DEVICE_ID, db_path)
+    ok = check(reopened.snapshot() == {"3": 0, "4": 2}, f"counts after reopening: {reopened.snapshot()}") and ok
+    reopened.close()
+
+    print("\n3. Slots that do not match the instructions...")
+    entry = purchase(emitter, "inv-4", [ROTATION, ROTATION], slots=[4])
+    ok = check(entry.get("state") == "rejected" and entry.get("reason") == "invalid_slots",
+               f"rejected: {entry.get('state')} {entry.get('reason')}") and ok
+
+    print("\n4. A purchase without slots...")
+    entry = purchase(emitter, "inv-5", [ROTATION])
+    ok = check(entry.get("state") == "accepted", f"accepted without a stock check: {entry.get('state')}") and ok
+
+    queued = [args[1] for event, *args in emitter.events if event == "purchase"]
+    ok = check(queued == ["inv-1", "inv-3", "inv-5"], f"only accepted orders queued: {queued}") and ok
+
+    print("\n5. Numeric and string order ids...")
+    inventory = subscriber.inventory = Inventory(subscriber.DEVICE_ID, os.path.join(state_dir, "ids.db"))
+    inventory.set_stock({5: 2})
+    purchase(emitter, 5, [ROTATION], slots=[5])
+    purchase(emitter, "5", [ROTATION], slots=[5])
+    inventory.release(5)
+    ok = check(inventory.snapshot() == {"5": 1}, f"releasing 5 keeps \"5\" reserved: {inventory.snapshot()}") and ok
+    inventory.consume("5")
+    ok = check(inventory.stock == {"5": 1}, f"\"5\" dispensed its own pot: {inventory.stock}") and ok
+    inventory.close()
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nInventory test completed successfully!")
+        else:
+            print("\nInventory test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
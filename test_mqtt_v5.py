@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test script for purchases over MQTT v5 against the local broker stand-in.
+
+- Connects the subscriber with MQTT v5 and checks that its online status
+  lists the content types it accepts
+- A JSON purchase with no content type and one labelled application/json
+  both arrive
+- A purchase in a binary encoding arrives decoded, through a stub codec
+  registered for the test (zlib-compressed JSON), the way CBOR and
+  MessagePack are when their packages are installed
+- A purchase in an encoding with no codec is rejected
+"""
+
+import json
+import sys
+import threading
+import time
+import zlib
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+import payload_codecs
+import subscriber
+from local_broker import LocalBroker
+from testing import check, isolate_subscriber
+
+CONNECT_TIMEOUT = 15   # Seconds allowed to connect
+DELIVERY_TIMEOUT = 5   # Seconds a purchase may take to arrive
+STUB = "application/x-test-zlib"
+
+received = {}  # order id -> instructions
+received_event = threading.Event()
+statuses = []
+
+
+@subscriber.ee.on("purchase")
+def on_purchase(instructions, order_id=None):
+    received[order_id] = instructions
+    received_event.set()
+
+
+def publish(port, order_id, payload, content_type=None):
+    """Publish one purchase with its own short-lived MQTT v5 client."""
+    publisher = mqtt.Client(client_id=f"publisher-{order_id}", protocol=mqtt.MQTTv5)
+    publisher.connect("127.0.0.1", port)
+    publisher.loop_start()
+    properties = None
+    if content_type is not None:
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.ContentType = content_type
+    info = publisher.publish("defarm/product/purchased", payload, qos=1, properties=properties)
+    info.wait_for_publish(5)
+    publisher.disconnect()
+    publisher.loop_stop()
+
+
+def expect_purchase(port, order_id, payload, content_type=None, arrives=True):
+    received_event.clear()
+    publish(port, order_id, payload, content_type)
+    deadline = time.monotonic() + (DELIVERY_TIMEOUT if arrives else 1.0)
+    while order_id not in received and time.monotonic() < deadline:
+        received_event.wait(0.1)
+    return received.get(order_id)
+
+
+def main():
+    """Main test function"""
+    print("Testing purchases over MQTT v5 with the local broker stand-in")
+
+    isolate_subscriber()  # keeps the test's order ids, stock and traces out of the real files
+    payload_codecs.CODECS[STUB] = payload_codecs.Codec(
+        STUB, lambda payload: json.loads(zlib.decompress(payload)), lambda payload: payload[:1] == b"\x78")
+
+    broker = LocalBroker()
+    port = broker.start()
+    watcher = mqtt.Client(client_id="status-watcher", protocol=mqtt.MQTTv5)
+    watcher.on_message = lambda client, userdata, msg: statuses.append(json.loads(msg.payload))
+    watcher.connect("127.0.0.1", port)
+    watcher.subscribe(subscriber.status.topic, qos=1)
+    watcher.loop_start()
+    ok = True
+
+    print("\n1. Connecting with MQTT v5...")
+    manager = subscriber.start_subscriber("127.0.0.1", port, client_id="v5-test", block=False, tls=False,
+                                          protocol=mqtt.MQTTv5)
+    if not check(manager.wait_connected(CONNECT_TIMEOUT), "connected"):
+        return False
+    time.sleep(1.0)  # let the subscriptions settle and the online status go out
+    online = [message for message in statuses if message.get("state") == "online"]
+    ok = check(bool(online) and payload_codecs.JSON in online[-1].get("content_types", []),
+               f"online status {online[-1] if online else None}") and ok
+
+    print("\n2. JSON purchases...")
+    instructions = expect_purchase(port, "v5-1", json.dumps({"instructions": [1], "order_id": "v5-1"}))
+    ok = check(instructions == [1], f"without a content type: {instructions}") and ok
+    instructions = expect_purchase(port, "v5-2", json.dumps({"instructions": [2], "order_id": "v5-2"}),
+                                   "application/json; charset=utf-8")
+    ok = check(instructions == [2], f"as application/json: {instructions}") and ok
+
+    print("\n3. Binary purchase through the stub codec...")
+    payload = zlib.compress(json.dumps({"instructions": [3, 4], "order_id": "v5-3"}).encode())
+    instructions = expect_purchase(port, "v5-3", payload, STUB)
+    ok = check(instructions == [3, 4], f"as {STUB}: {instructions}") and ok
+
+    print("\n4. Encoding with no codec...")
+    instructions = expect_purchase(port, "v5-4", b"\x00\x01", "application/x-unknown", arrives=False)
+    ok = check(instructions is None, "rejected") and ok
+
+    manager.stop()
+    watcher.loop_stop()
+    watcher.disconnect()
+    broker.stop()
+    del payload_codecs.CODECS[STUB]
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nMQTT v5 test completed successfully!")
+        else:
+            print("\nMQTT v5 test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
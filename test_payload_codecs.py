@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script for the CBOR and MessagePack purchase encodings, without a broker.
+
+Each encoding is skipped when its package (requirements-optional.txt) is
+not installed.
+
+- A purchase encoded with the real package decodes to the same dict
+- The first-byte check accepts a map and refuses an array
+- The encoding is advertised, under its aliases too
+- A purchase published with the content type reaches the purchase handler
+"""
+
+import sys
+from types import SimpleNamespace
+
+import payload_codecs
+import subscriber
+from subscriber import PURCHASE_TOPIC
+from testing import RecordingEmitter, check, isolate_subscriber
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def encodings():
+    """(name, content type, aliases, encode) for each encoding, encode None when not installed."""
+    return [
+        ("CBOR", payload_codecs.CBOR, [], cbor2 and cbor2.dumps),
+        ("MessagePack", payload_codecs.MSGPACK, ["application/x-msgpack", "application/vnd.msgpack"],
+         msgpack and msgpack.packb),
+    ]
+
+
+def main():
+    """Main test function"""
+    print("Testing the CBOR and MessagePack codecs")
+
+    isolate_subscriber()  # keeps the test's order ids, stock and traces out of the real files
+    ok = True
+
+    for step, (name, content_type, aliases, encode) in enumerate(encodings(), 1):
+        print(f"\n{step}. {name}...")
+        if encode is None:
+            print(f"  skip {name}: package not installed")
+            continue
+
+        purchase = {"instructions": [2335, 4670.5, 2335], "order_id": f"codec-{step}", "slots": [1, 2, 1]}
+        payload = encode(purchase)
+        codec = payload_codecs.get_codec(content_type)
+        ok = check(codec.decode(payload) == purchase, f"round trip of {len(payload)} bytes") and ok
+        ok = check(codec.is_object(payload) and not codec.is_object(encode([1, 2])),
+                   "map accepted, array refused by the first-byte check") and ok
+        ok = check(content_type in payload_codecs.supported_content_types(), "advertised") and ok
+        for alias in aliases:
+            ok = check(payload_codecs.get_codec(alias) is codec, f"alias {alias}") and ok
+
+        emitter = RecordingEmitter()
+        msg = SimpleNamespace(topic=PURCHASE_TOPIC, payload=payload,
+                              properties=SimpleNamespace(ContentType=content_type))
+        subscriber.on_message(None, emitter, msg)
+        ok = check(emitter.events == [("purchase", purchase["instructions"], purchase["order_id"])],
+                   f"purchase handled: {emitter.events}") and ok
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nPayload codec test completed successfully!")
+        else:
+            print("\nPayload codec test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test script for the MQTT connection manager against the local broker stand-in.
+
+- Starts the subscriber before the broker exists, so the first connects must be retried
+- Kills and restarts the broker, keeping the persistent session
+- Kills and restarts the broker again, this time losing the session
+- Checks that purchases still arrive after each outage and prints the metrics
+"""
+
+import json
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import subscriber
+from local_broker import LocalBroker
+from testing import isolate_subscriber
+
+CONNECT_TIMEOUT = 15   # Seconds allowed to (re)connect after the broker comes back
+OUTAGE = 2.0           # Seconds the broker stays down during each restart
+
+received = []
+received_event = threading.Event()
+
+
+@subscriber.ee.on("purchase")
+def on_purchase(instructions, order_id=None):
+    received.append(instructions)
+    received_event.set()
+
+
+def publish_purchase(port, order_id):
+    """Publish one purchase with its own short-lived client."""
+    publisher = mqtt.Client(client_id=f"publisher-{order_id}")
+    publisher.connect("127.0.0.1", port)
+    publisher.loop_start()
+    info = publisher.publish("defarm/product/purchased",
+                             json.dumps({"instructions": [order_id], "order_id": f"reconnect-{order_id}"}),
+                             qos=1)
+    info.wait_for_publish(5)
+    publisher.disconnect()
+    publisher.loop_stop()
+
+
+def expect_purchase(order_id):
+    received_event.clear()
+    if order_id not in [instructions[0] for instructions in received]:
+        received_event.wait(5)
+    ok = order_id in [instructions[0] for instructions in received]
+    print(f"  purchase {order_id} {'received' if ok else 'NOT received'}")
+    return ok
+
+
+def expect_purchase_after(port, order_id):
+    publish_purchase(port, order_id)
+    return expect_purchase(order_id)
+
+
+def outage(broker, manager, port, order_id, forget_sessions):
+    broker.stop(forget_sessions=forget_sessions)
+    time.sleep(OUTAGE)
+    broker.start()
+    if not manager.wait_connected(CONNECT_TIMEOUT):
+        print("Failed to reconnect")
+        return False
+    time.sleep(0.5)
+    print(f"  reconnected after {manager.metrics()['last_reconnect_seconds']:.2f} s")
+    return expect_purchase_after(port, order_id)
+
+
+def main():
+    """Main test function"""
+    print("Testing MQTT reconnect handling with the local broker stand-in")
+
+    isolate_subscriber()  # keeps the test's order ids, stock and traces out of the real files
+
+    broker = LocalBroker()
+    port = broker.start()
+    broker.stop()
+
+    print("\n1. Starting subscriber while the broker is down...")
+    manager = subscriber.start_subscriber("127.0.0.1", port, client_id="reconnect-test", block=False, tls=False)
+    manager.client.reconnect_delay_set(1, 2)
+    time.sleep(OUTAGE)
+    broker.start()
+    if not manager.wait_connected(CONNECT_TIMEOUT):
+        print("Failed to connect once the broker came up")
+        return False
+    time.sleep(0.5)  # let the subscriptions settle
+    ok = expect_purchase_after(port, 1)
+
+    print("\n2. Killing the broker, session kept...")
+    ok = outage(broker, manager, port, 2, forget_sessions=False) and ok
+
+    print("\n3. Killing the broker, session lost...")
+    ok = outage(broker, manager, port, 3, forget_sessions=True) and ok
+
+    print("\nConnection metrics:")
+    for key, value in manager.metrics().items():
+        print(f"  {key}: {value}")
+
+    manager.stop()
+    broker.stop()
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nReconnect test completed successfully!")
+        else:
+            print("\nReconnect test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
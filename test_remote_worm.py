@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test script for checking defarm/remote/worm payloads, with a stand-in worm.
+
+- {"slots": n} turns n whole slots, and a bare number or {} is read as slots
+- Zero, negative, fractional, string and boolean slot counts are ignored,
+  as are more than REMOTE_MAX_SLOTS
+- {"counts": n} must be a positive number
+"""
+
+import contextlib
+import io
+import sys
+
+from simulator import VirtualClock, Machine, fake_modules
+from testing import check
+
+
+class RecordingWorm:
+    """Stands in for Worm and records the rotations asked of it."""
+
+    def __init__(self):
+        self.rotations = []
+
+    def rotate_degrees(self, target, speed=None):
+        self.rotations.append(target)
+
+
+def main():
+    """Main test function"""
+    print("Testing remote worm command checks")
+    sys.modules.update(fake_modules(Machine(VirtualClock(speedup=1.0))))
+    import main as controller
+    from config import machine_config
+
+    slot = machine_config().worm.rotation_counts
+    controller.hardware_ready.set()
+    ok = True
+
+    def turn(payload):
+        controller.worm = RecordingWorm()
+        with contextlib.redirect_stdout(io.StringIO()):
+            controller.on_worm(payload)
+        return controller.worm.rotations
+
+    print("\n1. Valid commands...")
+    for payload, expected in (({"slots": 3}, [slot] * 3), (2, [slot] * 2), ({}, [slot]),
+                              ({"counts": 500}, [500]), ({"counts": 12.5}, [12.5])):
+        rotations = turn(payload)
+        ok = check(rotations == expected, f"{payload!r} -> {rotations}") and ok
+
+    print("\n2. Invalid commands...")
+    for payload in ({"slots": 0}, {"slots": -3}, {"slots": "2"}, {"slots": 1.5}, {"slots": True},
+                    {"slots": controller.REMOTE_MAX_SLOTS + 1}, {"counts": 0}, {"counts": "5"}, 0):
+        rotations = turn(payload)
+        ok = check(rotations == [], f"{payload!r} ignored") and ok
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nRemote worm test completed successfully!")
+        else:
+            print("\nRemote worm test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test script for a hardware step failing at startup, against the simulator's
+stand-ins for the hardware modules.
+
+- The worm failing to initialise is reported as a FAILED machine status
+- A purchase is refused with FAILED instead of reaching the scheduler
+- A remote worm command is ignored rather than failing on a missing worm
+- Hardware that did come up stays usable
+"""
+
+import contextlib
+import io
+import sys
+
+from simulator import VirtualClock, Machine, fake_modules
+from testing import check
+
+
+def main():
+    """Main test function"""
+    print("Testing startup with a failed worm")
+    sys.modules.update(fake_modules(Machine(VirtualClock(speedup=1.0))))
+    import main as controller
+    from status import FAILED
+
+    def broken_worm():
+        raise OSError("pigpio daemon not running")
+
+    controller.init_worm = broken_worm
+    controller.start_monitoring = lambda: None  # the real monitor posts readings
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        controller.init_hardware()
+    ok = True
+
+    print("\n1. Startup report...")
+    machine = controller.status.pending.get((None, FAILED), {})
+    ok = check(machine.get("hardware") == ["worm"] and "pigpio daemon not running" in machine.get("error", ""),
+               f"machine status {machine}") and ok
+
+    print("\n2. A purchase...")
+    with contextlib.redirect_stdout(output):
+        controller.on_purchase([2335], "startup-1")
+    entry = controller.status.pending.get(("startup-1", None), {})
+    ok = check(entry.get("state") == FAILED and "worm" in entry.get("error", ""), f"order status {entry}") and ok
+    ok = check(controller.scheduler.idle(), "nothing reached the scheduler") and ok
+
+    print("\n3. A remote worm command...")
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        controller.on_worm({"slots": 1})
+    lines = [line for line in output.getvalue().splitlines() if "worm" in line.lower()]
+    ok = check(any(line.startswith("Ignoring worm command") for line in lines), f"logged {lines}") and ok
+
+    print("\n4. The rest of the hardware...")
+    ok = check(controller.hardware_error("elevator", "outputs") is None, "elevator and outputs usable") and ok
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nStartup test completed successfully!")
+        else:
+            print("\nStartup test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
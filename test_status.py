@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script for StatusPublisher coalescing, without a broker.
+
+- BUSY and IDLE in one flush go out as separate messages, IDLE last and
+  without BUSY's current_order
+- An order's message carries only the details of its latest state, plus
+  every state it passed through
+- The published counter matches the messages handed to the connection,
+  with flushes running on several threads
+"""
+
+import json
+import sys
+import threading
+
+from status import StatusPublisher, ACCEPTED, FAILED, BUSY, IDLE
+from testing import check
+
+
+class RecordingConnection:
+    """Stands in for ConnectionManager.publish and keeps every status message."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = []
+
+    def publish(self, topic, payload, qos=0):
+        with self.lock:
+            self.messages.append(json.loads(payload))
+
+
+def main():
+    """Main test function"""
+    print("Testing status coalescing")
+    ok = True
+
+    print("\n1. BUSY then IDLE in one flush...")
+    connection = RecordingConnection()
+    status = StatusPublisher("test", interval=60)
+    status.publish_fn = connection.publish  # flushed by hand, not by the thread
+    status.update(BUSY, current_order="o1")
+    status.update(IDLE)
+    status.flush()
+    states = [message["state"] for message in connection.messages]
+    ok = check(states == [BUSY, IDLE], f"published {states}") and ok
+    idle = connection.messages[-1]
+    ok = check("current_order" not in idle, f"IDLE message {idle}") and ok
+
+    print("\n2. BUSY, IDLE, BUSY in one flush...")
+    connection.messages.clear()
+    status.update(BUSY, current_order="o2")
+    status.update(IDLE)
+    status.update(BUSY, current_order="o3")
+    status.flush()
+    last = connection.messages[-1]
+    ok = check(last["state"] == BUSY and last["current_order"] == "o3", f"latest state published last: {last}") and ok
+
+    print("\n3. An order failing and then accepted again...")
+    connection.messages.clear()
+    status.update(FAILED, "o4", error="worm stalled", fault="worm_stalled")
+    status.update(ACCEPTED, "o4")
+    status.flush()
+    message = connection.messages[0]
+    ok = check(message["states"] == [FAILED, ACCEPTED], f"states {message['states']}") and ok
+    ok = check("error" not in message and "fault" not in message, f"no stale details: {message}") and ok
+
+    print("\n4. Published counter...")
+    connection.messages.clear()
+    status.published = 0
+
+    def report(thread):
+        for i in range(200):
+            status.update(ACCEPTED, f"t{thread}-{i}")
+            status.flush()
+
+    threads = [threading.Thread(target=report, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    status.flush()
+    published = status.metrics()["published"]
+    ok = check(published == len(connection.messages) == 1600,
+               f"{published} counted, {len(connection.messages)} published") and ok
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nStatus test completed successfully!")
+        else:
+            print("\nStatus test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
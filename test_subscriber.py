@@ -8,7 +8,7 @@ load_dotenv()
 
 # This function will be called when a purchase is made
 @ee.on("purchase")
-def on_purchase(instructions):
+def on_purchase(instructions, order_id=None):
     print(f"RECEIVED MESSAGE = {instructions}")
 
 
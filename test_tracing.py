@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script for spans started and ended apart, on a temporary trace buffer.
+
+- A span begun for an order is recorded once when it ends
+- Spans begun for orders without an id are not traced, so two anonymous
+  orders queued together cannot end each other's span
+- A cancelled span is not recorded
+"""
+
+import os
+import sys
+import tempfile
+
+from tracing import Tracer
+from testing import check
+
+
+def main():
+    """Main test function"""
+    print("Testing begin/end spans")
+    tracer = Tracer(os.path.join(tempfile.mkdtemp(), "trace.bin"))
+    ok = True
+
+    def spans():
+        return [(order_id, stage) for _, order_id, stage, _, _ in tracer.records()]
+
+    print("\n1. An order with an id...")
+    tracer.begin("queue_wait", "t-1")
+    tracer.end("queue_wait", "t-1")
+    tracer.end("queue_wait", "t-1")
+    ok = check(spans() == [("t-1", "queue_wait")], f"recorded once: {spans()}") and ok
+
+    print("\n2. Two orders without an id...")
+    tracer.begin("queue_wait")
+    tracer.begin("queue_wait")
+    tracer.end("queue_wait")
+    ok = check(tracer.open_spans == {} and spans() == [("t-1", "queue_wait")], "not traced") and ok
+
+    print("\n3. A cancelled span...")
+    tracer.begin("queue_wait", "t-2")
+    tracer.cancel("queue_wait", "t-2")
+    tracer.end("queue_wait", "t-2")
+    ok = check(spans() == [("t-1", "queue_wait")], f"not recorded: {spans()}") and ok
+
+    tracer.close()
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nTracing test completed successfully!")
+        else:
+            print("\nTracing test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test script for the worm's stall recovery against the simulator's worm model.
+
+- Jams the worm for good part way through a rotation: the rotation must fail
+  with WormStalled, its goal must move back to where the worm stopped, and
+  the next relative rotation must be refused rather than make up the counts
+- Clears the jam and sends the worm to a slot, which must realign it
+- Jams it with an encoder that chatters back and forth: still a stall
+- Jams it so that turning back frees it: the rotation must complete
+- A WormFault of no particular kind still has details to report
+
+Runs in real time; takes about 20 seconds.
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from config import machine_config
+from simulator import (VirtualClock, Machine, fake_modules, WORM_ENABLE_PIN, WORM_IN1_PIN,
+                       WORM_IN2_PIN, ENCODER_A_PIN, ENCODER_B_PIN)
+from testing import check
+
+SLOT = machine_config().worm.rotation_counts
+JAM_AT = 1000        # Count the worm jams at in the first slot
+TOLERANCE = 20       # Counts a completed rotation may end from its goal
+STALL_LIMIT = 15.0   # Seconds a stalled rotation may take to fail, retries included
+
+
+def rotate(worm, counts):
+    """Run worm.rotate_degrees(counts) quietly; returns (exception or None, seconds)."""
+    started = time.monotonic()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            worm.rotate_degrees(counts)
+    except Exception as e:
+        return e, time.monotonic() - started
+    return None, time.monotonic() - started
+
+
+def main():
+    """Main test function"""
+    print("Testing worm stall recovery against the simulated worm")
+
+    machine = Machine(VirtualClock(speedup=1.0))
+    sys.modules.update(fake_modules(machine))
+    from coast import CoastTable
+    from position import PositionStore
+    from worm import Worm, WormFault, WormStalled, WormNotAligned
+
+    # Keep the test's calibration and position out of the real files
+    state_dir = tempfile.mkdtemp()
+    store_path = os.path.join(state_dir, "worm_position.bin")
+    machine.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        worm = Worm(WORM_ENABLE_PIN, WORM_IN1_PIN, WORM_IN2_PIN, ENCODER_A_PIN, ENCODER_B_PIN,
+                    CoastTable(os.path.join(state_dir, "coast.db")), PositionStore(store_path))
+    ok = True
+
+    print("\n1. Worm jammed for good...")
+    machine.jam(JAM_AT)
+    error, seconds = rotate(worm, SLOT)
+    ok = check(isinstance(error, WormStalled), f"rotation failed with {error!r} after {seconds:.1f} s") and ok
+    ok = check(seconds < STALL_LIMIT, f"failed within {STALL_LIMIT:g} s") and ok
+    ok = check(worm.goal == worm.position, f"goal {worm.goal} moved back to the position {worm.position}") and ok
+    if isinstance(error, WormStalled):
+        details = error.details()
+        ok = check(details["fault"] == "worm_stalled" and details["goal"] == SLOT,
+                   f"error details {details}") and ok
+    stalled_at = worm.position
+    error, _ = rotate(worm, SLOT)
+    ok = check(isinstance(error, WormNotAligned), f"next rotation refused with {error!r}") and ok
+    ok = check(abs(worm.position - stalled_at) <= 1, f"worm did not move ({worm.position})") and ok
+    with contextlib.redirect_stdout(io.StringIO()):
+        reopened = PositionStore(store_path).load()
+    ok = check(reopened is not None and reopened[2] is False, f"stored as not aligned {reopened}") and ok
+
+    print("\n2. Jam cleared, worm sent to slot 1...")
+    machine.jam(None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        worm.move_to_slot(1)
+    ok = check(worm.aligned, "worm aligned again") and ok
+    ok = check(abs(worm.position - SLOT) <= TOLERANCE, f"at {worm.position}, slot 1 is {SLOT}") and ok
+    error, _ = rotate(worm, SLOT)
+    ok = check(error is None and abs(worm.position - 2 * SLOT) <= TOLERANCE,
+               f"next rotation turned one slot, to {worm.position}") and ok
+
+    print("\n3. Worm jammed with a chattering encoder...")
+    machine.jam(worm.position + JAM_AT, chatter=True)
+    error, seconds = rotate(worm, SLOT)
+    ok = check(isinstance(error, WormStalled), f"rotation failed with {error!r} after {seconds:.1f} s") and ok
+    ok = check(seconds < STALL_LIMIT, f"failed within {STALL_LIMIT:g} s") and ok
+
+    print("\n4. Worm jammed, freed by turning back...")
+    machine.jam(None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        worm.move_to_slot(round(worm.goal / SLOT) + 1)
+    start = worm.goal
+    machine.jam(start + JAM_AT, clears_on_reverse=True)
+    error, _ = rotate(worm, SLOT)
+    ok = check(error is None, f"rotation completed ({error!r})") and ok
+    ok = check(abs(worm.position - (start + SLOT)) <= TOLERANCE,
+               f"at {worm.position}, goal {start + SLOT}") and ok
+
+    machine.stop()
+
+    print("\n5. A plain worm fault...")
+    details = WormFault("encoder lost").details()
+    ok = check(details == {"fault": "worm_fault", "message": "encoder lost"}, f"details {details}") and ok
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        success = main()
+        if success:
+            print("\nWorm jam test completed successfully!")
+        else:
+            print("\nWorm jam test failed!")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        success = False
+    sys.exit(0 if success else 1)
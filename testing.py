@@ -0,0 +1,48 @@
+"""
+Helpers shared by the test_*.py scripts.
+
+Each script still runs on its own with python; this module holds the check
+printer, the stand-in for the dispatcher and the temporary state they would
+otherwise each repeat.
+"""
+
+import os
+import tempfile
+
+
+def check(ok, message):
+    """Print one check as ok or FAIL. Returns ok, for ok = check(...) and ok."""
+    print(f"  {'ok  ' if ok else 'FAIL'} {message}")
+    return ok
+
+
+class RecordingEmitter:
+    """Stands in for the dispatcher and records what the handlers emit."""
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, *args):
+        self.events.append((event,) + args)
+        return True
+
+
+def isolate_subscriber():
+    """
+    Point the subscriber's dedup index, inventory and tracer at a new
+    temporary directory, so a test's order ids, stock and traces stay out of
+    the real files.
+
+    Returns:
+        str: The temporary directory.
+    """
+    import subscriber
+    from dedup import DedupIndex
+    from inventory import Inventory
+    from tracing import Tracer
+
+    state_dir = tempfile.mkdtemp()
+    subscriber.dedup = DedupIndex(os.path.join(state_dir, "orders.db"))
+    subscriber.inventory = Inventory(subscriber.DEVICE_ID, os.path.join(state_dir, "inventory.db"))
+    subscriber.tracer = Tracer(os.path.join(state_dir, "trace.bin"))
+    return state_dir
@@ -0,0 +1,136 @@
+"""
+Hashed timer wheel.
+
+Timed remote commands ("pump on for 30 s") need to do something later. A
+sleeping thread per command would cost a thread, and its stack, for every
+command in flight; the wheel runs every timer on one thread instead.
+
+Timers are kept in a ring of slots, one per tick, hashed by the tick they
+are due on, so scheduling and cancelling are O(1) and each tick only looks
+at one slot. Timers further out than one turn of the ring share a slot with
+nearer ones and are skipped until their turn comes. The thread sleeps while
+no timer is pending.
+"""
+
+import math
+import threading
+import time
+
+DEFAULT_TICK = 0.1  # Seconds; timers fire up to one tick late, never early
+DEFAULT_SLOTS = 512  # Ticks per turn of the wheel
+
+
+class Timer:
+    def __init__(self, due_tick, callback, args):
+        self.due_tick = due_tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.fired = False
+
+
+class TimerWheel:
+    """
+    Runs callbacks after a delay, all on one thread.
+    """
+
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS):
+        """
+        Args:
+            tick (float): Resolution in seconds.
+            slots (int): Slots in the ring.
+        """
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.condition = threading.Condition()
+        self.started_at = time.monotonic()
+        self.current_tick = 0  # last tick processed
+        self.pending = 0
+        self.thread = None
+
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+        self.max_pending = 0
+
+    def _now_tick(self):
+        return int((time.monotonic() - self.started_at) / self.tick)
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call callback(*args) on the wheel's thread after delay seconds.
+
+        Callbacks must be quick; a slow one delays every timer behind it.
+
+        Returns:
+            Timer: Handle for TimerWheel.cancel().
+        """
+        with self.condition:
+            now_tick = self._now_tick()
+            if not self.pending:
+                # Nothing to catch up on after an idle spell
+                self.current_tick = now_tick
+            timer = Timer(now_tick + max(1, math.ceil(delay / self.tick)), callback, args)
+            self.slots[timer.due_tick % len(self.slots)].append(timer)
+            self.pending += 1
+            self.scheduled += 1
+            self.max_pending = max(self.max_pending, self.pending)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="timer-wheel", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return timer
+
+    def cancel(self, timer):
+        """Cancel a timer. Cancelling one that fired or was cancelled does nothing."""
+        with self.condition:
+            if not timer.cancelled and not timer.fired:
+                timer.cancelled = True
+                self.pending -= 1
+                self.cancelled += 1
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                wait = self.started_at + (self.current_tick + 1) * self.tick - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                self.current_tick += 1
+                slot = self.slots[self.current_tick % len(self.slots)]
+                due = []
+                keep = []
+                for timer in slot:
+                    if timer.cancelled:
+                        continue
+                    if timer.due_tick <= self.current_tick:
+                        timer.fired = True
+                        due.append(timer)
+                    else:
+                        keep.append(timer)
+                slot[:] = keep
+                self.pending -= len(due)
+                self.fired += len(due)
+
+            for timer in due:
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    print(f"Error in timer callback {timer.callback}: {e}")
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Timers pending, scheduled, fired and cancelled, and the most
+                  pending at once.
+        """
+        with self.condition:
+            return {
+                'pending': self.pending,
+                'scheduled': self.scheduled,
+                'fired': self.fired,
+                'cancelled': self.cancelled,
+                'max_pending': self.max_pending,
+            }
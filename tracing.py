@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Per-stage purchase tracing.
+
+Spans (order id, stage, start, duration) are timed with the monotonic clock
+and written as fixed-size binary records into a ring buffer file mapped into
+memory, so tracing costs a few microseconds per span and the file never
+grows. The newest records overwrite the oldest. Records reach the disk when
+the OS writes the mapped pages back, so they survive the process crashing
+but not necessarily a power cut.
+
+Run this module to summarise the buffer: p50/p95 seconds per stage across
+the last N orders, largest first.
+
+Usage: python tracing.py [--orders 50] [--path trace.bin]
+"""
+
+import argparse
+import contextlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TRACE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trace.bin")
+DEFAULT_CAPACITY = 4096  # Records kept; 64 bytes each
+
+MAGIC = b"DFTR"
+VERSION = 1
+HEADER = struct.Struct("<4sIIQ")        # magic, version, capacity, next sequence number
+RECORD = struct.Struct("<Q24s16sqq")    # sequence (0 = empty), order id, stage, start ns, duration ns
+
+
+class Tracer:
+    """
+    Writes spans into a ring buffer file.
+    """
+
+    def __init__(self, path=DEFAULT_TRACE_PATH, capacity=DEFAULT_CAPACITY, enabled=True):
+        """
+        Args:
+            path (str): Ring buffer file. Created or resized on first use.
+            capacity (int): Number of records the buffer holds.
+            enabled (bool): False turns every call into a no-op.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.file = None
+        self.map = None
+        self.sequence = 0
+        self.open_spans = {}  # (stage, order id) -> start ns, see begin(); never for a None order id
+
+    def _open(self):
+        """Map the buffer file, starting a new one if it is missing or a different size."""
+        size = HEADER.size + self.capacity * RECORD.size
+        self.file = open(self.path, "a+b")
+        self.file.seek(0)
+        header = self.file.read(HEADER.size)
+        valid = False
+        if len(header) == HEADER.size:
+            magic, version, capacity, sequence = HEADER.unpack(header)
+            valid = magic == MAGIC and version == VERSION and capacity == self.capacity
+        if not valid or os.path.getsize(self.path) != size:
+            self.file.truncate(0)
+            self.file.truncate(size)
+            sequence = 0
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.map[:HEADER.size] = HEADER.pack(MAGIC, VERSION, self.capacity, sequence)
+        self.sequence = sequence
+
+    def record(self, stage, order_id=None, start_ns=None, end_ns=None):
+        """
+        Write one span.
+
+        Args:
+            stage (str): Stage name, at most 16 bytes are kept.
+            order_id (str): Order the span belongs to, at most 24 bytes are kept.
+            start_ns (int): time.monotonic_ns() at the start.
+            end_ns (int): time.monotonic_ns() at the end, default now.
+        """
+        if not self.enabled:
+            return
+        end_ns = time.monotonic_ns() if end_ns is None else end_ns
+        start_ns = end_ns if start_ns is None else start_ns
+        order = b"" if order_id is None else str(order_id).encode("utf-8")[:24]
+        with self.lock:
+            try:
+                if self.map is None:
+                    self._open()
+                self.sequence += 1
+                offset = HEADER.size + (self.sequence - 1) % self.capacity * RECORD.size
+                self.map[offset:offset + RECORD.size] = RECORD.pack(
+                    self.sequence, order, stage.encode("utf-8")[:16], start_ns, end_ns - start_ns)
+                self.map[:HEADER.size] = HEADER.pack(MAGIC, VERSION, self.capacity, self.sequence)
+            except (OSError, ValueError) as e:
+                print(f"Tracing disabled, cannot write {self.path}: {e}")
+                self.enabled = False
+
+    @contextlib.contextmanager
+    def span(self, stage, order_id=None):
+        """Time the body of a with block as one span."""
+        start_ns = time.monotonic_ns()
+        try:
+            yield
+        finally:
+            self.record(stage, order_id, start_ns)
+
+    def begin(self, stage, order_id=None):
+        """
+        Start a span that is ended elsewhere, e.g. on another thread, by end().
+
+        Orders without an id are not traced this way: their spans could not
+        be told apart, so one order's end() would close another's span.
+        """
+        if self.enabled and order_id is not None:
+            with self.lock:
+                self.open_spans[(stage, order_id)] = time.monotonic_ns()
+
+    def end(self, stage, order_id=None):
+        """End a span started with begin(). Does nothing if it was never started."""
+        if not self.enabled:
+            return
+        with self.lock:
+            start_ns = self.open_spans.pop((stage, order_id), None)
+        if start_ns is not None:
+            self.record(stage, order_id, start_ns)
+
+    def cancel(self, stage, order_id=None):
+        """Forget a span started with begin() without recording it."""
+        with self.lock:
+            self.open_spans.pop((stage, order_id), None)
+
+    def records(self):
+        """
+        Read every record in the buffer, oldest first.
+
+        Returns:
+            list: (sequence, order id, stage, start ns, duration ns) tuples.
+        """
+        with self.lock:
+            if self.map is None:
+                if not os.path.exists(self.path):
+                    return []
+                self._open()
+            data = self.map[HEADER.size:]
+        records = []
+        for offset in range(0, len(data), RECORD.size):
+            sequence, order, stage, start_ns, duration_ns = RECORD.unpack_from(data, offset)
+            if sequence:
+                records.append((sequence, order.rstrip(b"\0").decode("utf-8", "replace") or None,
+                                stage.rstrip(b"\0").decode("utf-8", "replace"), start_ns, duration_ns))
+        records.sort()
+        return records
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.file.close()
+                self.map = None
+                self.file = None
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarise(records, orders=50):
+    """
+    Per-stage statistics across the most recent orders.
+
+    Spans of the same stage within one order (e.g. one per worm rotation)
+    are added up first, so each order counts once per stage.
+
+    Args:
+        records (list): Records from Tracer.records().
+        orders (int): Number of most recent orders to include.
+
+    Returns:
+        list: (stage, orders, p50 seconds, p95 seconds) tuples, largest p50 first.
+    """
+    per_order = OrderedDict()  # order id -> stage -> seconds, oldest first
+    for _, order_id, stage, _, duration_ns in records:
+        if order_id is None:
+            continue
+        stages = per_order.pop(order_id, {})
+        stages[stage] = stages.get(stage, 0.0) + duration_ns / 1e9
+        per_order[order_id] = stages
+
+    by_stage = {}
+    for stages in list(per_order.values())[-orders:]:
+        for stage, seconds in stages.items():
+            by_stage.setdefault(stage, []).append(seconds)
+
+    rows = [(stage, len(values), percentile(values, 0.50), percentile(values, 0.95))
+            for stage, values in by_stage.items()]
+    rows.sort(key=lambda row: -row[2])
+    return rows
+
+
+# Shared by the subscriber, main and elevator so all spans land in one buffer
+tracer = Tracer(enabled=os.getenv("TRACE", "1") != "0")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--orders", type=int, default=50, help="summarise the last N orders")
+    parser.add_argument("--path", default=DEFAULT_TRACE_PATH, help="trace buffer file")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"No trace buffer at {args.path}")
+        return
+    rows = summarise(Tracer(args.path, capacity=_capacity_of(args.path)).records(), args.orders)
+    print(f"{'stage':<16} {'orders':>7} {'p50 s':>9} {'p95 s':>9}")
+    for stage, count, p50, p95 in rows:
+        print(f"{stage:<16} {count:>7} {p50:>9.3f} {p95:>9.3f}")
+
+
+def _capacity_of(path):
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) == HEADER.size and header[:4] == MAGIC:
+        return HEADER.unpack(header)[2]
+    return DEFAULT_CAPACITY
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,56 @@
-import rotary_encoder as rotary_encoder
-import pigpio
-import RPi.GPIO as GPIO
+import RPi.GPIO as GPIO  # Every hardware module needs it; importing it touches no pins, setmode()/setup() do
+import threading
 import time
-import keyboard
+from coast import CoastTable
+from config import machine_config
+from motion import PID, TrapezoidProfile
+from position import PositionStore
+
+SETTLE_TIMEOUT = 1.0 # Longest wait in seconds for the worm to coast to rest after a rotation
+
+class WormFault(RuntimeError):
+    """Base of the worm failures reported with structured details."""
+
+    def details(self):
+        """Fields for a status update about the failure; subclasses add their own."""
+        return {'fault': 'worm_fault', 'message': str(self)}
+
+
+class WormStalled(WormFault):
+    """Raised when the worm stops turning and jiggling it back and forth did not free it."""
+
+    def __init__(self, position, goal, attempts):
+        super().__init__(f"worm stalled at {position}, {goal - position:g} counts short of {goal:g} "
+                         f"after {attempts} attempts")
+        self.position = position
+        self.goal = goal
+        self.attempts = attempts
+
+    def details(self):
+        return {**super().details(), 'fault': 'worm_stalled', 'position': self.position, 'goal': self.goal,
+                'remaining': self.goal - self.position, 'attempts': self.attempts}
+
+
+class WormNotAligned(WormFault):
+    """Raised for a relative rotation after a stall, until the worm is sent to a slot or homed."""
+
+    def __init__(self, position):
+        super().__init__(f"worm at {position} is not aligned with its slots since it stalled; "
+                         f"send it to a slot or home it")
+        self.position = position
+
+    def details(self):
+        return {**super().details(), 'fault': 'worm_not_aligned', 'position': self.position}
+
 
 class Worm:
-    def __init__(self, enable_pin, in1_pin, in2_pin, encoder_a_pin, encoder_b_pin):
+    def __init__(self, enable_pin, in1_pin, in2_pin, encoder_a_pin, encoder_b_pin, coast=None, store=None):
         """
         Simplified L298N motor controller with basic encoder counting
+
+        coast is the CoastTable the coast compensation learns into, default
+        the one in coast.db. store is the PositionStore the absolute position
+        is kept in, default the one in worm_position.bin.
         """
         # Pin setup
         self.enable_pin = enable_pin
@@ -18,7 +61,26 @@ class Worm:
         
         # Encoder tracking
         self.encoder_position = 0 # The current position of the encoder - default to zero at program start.
-        self.encoder_old_position = 0 # The previous position of the encoder - used to skip writing to the console
+        self.stop_at = None # Count at which the encoder callback cuts the power, None while no rotation is running
+        self.target_reached = threading.Event() # Set once the power has been cut
+        self.lock = threading.Lock() # Keeps the speed controller from restarting a motor the callback just stopped
+        self.velocity = 0.0 # Last measured speed, counts per second
+        self.stop_position = 0 # Count and speed the power was last cut at
+        self.stop_velocity = 0.0
+        self.progress = 0 # Furthest count of the current rotation, for the stall watchdog
+        self.last_count_at = 0.0 # time.monotonic() the furthest count was reached
+        self.coast = coast or CoastTable()
+
+        # Absolute position, in counts from slot 0, the position the last command
+        # asked for, and whether the worm is aligned with its slots
+        self.store = store or PositionStore()
+        stored = self.store.load()
+        if stored is None:
+            print("Worm position unknown, taking the current position as slot 0")
+            stored = (0, 0, True)
+        self.position, self.goal, self.aligned = stored
+        if not self.aligned:
+            print(f"Worm not aligned since it stalled at {self.position}; send it to a slot or home it")
         
         # Configure GPIO
         GPIO.setmode(GPIO.BCM)
@@ -28,16 +90,19 @@ class Worm:
         GPIO.setup(self.encoder_a_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
         
         # PWM setup
-        self.pwm = GPIO.PWM(self.enable_pin, 1000)
+        self.pwm = GPIO.PWM(self.enable_pin, machine_config().worm.pwm_frequency)
         self.pwm.start(0)
         
+        # Imported here so importing this module does not need the pigpio library
+        import pigpio
+        import rotary_encoder
+
         self.pi = pigpio.pi() # Defines the specfic Raspberry Pi we are polling for information - defaults to the local device.
         self.decoder = rotary_encoder.decoder(self.pi, self.encoder_a_pin, self.encoder_b_pin, lambda way: self.callback(way)) # Creates an object that automatically fires
 
     def reset_encoder(self):
         """Reset the encoder counter"""
         self.encoder_position = 0
-        self.encoder_old_position = 0
 
     def set_direction(self, ccw=True):
         """Set rotation direction (CCW by default)"""
@@ -53,27 +118,195 @@ class Worm:
         speed = max(0, min(100, speed))
         self.pwm.ChangeDutyCycle(speed)
 
-    def rotate_degrees(self, target, speed=60):
-        
+    def rotate_degrees(self, target, speed=None):
+        """
+        Turn the worm target encoder counts CCW on from the last goal.
+
+        The distance is counted from where the last command asked the worm
+        to be, not from where it came to rest, so overshoot and rounding do
+        not add up from one rotation to the next.
+
+        If the worm stops turning, it is jiggled back and tried again, up
+        to the configured worm.stall_retries times.
+
+        Raises:
+            WormStalled: If it still does not turn. The goal is moved back to
+                         where the worm stopped, so no later command makes up
+                         the missing counts, and the worm is no longer aligned.
+            WormNotAligned: If the worm stalled before and has not been sent
+                            to a slot or homed since.
+        """
+        if not self.aligned:
+            raise WormNotAligned(self.position)
+        self._move(self.goal + target, speed)
+
+    def _move(self, goal, speed=None):
+        self.goal = goal
+        self.store.store(self.position, self.goal)
+        retries = machine_config().worm.stall_retries
+        for attempt in range(retries + 1):
+            if attempt:
+                print(f"Worm stalled at {self.position}, jiggling it free (retry {attempt} of {retries})")
+                self._jiggle()
+            if self._turn(self.goal - self.position, speed):
+                return
+        error = WormStalled(self.position, goal, retries + 1)
+        self.goal = self.position
+        self.aligned = False
+        self.store.store(self.position, self.goal, aligned=False)
+        self.store.flush()
+        raise error
+
+    def move_to(self, position, speed=None):
+        """
+        Turn the worm CCW to an absolute position.
+
+        Getting there realigns a worm that stalled, as the encoder counted
+        every move it made.
+
+        Raises:
+            ValueError: If the position is behind the last goal; the worm only
+                        turns CCW.
+            WormStalled: As rotate_degrees().
+        """
+        if position < self.goal:
+            raise ValueError(f"position {position} is behind the worm's position {self.goal}")
+        self._move(position, speed)
+        if not self.aligned:
+            self.aligned = True
+            self.store.store(self.position, aligned=True)
+            print(f"Worm aligned again at {position}")
+
+    def slot_position(self, slot):
+        """Absolute position of a slot, in encoder counts."""
+        return slot * machine_config().worm.rotation_counts
+
+    def move_to_slot(self, slot, speed=None):
+        """Turn the worm CCW to a slot, counted from slot 0."""
+        self.move_to(self.slot_position(slot), speed)
+
+    def set_home(self, slot=0):
+        """Take the worm's current position as a slot, after aligning it by hand."""
+        self.position = self.goal = self.slot_position(slot)
+        self.aligned = True
+        self.store.store(self.position, self.goal, aligned=True)
+        self.store.flush()
+
+    def _turn(self, target, speed=None):
+        """
+        Turn the worm target encoder counts CCW from where it is.
+
+        The speed follows a trapezoidal profile from the configured worm
+        settings, held by a PID on the speed measured from the encoder every
+        control_period, with the duty cycle limited to speed or the
+        configured worm.speed. The encoder callback cuts the power as soon as
+        the count comes within the coast distance predicted for the current
+        speed of the target, so the stop does not wait for this thread to be
+        scheduled. Once the worm is at rest the distance it actually coasted
+        is added to the coast calibration.
+
+        A watchdog stops the motor if the count does not get past its
+        furthest point so far for stall_window seconds, so an encoder
+        chattering back and forth on a jammed worm does not count as
+        progress.
+
+        Returns:
+            bool: True if the worm got there, False if it stalled.
+        """
+        config = machine_config().worm
+        if speed is None:
+            speed = config.speed
         self.reset_encoder()
+        if target <= 0:
+            return True
+        profile = TrapezoidProfile(config.cruise_velocity, config.acceleration, config.creep_velocity)
+        pid = PID(config.kp, config.ki, config.kd, 0, speed)
+        self.velocity = 0.0
+        self.target_reached.clear()
+        self.stop_at = target # Armed before the motor starts so no count is missed
         self.set_direction(ccw=True)
-        self.set_speed(speed)
-        
-        while (self.encoder_position < target): # Only prints the position of the encoder if a change has been made, refreshing every millisecond.
-            # Helps reduce lag when moving a high resolution encoder extremely quickly.
-            # Interstingly, the system didn't lose counts for me, but it did take an inordinate amount of time
-            # to catch up when wiriting to the console.       
-            if self.encoder_position != self.encoder_old_position:
-                print("pos = {}".format(self.encoder_position))
-                self.encoder_old_position = self.encoder_position
-                time.sleep(0.001)
-            
+
+        self.progress = 0
+        started = last_time = self.last_count_at = time.monotonic()
+        last_position = 0
+        stalled = False
+        while True:
+            now = time.monotonic()
+            position = self.encoder_position
+            if now - self.last_count_at > config.stall_window:
+                with self.lock:
+                    if self.stop_at is not None:
+                        self._stop()
+                        stalled = True
+                break
+            if now > last_time:
+                self.velocity = (position - last_position) / (now - last_time)
+            setpoint = profile.velocity(now - started, target - position)
+            duty = pid.update(setpoint, self.velocity, now - last_time,
+                              feedforward=100.0 * setpoint / config.full_duty_velocity)
+            last_position, last_time = position, now
+            with self.lock:
+                if self.stop_at is None:
+                    break
+                self.stop_at = target - self.coast.predict(self.velocity)
+                if position >= self.stop_at:
+                    self._stop()
+                    break
+                self.set_speed(duty)
+            if self.target_reached.wait(config.control_period):
+                break
+
+        if stalled:
+            return False
+
+        # Wait for the worm to come to rest to see how far it coasted
+        position = self.encoder_position
+        deadline = time.monotonic() + SETTLE_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(config.control_period)
+            if self.encoder_position == position:
+                break
+            position = self.encoder_position
+        coast = position - self.stop_position
+        self.coast.record(self.stop_velocity, coast)
+        print("pos = {} ({:+g} from target, coasted {} counts from {:.0f} counts/s), at {}".format(
+            position, position - target, coast, self.stop_velocity, self.position))
+        return True
+
+    def _jiggle(self):
+        # Turn back a little and let the worm stop, to free whatever jammed it
+        config = machine_config().worm
+        self.set_direction(ccw=False)
+        self.set_speed(config.jiggle_duty)
+        time.sleep(config.jiggle_time)
+        self.set_speed(0)
+        time.sleep(config.jiggle_time)
+        self.set_direction(ccw=True)
+
+    def _stop(self):
+        # Called with the lock held
+        self.stop_at = None
         self.set_speed(0)  # Stop motor
+        self.stop_position = self.encoder_position
+        self.stop_velocity = self.velocity
+        self.target_reached.set()
 
     def cleanup(self):
         """Clean up resources"""
         self.pwm.stop()
+        self.store.close()
         GPIO.cleanup()
         
     def callback(self, way): # Updates the position with the direction the encoder was turned.
         self.encoder_position += way
+        self.position += way
+        # Runs on the pigpio callback thread for every count, so kept short
+        self.store.store(self.position)
+        if self.encoder_position > self.progress:
+            self.progress = self.encoder_position
+            self.last_count_at = time.monotonic()
+        stop_at = self.stop_at
+        if stop_at is not None and self.encoder_position >= stop_at:
+            with self.lock:
+                if self.stop_at is not None:
+                    self._stop()